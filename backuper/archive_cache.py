@@ -0,0 +1,131 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from backuper.catalog import file_manifest_path
+from backuper.defs import archives_dir
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+class ArchiveCache:
+    """
+    Ограниченный по объёму кэш загруженных архивов в archives_dir.
+    В кэш попадают только архивы, которые уже лежат на диске, поэтому вытеснение
+    не трогает архивы из очереди на загрузку. При превышении объёма удаляются
+    архивы, которые дольше всего не использовались
+    """
+
+    def __init__(self, db_path: str = ":memory:", directory: Path = archives_dir):
+        self.directory = Path(directory)
+        self.connection = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS archives ("
+            "name TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS archives_last_used ON archives (last_used)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS settings ("
+            "key TEXT PRIMARY KEY, "
+            "value INTEGER NOT NULL)"
+        )
+        self.connection.commit()
+
+    @property
+    def max_bytes(self) -> int:
+        """
+        :return: допустимый объём кэша в байтах
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT value FROM settings WHERE key = 'max_bytes'").fetchone()
+        return row[0] if row else DEFAULT_CACHE_SIZE
+
+    @max_bytes.setter
+    def max_bytes(self, value: int) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('max_bytes', ?)", (value,))
+
+    def add(self, archive_path) -> None:
+        """
+        Добавляет загруженный архив в кэш
+        :param archive_path: путь до архива в archives_dir
+        """
+        name = os.path.basename(archive_path)
+        try:
+            size = sum(os.path.getsize(path) for path in self._paths(name) if os.path.isfile(path))
+        except OSError:
+            return
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO archives (name, size, last_used) VALUES (?, ?, ?)", (name, size, time.time())
+            )
+
+    def get(self, name: str) -> Optional[Path]:
+        """
+        Возвращает путь до архива из кэша и отмечает, что архив использовался
+        :param name: имя архива
+        :return: путь до архива или None, если его нет в кэше
+        """
+        path = self.directory / name
+        with self._lock, self.connection:
+            if self.connection.execute("SELECT 1 FROM archives WHERE name = ?", (name,)).fetchone() is None:
+                return None
+            if not path.is_file():
+                self.connection.execute("DELETE FROM archives WHERE name = ?", (name,))
+                return None
+            self.connection.execute("UPDATE archives SET last_used = ? WHERE name = ?", (time.time(), name))
+        return path
+
+    def remove(self, name: str) -> None:
+        """
+        Удаляет архив и его список файлов из кэша
+        :param name: имя архива
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM archives WHERE name = ?", (name,))
+        for path in self._paths(name):
+            Path(path).unlink(missing_ok=True)
+
+    def evict(self) -> list[str]:
+        """
+        Удаляет давно не использованные архивы, пока объём кэша превышает допустимый
+        :return: имена удалённых архивов
+        """
+        max_bytes = self.max_bytes
+        with self._lock:
+            rows = self.connection.execute("SELECT name, size FROM archives ORDER BY last_used").fetchall()
+        total = sum(size for _, size in rows)
+
+        evicted = []
+        for name, size in rows:
+            if total <= max_bytes:
+                break
+            self.remove(name)
+            total -= size
+            evicted.append(name)
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} archives from the local cache")
+        return evicted
+
+    def usage(self) -> tuple[int, int]:
+        """
+        :return: (количество архивов, объём в байтах) в кэше
+        """
+        with self._lock:
+            count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM archives").fetchone()
+        return count, size
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _paths(self, name: str) -> tuple[str, str]:
+        archive_path = self.directory / name
+        return str(archive_path), file_manifest_path(archive_path)
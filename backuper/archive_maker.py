@@ -1,35 +1,318 @@
+import logging
 import os
-import datetime
+import time
+from pathlib import Path
+from typing import Callable, Collection, Iterable, Iterator, NamedTuple, Optional
 
-from backuper.utils import filter_files_by_time, make_archive
+from backuper.catalog import FileManifestWriter, file_manifest_path
+from backuper.compression import CodecSelector, DeflateCodec
+from backuper.defs import archives_dir
+from backuper.file_index import FileIndex
+from backuper.file_list import FileList
+from backuper.hash_cache import DEFAULT_HASH_LIMIT, HashCache
+from backuper.parallel_zip import write_parallel_archive
+from backuper.pipeline import (
+    DEFAULT_READ_AHEAD, SCAN_BATCH_SIZE, SCAN_QUEUE_SIZE, Prefetcher, VolumeSplitter, batched
+)
+from backuper.scanner import FileStat, scan_path, stat_paths
+from backuper.stream import stream_to_disk
+from backuper.utils import make_archive_name, numbered_archive_name, write_archive
+from backuper.watcher import InotifyWatcher
+
+RECONCILE_INTERVAL = 6 * 60 * 60
+
+
+class ArchiveStats(NamedTuple):
+    """
+    Метрики последней сборки архива
+    """
+    scan_seconds: float = 0.0
+    scanned_files: int = 0
+    changed_files: int = 0
+    raw_bytes: int = 0
+    compressed_bytes: int = 0
+    compression_seconds: float = 0.0
 
 
 class ArchiveMaker:
-    def __init__(self, path):
+    """
+    Собирает архивы изменённых файлов конвейером: сканирование идёт в отдельном потоке, и сжатие
+    начинается с первых найденных файлов. С ограничением volume_size изменения делятся на тома —
+    обычные архивы, каждый из которых восстанавливается сам по себе. Собранный том сразу отдаётся
+    на загрузку, пока сжимается следующий, а ошибка загрузки затрагивает только один том.
+    С кэшем хешей файл, у которого изменилось только время изменения или inode, перечитывается
+    и пропускается, если его содержимое совпадает с сохранённым. Файлы больше hash_limit
+    не перечитываются, 0 — не перечитывать файлы, None — перечитывать файлы любого размера
+    """
+
+    def __init__(
+            self, path, file_index: Optional[FileIndex] = None,
+            workers: int = 1, codec_selector: Optional[CodecSelector] = None,
+            watcher: Optional[InotifyWatcher] = None, reconcile_interval: float = RECONCILE_INTERVAL,
+            volume_size: Optional[int] = None, read_ahead: int = DEFAULT_READ_AHEAD,
+            hash_cache: Optional[HashCache] = None, hash_limit: Optional[int] = DEFAULT_HASH_LIMIT
+    ):
         self.path = path
-        self.backuped_files = set()
-        self.last_backup_time = 0
-
-    def get_files_from_path(self):
-        files_in_path = set()
-        for root, dirs, files in os.walk(self.path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if os.path.getmtime(file_path) > self.last_backup_time:
-                    files_in_path.add(file_path)
-        return files_in_path
-
-    def make_fresh_archive(self):
-        files_in_path = self.get_files_from_path()
-        new_files = files_in_path - self.backuped_files
-        updated_files = filter_files_by_time(files_in_path, self.last_backup_time)
-        files_to_archive = updated_files | new_files
-
-        if not files_to_archive:
-            return None
-
-        self.backuped_files |= files_to_archive
-        archive_path = make_archive(self.path, files_to_archive)
-        self.last_backup_time = datetime.datetime.now().timestamp()
+        self.file_index = file_index if file_index is not None else FileIndex()
+        self.workers = workers
+        self.codec_selector = codec_selector if codec_selector is not None else CodecSelector(DeflateCodec())
+        self.watcher = watcher
+        self.reconcile_interval = reconcile_interval
+        self.volume_size = volume_size
+        self.read_ahead = read_ahead
+        self.hash_cache = hash_cache
+        self.hash_limit = hash_limit
+        self.last_stats = ArchiveStats()
+        self._last_full_scan = None
+
+    def get_files_from_path(self) -> FileList:
+        """
+        :return: записи об изменённых файлах
+        """
+        return FileList(self.iter_changed_files())
+
+    def iter_changed_files(self) -> Iterator[FileStat]:
+        """
+        Находит новые и изменённые файлы. С наблюдателем проверяются только пути, о которых сообщил inotify,
+        а вся директория сканируется при первом запуске, после переполнения очереди событий
+        и раз в reconcile_interval секунд. Когда обход закончен, записываются метрики сканирования,
+        а из индекса удаляются файлы, которых больше нет
+        :return: итератор по записям об изменённых файлах
+        """
+        started = time.monotonic()
+        entries = None
+        dirty = ()
+        if self.watcher is not None:
+            dirty, overflowed = self.watcher.drain()
+            if (not overflowed and self._last_full_scan is not None
+                    and started - self._last_full_scan < self.reconcile_interval):
+                entries = stat_paths(sorted(dirty))
+            else:
+                self._last_full_scan = started
+        full_scan = entries is None
+        if full_scan:
+            entries = scan_path(self.path)
+            self.file_index.begin_scan()
+            if self.hash_cache is not None:
+                self.hash_cache.begin_scan()
+
+        scanned = changed = raw_bytes = 0
+        touched = []
+        seen = []
+        for entry in entries:
+            scanned += 1
+            if full_scan:
+                seen.append(entry)
+                if len(seen) >= SCAN_BATCH_SIZE:
+                    self._mark_seen(seen)
+                    seen = []
+            if not self.file_index.is_changed(entry):
+                continue
+            if self._same_content(entry):
+                touched.append(entry)
+                if len(touched) >= SCAN_BATCH_SIZE:
+                    self.file_index.touch(touched)
+                    touched = []
+                continue
+            changed += 1
+            raw_bytes += entry.size
+            yield entry
+        self.file_index.touch(touched)
+        if full_scan:
+            self._mark_seen(seen)
+            removed = self.file_index.remove_unseen()
+            if self.hash_cache is not None:
+                self.hash_cache.remove_unseen()
+        else:
+            removed = self.file_index.remove_trees(
+                path for path in dirty if not os.path.isfile(path) and not os.path.isdir(path)
+            )
+        if removed:
+            logging.info(f"Forgot {removed} deleted files in {self.path}")
+        self.last_stats = ArchiveStats(time.monotonic() - started, scanned, changed, raw_bytes)
+
+    def write_archive(
+            self, target, archive_name: str, files: Iterable[FileStat],
+            on_hashed: Optional[Callable[[FileStat, str], None]] = None
+    ) -> None:
+        """
+        Пишет архив с переданными файлами
+        :param target: путь до архива или файловый объект
+        :param archive_name: имя архива на диске
+        :param files: записи о файлах для архивации
+        :param on_hashed: вызывается с sha256 каждого файла, посчитанным в том же проходе, что и сжатие
+        """
+        if self.workers > 1:
+            write_parallel_archive(
+                target, self.path, files, self.workers, self.codec_selector, self.read_ahead, on_hashed
+            )
+        else:
+            write_archive(target, self.path, files, self.codec_selector, on_hashed)
+
+    def make_fresh_archive(self, on_volume: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        Собирает архив изменённых файлов и ставит его в очередь на загрузку в индексе
+        :param on_volume: вызывается с путём каждого собранного тома, кроме последнего, до сжатия следующего
+        :return: путь до архива или его последнего тома, None, если изменений нет
+        """
+        archive_path = None
+        compressed_bytes = 0
+        started = time.monotonic()
+        with self._scan() as files:
+            volumes = VolumeSplitter(files, self.volume_size)
+            while volumes:
+                if archive_path is not None and on_volume is not None:
+                    on_volume(str(archive_path))
+                archive_path = self._new_archive_path()
+                manifest_path = file_manifest_path(archive_path)
+                try:
+                    with FileManifestWriter(manifest_path, self.path) as manifest:
+                        self.write_archive(archive_path, archive_path.name, volumes.volume(), self._hashed(manifest))
+                    compressed_bytes += os.path.getsize(archive_path)
+                except BaseException:
+                    Path(manifest_path).unlink(missing_ok=True)
+                    self._return_to_watcher(volumes.remaining())
+                    raise
+                finally:
+                    self._record_compression(compressed_bytes, started)
+                self.file_index.enqueue(str(archive_path), volumes.written)
+
+        return None if archive_path is None else str(archive_path)
+
+    def stream_fresh_archive(self, disk, on_volume: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        Собирает архив изменённых файлов и загружает его на диск по мере сжатия, не сохраняя локально.
+        Рядом с архивом на диск загружается список его файлов, локальная копия списка остаётся в archives_dir
+        :param disk: диск для загрузки
+        :param on_volume: вызывается с именем каждого загруженного тома, кроме последнего
+        :return: имя загруженного архива или его последнего тома, None, если изменений нет
+        """
+        archive_names = []
+        compressed_bytes = 0
+        started = time.monotonic()
+        with self._scan() as files:
+            volumes = VolumeSplitter(files, self.volume_size)
+            while volumes:
+                if archive_names and on_volume is not None:
+                    on_volume(archive_names[-1])
+                archive_name = self._new_archive_path(archive_names).name
+                manifest_path = file_manifest_path(archives_dir / archive_name)
+                volume = volumes.volume()
+                try:
+                    with FileManifestWriter(manifest_path, self.path) as manifest:
+                        compressed_bytes += stream_to_disk(disk, archive_name, lambda fileobj: self.write_archive(
+                            fileobj, archive_name, volume, self._hashed(manifest)
+                        ))
+                except BaseException:
+                    Path(manifest_path).unlink(missing_ok=True)
+                    self._return_to_watcher(volumes.remaining())
+                    raise
+                finally:
+                    self._record_compression(compressed_bytes, started)
+                self.file_index.update(volumes.written)
+                disk.upload(manifest_path)
+                archive_names.append(archive_name)
+
+        return archive_names[-1] if archive_names else None
+
+    def pending_archives(self) -> list[str]:
+        """
+        Находит архивы, собранные, но ещё не загруженные на диск, например до перезапуска процесса.
+        Потерянные архивы убираются из очереди, а их файлы попадут в следующий архив
+        :return: пути до архивов в порядке сборки
+        """
+        archives = []
+        for archive_path in self.file_index.queued():
+            if os.path.isfile(archive_path):
+                archives.append(archive_path)
+            else:
+                self.discard(archive_path)
+        return archives
+
+    def discard(self, archive_path: str) -> None:
+        """
+        Забывает архив, который не получится загрузить
+        :param archive_path: путь до архива
+        """
+        self.file_index.discard(archive_path)
+        Path(file_manifest_path(archive_path)).unlink(missing_ok=True)
+
+    def mark_uploaded(self, archive_path: str) -> None:
+        """
+        Убирает архив из очереди на загрузку после его загрузки на диск
+        :param archive_path: путь до архива
+        """
+        self.file_index.dequeue(archive_path)
+
+    def close(self) -> None:
+        """
+        Останавливает наблюдение за директорией
+        """
+        if self.watcher is not None:
+            self.watcher.close()
+
+    def _scan(self) -> Prefetcher:
+        """
+        :return: стадия сканирования, которая ищет изменённые файлы, пока сжимаются уже найденные
+        """
+        return Prefetcher(
+            batched(self.iter_changed_files(), SCAN_BATCH_SIZE), SCAN_QUEUE_SIZE // SCAN_BATCH_SIZE, "scan"
+        )
+
+    def _same_content(self, entry: FileStat) -> bool:
+        """
+        :return: True, если у файла изменилось только время изменения или inode, а содержимое совпадает
+            с сохранённой версией
+        """
+        if self.hash_cache is None or self.hash_limit == 0:
+            return False
+        if self.hash_limit is not None and entry.size > self.hash_limit:
+            return False
+        indexed = self.file_index.get(entry.path)
+        if indexed is None or indexed[0] != entry.size:
+            return False
+        size, mtime_ns, inode = indexed
+        archived = self.hash_cache.get(entry.device, inode, size, mtime_ns)
+        if archived is None:
+            return False
+        try:
+            return self.hash_cache.hash(entry) == archived
+        except OSError:
+            return False
+
+    def _mark_seen(self, entries: list[FileStat]) -> None:
+        self.file_index.mark_seen(entries)
+        if self.hash_cache is not None:
+            self.hash_cache.mark_seen(entries)
+
+    def _hashed(self, manifest: FileManifestWriter) -> Callable[[FileStat, str], None]:
+        """
+        :return: обработчик хешей, посчитанных при сжатии: записывает их в список файлов архива и в кэш хешей
+        """
+        def on_hashed(entry: FileStat, sha256: str) -> None:
+            manifest.add(entry, sha256)
+            if self.hash_cache is not None:
+                self.hash_cache.put(entry, sha256)
+        return on_hashed
+
+    def _record_compression(self, compressed_bytes: int, started: float) -> None:
+        self.last_stats = self.last_stats._replace(
+            compressed_bytes=compressed_bytes, compression_seconds=time.monotonic() - started
+        )
+
+    def _return_to_watcher(self, files: Iterable[FileStat]) -> None:
+        if self.watcher is not None:
+            self.watcher.mark_dirty(entry.path for entry in files)
 
+    def _new_archive_path(self, taken: Collection[str] = ()) -> Path:
+        """
+        :param taken: имена уже загруженных архивов, которых нет в archives_dir
+        :return: путь до архива с ещё не занятым именем
+        """
+        name = make_archive_name(self.path)
+        archive_path = archives_dir / name
+        number = 1
+        while archive_path.exists() or archive_path.name in taken:
+            archive_path = archives_dir / numbered_archive_name(name, number)
+            number += 1
         return archive_path
@@ -4,8 +4,17 @@ import sys
 
 from pkg_resources import resource_filename
 
-from backuper.defs import processes_info_file
+from backuper.archive_cache import ArchiveCache
+from backuper.compression import CODECS, get_codec
+from backuper.catalog import Catalog
+from backuper.defs import cache_file, catalog_file, metrics_file, processes_info_file, restore_index_file
+from backuper.download_engine import DEFAULT_DOWNLOAD_CONNECTIONS
+from backuper.hash_cache import DEFAULT_HASH_LIMIT
+from backuper.metrics import MetricsRepository
+from backuper.pipeline import DEFAULT_READ_AHEAD, DEFAULT_UPLOAD_QUEUE
 from backuper.processes_repository import ProcessesRepository
+from backuper.restore import DEFAULT_RESTORE_WORKERS, Restorer, RestoreIndex
+from backuper.schedule import OVERRUN_POLICIES, OVERRUN_SKIP, CronSchedule
 from .disk_utils import get_disk, is_disk_authed
 from .utils import *
 
@@ -19,7 +28,7 @@ def _parse_args():  # pragma: no cover
 
     def cron(args_string):
         try:
-            cron_parser(args_string)
+            CronSchedule(args_string)
             return args_string
         except ValueError:
             raise ValueError("Invalid cron format")
@@ -31,8 +40,33 @@ def _parse_args():  # pragma: no cover
     start_parser.set_defaults(cmd="start")
     start_parser.add_argument("-p", "--path", help="path to file", type=path)
     start_parser.add_argument("-c", "--cron", help="backuper rate", type=cron)
-    start_parser.add_argument("-d", "--disk", help="[google, yandex]", choices=["yandex", "google"])
+    start_parser.add_argument("-d", "--disk", help="[google, yandex, local]", choices=["yandex", "google", "local"])
     start_parser.add_argument("-n", "--name", help="name of process", type=str)
+    start_parser.add_argument("--dedup", help="upload only new content-defined chunks", action="store_true")
+    start_parser.add_argument("--delta", help="upload only changed blocks of large modified files",
+                              action="store_true")
+    start_parser.add_argument("--stream", help="upload archives while they are written", action="store_true")
+    start_parser.add_argument("-w", "--workers", help="number of compression threads", type=int, default=1)
+    start_parser.add_argument("--watch", help="track changes with inotify instead of rescanning", action="store_true")
+    start_parser.add_argument("--overrun", help="what to do with runs missed by a long backup",
+                              choices=OVERRUN_POLICIES, default=OVERRUN_SKIP)
+    start_parser.add_argument("--upload-workers", help="number of upload threads", type=int, default=1)
+    start_parser.add_argument("--codec", help="compression codec", choices=list(CODECS), default="deflate")
+    start_parser.add_argument("--level", help="compression level", type=int)
+    start_parser.add_argument("--auto", help="store incompressible files without compression", action="store_true")
+    start_parser.add_argument("--volume-size", help="split archives into volumes of this many megabytes",
+                              type=int, default=0)
+    start_parser.add_argument("--read-ahead", help="megabytes of files read ahead of compression",
+                              type=int, default=DEFAULT_READ_AHEAD // (1024 * 1024))
+    start_parser.add_argument("--upload-queue", help="volumes waiting for upload before compression pauses",
+                              type=int, default=DEFAULT_UPLOAD_QUEUE)
+    start_parser.add_argument("--hash-limit", help="re-hash touched files up to this many megabytes "
+                                                   "and skip them if their content did not change, 0 to disable",
+                              type=int, default=DEFAULT_HASH_LIMIT // (1024 * 1024))
+    start_parser.add_argument("--hash-all", help="re-hash touched files of any size", action="store_true")
+    start_parser.add_argument("--keep-hourly", help="keep the last backup of this many hours", type=int, default=0)
+    start_parser.add_argument("--keep-daily", help="keep the last backup of this many days", type=int, default=0)
+    start_parser.add_argument("--keep-weekly", help="keep the last backup of this many weeks", type=int, default=0)
 
     stop_parser = subparsers.add_parser('stop')
     stop_parser.set_defaults(cmd='stop')
@@ -40,50 +74,154 @@ def _parse_args():  # pragma: no cover
 
     auth_parser = subparsers.add_parser('auth')
     auth_parser.set_defaults(cmd='auth')
-    auth_parser.add_argument("-d", "--disk", help="[google, yandex]", choices=["yandex", "google"])
+    auth_parser.add_argument("-d", "--disk", help="[google, yandex, local]", choices=["yandex", "google", "local"])
 
     list_parser = subparsers.add_parser('backups')
     list_parser.set_defaults(cmd="backups")
 
     files_parser = subparsers.add_parser("diskfiles")
     files_parser.set_defaults(cmd="diskfiles")
-    files_parser.add_argument("-d", "--disk", help="[google, yandex]", choices=["yandex", "google"])
+    files_parser.add_argument("-d", "--disk", help="[google, yandex, local]", choices=["yandex", "google", "local"])
+    files_parser.add_argument("--refresh", action="store_true",
+                              help="list the disk again instead of using the cached manifest")
 
     download_parser = subparsers.add_parser("download")
     download_parser.set_defaults(cmd="download")
-    download_parser.add_argument("-d", "--disk", help="[google, yandex]", choices=["yandex", "google"])
+    download_parser.add_argument("-d", "--disk", help="[google, yandex, local]", choices=["yandex", "google", "local"])
     download_parser.add_argument("-n", "--name", help="name of file from disk", type=str)
+    download_parser.add_argument("-c", "--connections", help="number of parallel range requests",
+                                 type=int, default=DEFAULT_DOWNLOAD_CONNECTIONS)
+
+    restore_parser = subparsers.add_parser("restore")
+    restore_parser.set_defaults(cmd="restore")
+    restore_parser.add_argument("-d", "--disk", help="[google, yandex, local]", choices=["yandex", "google", "local"])
+    restore_parser.add_argument("-s", "--source", help="name of the backed up directory", type=str)
+    restore_parser.add_argument("--at", help="restore the state at this time, e.g. 2024-01-31T12:00",
+                                type=datetime.datetime.fromisoformat, default=None)
+    restore_parser.add_argument("--to", help="directory to restore into", type=Path)
+    restore_parser.add_argument("-w", "--workers", help="number of download and extraction threads",
+                                type=int, default=DEFAULT_RESTORE_WORKERS)
+    restore_parser.add_argument("-c", "--connections", help="number of parallel range requests per archive",
+                                type=int, default=DEFAULT_DOWNLOAD_CONNECTIONS)
+
+    find_parser = subparsers.add_parser("find")
+    find_parser.set_defaults(cmd="find")
+    find_parser.add_argument("pattern", help="glob pattern of the file path, e.g. 'docs/*.pdf' or 'report*'")
+    find_parser.add_argument("-d", "--disk", help="[google, yandex, local]", choices=["yandex", "google", "local"])
+
+    cache_parser = subparsers.add_parser("cache")
+    cache_parser.set_defaults(cmd="cache")
+    cache_parser.add_argument("--max-size", help="local archive cache limit in megabytes", type=int)
+
+    stats_parser = subparsers.add_parser("stats")
+    stats_parser.set_defaults(cmd="stats")
+    stats_parser.add_argument("-n", "--name", help="name of process", type=str)
+    stats_parser.add_argument("-l", "--limit", help="number of recent runs to show", type=int, default=10)
 
     args = parser.parse_args()
     return args
 
 
-def start_backup(disk: str, cron: str, process_name: str, path: str) -> None:
+def start_backup(
+        disk: str, cron: str, process_name: str, path: str,
+        dedup: bool = False, stream: bool = False, workers: int = 1,
+        codec: str = "deflate", level: Optional[int] = None, auto: bool = False,
+        upload_workers: int = 1, overrun: str = OVERRUN_SKIP, watch: bool = False,
+        keep_hourly: int = 0, keep_daily: int = 0, keep_weekly: int = 0, delta: bool = False,
+        volume_size: int = 0, read_ahead: int = DEFAULT_READ_AHEAD // (1024 * 1024),
+        upload_queue: int = DEFAULT_UPLOAD_QUEUE, hash_limit: int = DEFAULT_HASH_LIMIT // (1024 * 1024),
+        hash_all: bool = False
+) -> None:
     """
-    Запускает процесс бэкапа в хранилище
+    Регистрирует задачу бэкапа в хранилище и запускает планировщик, который её выполняет
 
     :param disk: хранилище для загрузки файла
     :param cron: периодичность в формате
     :param process_name: имя, которое мы даём процессу
     :param path: путь к файлу, который мы хотим бэкапить
+    :param dedup: загружать только новые чанки файлов вместо файлов целиком
+    :param stream: загружать архив по мере сжатия, не сохраняя его локально
+    :param workers: количество потоков сжатия
+    :param codec: кодек сжатия
+    :param level: уровень сжатия, None для уровня кодека по умолчанию
+    :param auto: сохранять несжимаемые файлы без сжатия
+    :param upload_workers: количество потоков загрузки
+    :param overrun: что делать с запусками, пропущенными из-за долгого бэкапа (skip, run-once)
+    :param watch: отслеживать изменения через inotify вместо полного сканирования на каждом запуске
+    :param keep_hourly: сколько последних часов хранить по одному бэкапу, 0 — не учитывать часы
+    :param keep_daily: сколько последних дней хранить по одному бэкапу
+    :param keep_weekly: сколько последних недель хранить по одному бэкапу
+    :param delta: загружать только изменённые блоки больших изменённых файлов
+    :param volume_size: ограничение тома архива в мегабайтах, 0 — один архив на запуск
+    :param read_ahead: сколько мегабайт файлов читать впрок, пока сжимаются предыдущие
+    :param upload_queue: сколько собранных томов может ждать загрузки, прежде чем сжатие приостановится
+    :param hash_limit: до скольких мегабайт перечитывать файлы с новым временем изменения, чтобы
+        не архивировать их, если содержимое не изменилось, 0 — не перечитывать
+    :param hash_all: перечитывать такие файлы любого размера
     """
     if not is_disk_authed(get_disk(disk).__name__):
         print("You're not authorized in disk")
         print("Please, run 'python backup.py auth -d <disk>")
         return
 
+    try:
+        get_codec(codec, level)
+    except ValueError as e:
+        print(e)
+        return
+
+    if dedup and delta:
+        print("--dedup and --delta can't be used together")
+        return
+
+    processes_repository = ProcessesRepository(processes_info_file)
+    if process_name in processes_repository:
+        processes_repository.stop_process(process_name)
+    processes_repository.add_process(process_name, {
+        "cron": cron,
+        "path": str(path),
+        "disk": disk,
+        "dedup": dedup,
+        "stream": stream,
+        "workers": workers,
+        "codec": codec,
+        "level": level,
+        "auto": auto,
+        "upload_workers": upload_workers,
+        "overrun": overrun,
+        "watch": watch,
+        "keep_hourly": keep_hourly,
+        "keep_daily": keep_daily,
+        "keep_weekly": keep_weekly,
+        "delta": delta,
+        "volume_size": volume_size * 1024 * 1024 if volume_size else None,
+        "read_ahead": read_ahead * 1024 * 1024,
+        "upload_queue": upload_queue,
+        "hash_limit": None if hash_all else hash_limit * 1024 * 1024,
+    })
+
     print("start")
-    backup_loop_path = resource_filename('backuper', 'backup_loop.py')
-    new_process = subprocess.Popen(
-        [
-            sys.executable, backup_loop_path, "start", "-p", str(path),
-            "-c", cron, "-d", disk, "-n", process_name
-        ],
+    print(ensure_daemon_running())
+
+
+def ensure_daemon_running() -> int:
+    """
+    Запускает планировщик задач бэкапа, если он ещё не запущен
+
+    :return: pid планировщика
+    """
+    pid = read_daemon_pid()
+    if pid is not None:
+        return pid
+
+    daemon_path = resource_filename('backuper', 'daemon.py')
+    daemon_process = subprocess.Popen(
+        [sys.executable, daemon_path],
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
         start_new_session=True
     )
-    print(new_process.pid)
+    return daemon_process.pid
 
 
 def stop_backup(name: str) -> None:
@@ -111,6 +249,8 @@ def get_backups() -> None:
         print(name)
         for key, value in info.items():
             print(f"\t{key}: {value}")
+        if "pid" in info and not processes_repository.is_running(name):
+            print("\tstatus: not running")
 
 
 def auth(disk: str) -> None:
@@ -122,30 +262,126 @@ def auth(disk: str) -> None:
     get_disk(disk)()
 
 
-def get_files_from_disk(disk: str):
+def get_files_from_disk(disk: str, refresh: bool = False):
     """
     Получение списка всех бэкапов, находящихся на хранилище
 
     :param disk: хранилище, из которого нужно получить список
+    :param refresh: обойти хранилище заново вместо локального манифеста
     """
     disk = get_disk(disk)()
-    for file in disk.list_of_files():
+    for file in disk.list_of_files(refresh):
         print(file)
 
 
-def download_file_from_disk(disk: str, name: str) -> None:
+def download_file_from_disk(disk: str, name: str, connections: int = DEFAULT_DOWNLOAD_CONNECTIONS) -> None:
     """
     Скачивание файла из хранилища
 
     :param disk: хранилище, с которого планируется скачивать файл
     :param name: имя файла для скачивания
+    :param connections: количество параллельных соединений
     """
 
     disk = get_disk(disk)()
     try:
-        disk.download(name)
-    except ValueError:
-        print("No such file on disk")
+        disk.download(name, connections)
+    except ValueError as e:
+        print(e)
+
+
+def restore_from_disk(
+        disk: str, source: str, at: Optional[datetime.datetime], target_dir: Path,
+        workers: int = DEFAULT_RESTORE_WORKERS, connections: int = DEFAULT_DOWNLOAD_CONNECTIONS
+) -> None:
+    """
+    Восстановление директории на момент времени
+
+    :param disk: хранилище с бэкапами
+    :param source: имя бэкапируемой директории
+    :param at: момент времени, по умолчанию текущий
+    :param target_dir: директория, в которую восстанавливаются файлы
+    :param workers: количество потоков скачивания и распаковки
+    :param connections: количество соединений на скачивание одного архива
+    """
+    disk = get_disk(disk)()
+    index = RestoreIndex(restore_index_file)
+    cache = ArchiveCache(cache_file)
+    try:
+        restored = Restorer(disk, index, workers, connections, cache).restore(
+            source, at if at is not None else datetime.datetime.now(), target_dir
+        )
+        print(f"Restored {restored} files")
+    except ValueError as e:
+        print(e)
+    finally:
+        index.close()
+        cache.close()
+
+
+def find_files(pattern: str, disk: Optional[str] = None) -> None:
+    """
+    Поиск файлов в бэкапах по локальному индексу списков файлов
+
+    :param pattern: glob-шаблон пути файла
+    :param disk: хранилище, архивы которого нужно сначала добавить в индекс
+    """
+    catalog = Catalog(catalog_file)
+    try:
+        disk_name = None
+        if disk is not None:
+            disk = get_disk(disk)()
+            disk_name = disk.__class__.__name__
+            catalog.sync(disk)
+        for match in catalog.find(pattern, disk_name):
+            modified = datetime.datetime.fromtimestamp(match.file.mtime_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{match.archive}\t{match.file.path}\t{match.file.size}\t{modified}")
+    finally:
+        catalog.close()
+
+
+def manage_cache(max_size: Optional[int] = None) -> None:
+    """
+    Вывод занятого места в локальном кэше архивов и изменение его объёма
+
+    :param max_size: новый допустимый объём кэша в мегабайтах, None, чтобы его не менять
+    """
+    cache = ArchiveCache(cache_file)
+    try:
+        if max_size is not None:
+            cache.max_bytes = max_size * 1024 * 1024
+            cache.evict()
+        count, size = cache.usage()
+        print(f"{count} archives, {size // (1024 * 1024)} of {cache.max_bytes // (1024 * 1024)} MB")
+    finally:
+        cache.close()
+
+
+def show_stats(name: Optional[str] = None, limit: int = 10) -> None:
+    """
+    Вывод метрик последних запусков задач бэкапа
+
+    :param name: имя процесса, None для всех процессов
+    :param limit: количество последних запусков каждого процесса
+    """
+    metrics = MetricsRepository(metrics_file)
+    try:
+        totals = [job_totals for job_totals in metrics.totals() if name is None or job_totals.job == name]
+        if not totals:
+            print("No runs yet")
+        for job_totals in totals:
+            print(f"{job_totals.job}: {job_totals.runs} runs, {job_totals.failed_runs} failed, "
+                  f"{job_totals.uploaded_bytes / 1024 / 1024:.1f} MB uploaded, {job_totals.upload_retries} retries")
+            print("\tstarted\t\t\tlag s\tscan s\tscanned\tchanged\traw MB\tzip MB\tzip s\tup MB/s\tbacklog")
+            for run in metrics.history(job_totals.job, limit):
+                started = datetime.datetime.fromtimestamp(run.started).strftime("%Y-%m-%d %H:%M:%S")
+                status = "" if run.succeeded else "\tfailed"
+                print(f"\t{started}\t{run.lag_seconds:.1f}\t{run.scan_seconds:.2f}\t{run.scanned_files}\t"
+                      f"{run.changed_files}\t{run.raw_bytes / 1024 / 1024:.1f}\t"
+                      f"{run.compressed_bytes / 1024 / 1024:.1f}\t{run.compression_seconds:.2f}\t"
+                      f"{run.upload_throughput / 1024 / 1024:.2f}\t{run.upload_backlog}{status}")
+    finally:
+        metrics.close()
 
 
 def main():  # pragma: no cover
@@ -153,7 +389,10 @@ def main():  # pragma: no cover
     make_app_dirs()
 
     if args.cmd == "start":
-        start_backup(args.disk, args.cron, args.name, args.path)
+        start_backup(args.disk, args.cron, args.name, args.path, args.dedup, args.stream,
+                     args.workers, args.codec, args.level, args.auto, args.upload_workers,
+                     args.overrun, args.watch, args.keep_hourly, args.keep_daily, args.keep_weekly, args.delta,
+                     args.volume_size, args.read_ahead, args.upload_queue, args.hash_limit, args.hash_all)
 
     elif args.cmd == 'stop':
         stop_backup(args.name)
@@ -165,10 +404,22 @@ def main():  # pragma: no cover
         auth(args.disk)
 
     elif args.cmd == "diskfiles":
-        get_files_from_disk(args.disk)
+        get_files_from_disk(args.disk, args.refresh)
 
     elif args.cmd == "download":
-        download_file_from_disk(args.disk, args.name)
+        download_file_from_disk(args.disk, args.name, args.connections)
+
+    elif args.cmd == "restore":
+        restore_from_disk(args.disk, args.source, args.at, args.to, args.workers, args.connections)
+
+    elif args.cmd == "find":
+        find_files(args.pattern, args.disk)
+
+    elif args.cmd == "cache":
+        manage_cache(args.max_size)
+
+    elif args.cmd == "stats":
+        show_stats(args.name, args.limit)
 
     else:
         raise ValueError("Unknown command")
@@ -1,24 +1,57 @@
+import sqlite3
 import time
 import logging
 
-from backuper.archive_maker import ArchiveMaker
+from backuper.archive_cache import ArchiveCache
+from backuper.archive_maker import ArchiveMaker, ArchiveStats
+from backuper.catalog import Catalog, file_manifest_path, read_file_manifest
 from backuper.backup import _parse_args
+from backuper.compression import CodecSelector, get_codec
 from backuper.controller import Controller, InfiniteController
+from backuper.dedup import ChunkIndex, DedupArchiveMaker
+from backuper.delta import DeltaArchiveMaker, SignatureStore
 from backuper.disk_utils import get_disk
 from backuper.disks.base_disk import BaseDisk
+from backuper.file_index import FileIndex
+from backuper.hash_cache import DEFAULT_HASH_LIMIT, HashCache
+from backuper.metrics import IterationMetrics, MetricsRepository, export_textfile
+from backuper.pipeline import DEFAULT_READ_AHEAD, DEFAULT_UPLOAD_QUEUE
 from backuper.processes_repository import ProcessesRepository
+from backuper.restore import RestoreIndex
+from backuper.retention import RetentionPolicy, prune
+from backuper.schedule import OVERRUN_SKIP, CronSchedule
+from backuper.upload_engine import UploadEngine
+from backuper.watcher import InotifyWatcher
 from backuper.utils import *
-from backuper.defs import logs_file, processes_info_file
+from backuper.defs import (
+    logs_file, processes_info_file, indexes_dir, catalog_file, archives_dir, cache_file, restore_index_file,
+    metrics_file, metrics_textfile
+)
 
 logging.basicConfig(level=logging.INFO, filename=logs_file, filemode="w",
                     format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
+RETENTION_INTERVAL = 60 * 60
+
 
 def start_process(
         name: str, path: Path, cron: str,
         disk: BaseDisk, backup_controller: Controller,
-        processes_repository: ProcessesRepository
+        processes_repository: ProcessesRepository,
+        dedup: bool = False,
+        stream: bool = False,
+        workers: int = 1,
+        codec_selector: Optional[CodecSelector] = None,
+        upload_workers: int = 1,
+        overrun: str = OVERRUN_SKIP,
+        watch: bool = False,
+        retention: Optional[RetentionPolicy] = None,
+        delta: bool = False,
+        volume_size: Optional[int] = None,
+        read_ahead: int = DEFAULT_READ_AHEAD,
+        upload_queue: int = DEFAULT_UPLOAD_QUEUE,
+        hash_limit: Optional[int] = DEFAULT_HASH_LIMIT
 ) -> None:
     """
     Запускает отдельный процесс для бэкапа
@@ -28,6 +61,20 @@ def start_process(
     :param path: путь файла для бэкапа
     :param cron: периодичность в формате крон
     :param disk_name: название хранилища
+    :param dedup: собирать дедуплицирующие снимки вместо обычных архивов
+    :param stream: загружать архивы по мере сжатия, не сохраняя их в archives_dir
+    :param workers: количество потоков сжатия
+    :param codec_selector: выбор кодека сжатия для каждого файла
+    :param upload_workers: количество потоков загрузки
+    :param overrun: что делать с запусками, пропущенными из-за долгого бэкапа (skip, run-once)
+    :param watch: отслеживать изменения через inotify вместо полного сканирования на каждом запуске
+    :param retention: сколько бэкапов хранить на диске, None, чтобы хранить все
+    :param delta: сохранять большие изменённые файлы дельтой относительно предыдущей версии
+    :param volume_size: ограничение тома архива в байтах, None — один архив на запуск
+    :param read_ahead: сколько байт прочитанных файлов может ждать сжатия
+    :param upload_queue: сколько собранных томов может ждать загрузки, прежде чем сжатие приостановится
+    :param hash_limit: до скольких байт перечитывать файлы с новым временем изменения, чтобы пропустить
+        неизменившиеся, None — файлы любого размера
     """
 
     logging.info(f"Start process {name} with path {path} and cron {cron}")
@@ -41,18 +88,242 @@ def start_process(
         "path": str(path),
     })
 
-    archive_maker = ArchiveMaker(path)
-    rate = cron_parser(cron)
+    job = BackupJob(
+        name, path, disk, dedup, stream, workers, codec_selector, upload_workers, watch, retention, delta,
+        volume_size, read_ahead, upload_queue, hash_limit
+    )
+    schedule = CronSchedule(cron, overrun)
+
+    logging.info(f"Start backup with schedule {cron}")
+    try:
+        while backup_controller.should_continue():
+            if job.run_once(schedule.next_fire) is None:
+                logging.debug(f"No changes in {path}")
+            schedule.advance(time.time())
+            time.sleep(schedule.delay(time.time()))
+    finally:
+        job.close()
+
+
+class BackupJob:
+    """
+    Бэкап одной папки. Каждый запуск собирает архив изменений и передаёт его на загрузку,
+    поэтому задачу может запускать как отдельный процесс, так и общий планировщик.
+    Сканирование, чтение, сжатие и загрузка идут одновременно и связаны ограниченными очередями.
+    Загруженные архивы остаются в ограниченном локальном кэше, а старые архивы
+    не чаще раза в час удаляются с диска по политике хранения
+    """
+
+    def __init__(
+            self, name: str, path: Path, disk: BaseDisk,
+            dedup: bool = False,
+            stream: bool = False,
+            workers: int = 1,
+            codec_selector: Optional[CodecSelector] = None,
+            upload_workers: int = 1,
+            watch: bool = False,
+            retention: Optional[RetentionPolicy] = None,
+            delta: bool = False,
+            volume_size: Optional[int] = None,
+            read_ahead: int = DEFAULT_READ_AHEAD,
+            upload_queue: int = DEFAULT_UPLOAD_QUEUE,
+            hash_limit: Optional[int] = DEFAULT_HASH_LIMIT
+    ):
+        self.name = name
+        self.path = Path(path)
+        self.disk = disk
+        self.stream = stream
+        self.retention = retention
+        self.upload_queue = upload_queue
+        self._last_retention = None
+
+        watcher = None
+        if watch:
+            try:
+                watcher = InotifyWatcher(path)
+            except OSError as e:
+                logging.warning(f"Can't watch {path} for changes, falling back to full scans: {e}")
+
+        self.file_index = FileIndex(indexes_dir / f"{name}.sqlite")
+        self.hash_cache = HashCache(indexes_dir / f"{name}.hashes.sqlite")
+        self.chunk_index = None
+        self.signature_store = None
+        if dedup:
+            self.chunk_index = ChunkIndex(indexes_dir / f"{name}.chunks.sqlite")
+            self.archive_maker = DedupArchiveMaker(
+                path, self.file_index, self.chunk_index, workers, codec_selector, watcher,
+                volume_size=volume_size, hash_cache=self.hash_cache, hash_limit=hash_limit
+            )
+        elif delta:
+            self.signature_store = SignatureStore(indexes_dir / f"{name}.signatures.sqlite")
+            self.archive_maker = DeltaArchiveMaker(
+                path, self.file_index, self.signature_store, workers, codec_selector, watcher,
+                volume_size=volume_size, hash_cache=self.hash_cache, hash_limit=hash_limit
+            )
+        else:
+            self.archive_maker = ArchiveMaker(
+                path, self.file_index, workers, codec_selector, watcher,
+                volume_size=volume_size, read_ahead=read_ahead, hash_cache=self.hash_cache, hash_limit=hash_limit
+            )
+
+        self.catalog = Catalog(catalog_file)
+        self.cache = ArchiveCache(cache_file)
+        self.metrics = MetricsRepository(metrics_file)
+        self.upload_engine = UploadEngine(disk, upload_workers)
+        for archive_path in self.archive_maker.pending_archives():
+            logging.info(f"Resume upload of {archive_path}")
+            self.upload_engine.submit(archive_path)
+
+    def run_once(self, scheduled_at: Optional[float] = None) -> Optional[str]:
+        """
+        Собирает архив изменённых файлов и ставит его в очередь на загрузку. Тома архива
+        загружаются по мере сборки, пока сжимаются следующие
+        :param scheduled_at: время запуска по расписанию, чтобы посчитать отставание от него
+        :return: путь или имя архива, None, если изменений нет или сборка не удалась
+        """
+        started = time.time()
+        uploads_before = self.upload_engine.totals()
+        self.archive_maker.last_stats = ArchiveStats()
+        retries = self._collect_uploads()
+        try:
+            if self.stream:
+                archive_path = self.archive_maker.stream_fresh_archive(self.disk, on_volume=self._streamed)
+                if archive_path is not None:
+                    self._streamed(archive_path)
+            else:
+                archive_path = self.archive_maker.make_fresh_archive(on_volume=self._submit_volume)
+                if archive_path is not None:
+                    self.upload_engine.submit(archive_path)
+        except Exception as e:
+            logging.exception(e)
+            self._record_metrics(started, scheduled_at, False, uploads_before, retries)
+            return None
+
+        self.upload_engine.log_stats()
+        self._apply_retention()
+        self._record_metrics(started, scheduled_at, True, uploads_before, retries)
+        return archive_path
+
+    def close(self) -> None:
+        """
+        Останавливает наблюдение за директорией и дожидается загрузки архивов из очереди
+        """
+        self.archive_maker.close()
+        self.upload_engine.close()
+        self._collect_uploads(retry=False)
+        self.catalog.close()
+        self.cache.close()
+        self.metrics.close()
+        self.hash_cache.close()
+        if self.signature_store is not None:
+            self.signature_store.close()
+
+    def _collect_uploads(self, retry: bool = True) -> int:
+        """
+        Убирает загруженные архивы из очереди, а архивы с ошибкой загрузки ставит в очередь снова
+        :return: количество архивов, поставленных в очередь повторно
+        """
+        retries = 0
+        uploaded = False
+        for archive_path, error in self.upload_engine.completed():
+            if error is None:
+                self._add_to_catalog(archive_path)
+                self.archive_maker.mark_uploaded(archive_path)
+                self.cache.add(archive_path)
+                uploaded = True
+            elif retry:
+                self.upload_engine.submit(archive_path)
+                retries += 1
+        if uploaded:
+            self.cache.evict()
+        return retries
+
+    def _record_metrics(
+            self, started: float, scheduled_at: Optional[float], succeeded: bool, uploads_before, retries: int
+    ) -> None:
+        """
+        Сохраняет метрики запуска и перезаписывает файл метрик для Prometheus
+        """
+        archive_stats = self.archive_maker.last_stats
+        uploads = self.upload_engine.totals()
+        uploaded_archives = uploads.archives - uploads_before.archives
+        uploaded_bytes = uploads.bytes - uploads_before.bytes
+        upload_seconds = uploads.seconds - uploads_before.seconds
+        if self.stream and archive_stats.compressed_bytes:
+            uploaded_archives, uploaded_bytes = 1, archive_stats.compressed_bytes
+            upload_seconds = archive_stats.compression_seconds
+
+        metrics = IterationMetrics(
+            self.name, started, time.time() - started, succeeded,
+            max(started - scheduled_at, 0.0) if scheduled_at is not None else 0.0,
+            *archive_stats,
+            uploaded_archives, uploaded_bytes, upload_seconds, retries, self.upload_engine.backlog[0]
+        )
+        try:
+            self.metrics.record(metrics)
+            export_textfile(self.metrics, metrics_textfile)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Can't save metrics of {self.name}: {e}")
+
+    def _apply_retention(self) -> None:
+        """
+        Удаляет с диска архивы, которые не нужны по политике хранения, и забывает их в локальных индексах.
+        Пока в очереди есть незагруженные архивы, удаление откладывается: они могут ссылаться на чанки старых архивов
+        """
+        if self.retention is None or not self.retention.enabled:
+            return
+        now = time.monotonic()
+        if self._last_retention is not None and now - self._last_retention < RETENTION_INTERVAL:
+            return
+        if self.file_index.queued():
+            return
+        self._last_retention = now
+
+        index = RestoreIndex(restore_index_file)
+        try:
+            pruned = prune(self.disk, index, self.path.name, self.retention)
+        except Exception as e:
+            logging.exception(e)
+            return
+        finally:
+            index.close()
+
+        for archive in pruned:
+            self.catalog.remove_archive(self.disk.__class__.__name__, archive)
+            self.cache.remove(archive)
+            if self.chunk_index is not None:
+                self.chunk_index.remove_archive(archive)
+            if self.signature_store is not None:
+                self.signature_store.remove_archive(archive)
+
+    def _submit_volume(self, archive_path: str) -> None:
+        """
+        Отдаёт собранный том на загрузку и приостанавливает сборку следующего,
+        пока загрузки ждёт больше upload_queue томов
+        """
+        self.upload_engine.submit(archive_path)
+        self.upload_engine.wait_for_backlog(self.upload_queue)
+
+    def _streamed(self, archive_name: str) -> None:
+        """
+        Добавляет загруженный потоком архив в каталог и удаляет локальную копию списка его файлов
+        """
+        self._add_to_catalog(archives_dir / archive_name)
+        Path(file_manifest_path(archives_dir / archive_name)).unlink(missing_ok=True)
 
-    logging.info(f"Start backup with rate {rate}")
-    while backup_controller.should_continue():
-        archive_path = archive_maker.make_fresh_archive()
-        if archive_path is None:
-            print(archive_path)
-            time.sleep(rate)
-            continue
-        disk.upload(archive_path)
-        time.sleep(rate)
+    def _add_to_catalog(self, archive_path) -> None:
+        """
+        Добавляет загруженный архив в локальный индекс поиска по списку его файлов
+        """
+        manifest_path = file_manifest_path(archive_path)
+        if not os.path.isfile(manifest_path):
+            return
+        try:
+            records = read_file_manifest(manifest_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can't read file list of {archive_path}: {e}")
+            return
+        self.catalog.add(self.disk.__class__.__name__, os.path.basename(archive_path), records)
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -64,6 +335,13 @@ if __name__ == '__main__':  # pragma: no cover
         logging.info(f"Authorized in {disk} disk")
         processes_repository = ProcessesRepository(processes_info_file)
         controller = InfiniteController()
-        start_process(args.name, args.path, args.cron, disk, controller, processes_repository)
+        codec_selector = CodecSelector(get_codec(args.codec, args.level), args.auto)
+        start_process(
+            args.name, args.path, args.cron, disk, controller, processes_repository,
+            args.dedup, args.stream, args.workers, codec_selector, args.upload_workers, args.overrun,
+            args.watch, RetentionPolicy(args.keep_hourly, args.keep_daily, args.keep_weekly), args.delta,
+            args.volume_size * 1024 * 1024 if args.volume_size else None, args.read_ahead * 1024 * 1024,
+            args.upload_queue, None if args.hash_all else args.hash_limit * 1024 * 1024
+        )
     except Exception as e:
         logging.exception(e)
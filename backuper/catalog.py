@@ -0,0 +1,263 @@
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from backuper.disks.base_disk import FILE_MANIFEST_SUFFIX, BaseDisk
+from backuper.scanner import FileStat
+from backuper.utils import ARCHIVE_TIME_FORMAT, ARCHIVE_TIME_PATTERN
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SYNC_WORKERS = 8
+MANIFEST_UPLOAD_GRACE = datetime.timedelta(days=1)
+
+
+class FileRecord(NamedTuple):
+    """
+    Файл в архиве
+    """
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: Optional[str]
+
+
+class CatalogMatch(NamedTuple):
+    """
+    Найденная версия файла
+    """
+    disk: str
+    archive: str
+    file: FileRecord
+
+
+def _predates_manifest(archive_name: str) -> bool:
+    """
+    :return: True, если архив собран раньше, чем его список файлов мог бы появиться на диске
+    """
+    created = ARCHIVE_TIME_PATTERN.match(archive_name)
+    if created is None:
+        return True
+    created = datetime.datetime.strptime(created.group(), ARCHIVE_TIME_FORMAT)
+    return datetime.datetime.now() - created > MANIFEST_UPLOAD_GRACE
+
+
+def file_manifest_path(archive_path) -> str:
+    """
+    :param archive_path: путь до архива
+    :return: путь до списка файлов архива, который лежит рядом с ним
+    """
+    return f"{archive_path}{FILE_MANIFEST_SUFFIX}"
+
+
+def hash_file(path: str) -> str:
+    """
+    :param path: путь до файла
+    :return: sha256 содержимого файла
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifestWriter:
+    """
+    Пишет сжатый список файлов архива с их размерами, временем изменения и хешами содержимого.
+    Записи добавляются по одной по мере архивации, не собирая весь список в памяти
+    """
+
+    def __init__(self, manifest_path, root_path: Path):
+        self.root_path = root_path
+        self.count = 0
+        self._file = gzip.open(manifest_path, "wt", encoding="utf-8")
+        self._file.write('{"files":[')
+
+    def add(self, entry: FileStat, sha256: str) -> None:
+        """
+        :param entry: запись о файле архива
+        :param sha256: хеш содержимого, попавшего в архив
+        """
+        record = [os.path.relpath(entry.path, self.root_path).replace(os.sep, "/"), entry.size, entry.mtime_ns,
+                  sha256]
+        self._file.write(("," if self.count else "") + json.dumps(record, separators=(",", ":")))
+        self.count += 1
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.write("]}")
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_file_manifest(manifest_path, root_path: Path, files: Iterable[FileStat]) -> int:
+    """
+    Пишет список файлов архива, читая каждый файл для хеша
+    :param manifest_path: путь до списка файлов
+    :param root_path: путь до бэкапируемой директории
+    :param files: записи о файлах архива
+    :return: количество записанных файлов
+    """
+    with FileManifestWriter(manifest_path, root_path) as manifest:
+        for entry in files:
+            manifest.add(entry, hash_file(entry.path))
+    return manifest.count
+
+
+def read_file_manifest(manifest_path) -> list[FileRecord]:
+    """
+    :param manifest_path: путь до списка файлов архива
+    :return: записи о файлах
+    """
+    with gzip.open(manifest_path, "rt", encoding="utf-8") as f:
+        return [FileRecord(*record) for record in json.load(f)["files"]]
+
+
+class Catalog:
+    """
+    Локальный индекс содержимого архивов на всех дисках, собранный из списков файлов архивов.
+    Пути хранятся по одному разу, поэтому поиск по шаблону проходит только по уникальным путям,
+    а шаблон с постоянным началом использует индекс
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.connection = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS archives ("
+            "disk TEXT NOT NULL, "
+            "archive TEXT NOT NULL, "
+            "PRIMARY KEY (disk, archive))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS paths ("
+            "id INTEGER PRIMARY KEY, "
+            "path TEXT NOT NULL UNIQUE)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            "path_id INTEGER NOT NULL, "
+            "disk TEXT NOT NULL, "
+            "archive TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "sha256 TEXT, "
+            "PRIMARY KEY (path_id, disk, archive))"
+        )
+        self.connection.commit()
+
+    def is_indexed(self, disk: str, archive: str) -> bool:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM archives WHERE disk = ? AND archive = ?", (disk, archive)
+            ).fetchone()
+        return row is not None
+
+    def add(self, disk: str, archive: str, records: Iterable[FileRecord]) -> None:
+        """
+        Добавляет содержимое архива
+        :param disk: имя диска
+        :param archive: имя архива
+        :param records: файлы архива
+        """
+        records = list(records)
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO paths (path) VALUES (?)", ((record.path,) for record in records)
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO versions (path_id, disk, archive, size, mtime_ns, sha256) "
+                "SELECT id, ?, ?, ?, ?, ? FROM paths WHERE path = ?",
+                ((disk, archive, record.size, record.mtime_ns, record.sha256, record.path) for record in records)
+            )
+            self.connection.execute("INSERT OR IGNORE INTO archives (disk, archive) VALUES (?, ?)", (disk, archive))
+
+    def remove_archive(self, disk: str, archive: str) -> None:
+        """
+        Забывает содержимое удалённого с диска архива и пути, версий которых больше ни в одном архиве нет
+        :param disk: имя диска
+        :param archive: имя архива
+        """
+        with self._lock, self.connection:
+            path_ids = [row[0] for row in self.connection.execute(
+                "SELECT path_id FROM versions WHERE disk = ? AND archive = ?", (disk, archive)
+            )]
+            self.connection.execute("DELETE FROM versions WHERE disk = ? AND archive = ?", (disk, archive))
+            self.connection.execute("DELETE FROM archives WHERE disk = ? AND archive = ?", (disk, archive))
+            self.connection.executemany(
+                "DELETE FROM paths WHERE id = ? AND NOT EXISTS (SELECT 1 FROM versions WHERE path_id = ?)",
+                ((path_id, path_id) for path_id in path_ids)
+            )
+
+    def find(self, pattern: str, disk: Optional[str] = None) -> list[CatalogMatch]:
+        """
+        Ищет версии файлов по glob-шаблону. Шаблон без "/" сравнивается и с именем файла на любой глубине
+        :param pattern: шаблон пути относительно бэкапируемой директории
+        :param disk: искать только на этом диске
+        :return: найденные версии, отсортированные по пути и архиву
+        """
+        conditions = "(p.path GLOB ?" + (")" if "/" in pattern else " OR p.path GLOB ?)")
+        params = [pattern] if "/" in pattern else [pattern, f"*/{pattern}"]
+        if disk is not None:
+            conditions += " AND v.disk = ?"
+            params.append(disk)
+
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT v.disk, v.archive, p.path, v.size, v.mtime_ns, v.sha256 "
+                "FROM paths p JOIN versions v ON v.path_id = p.id "
+                f"WHERE {conditions} ORDER BY p.path, v.archive", params
+            ).fetchall()
+        return [CatalogMatch(disk_name, archive, FileRecord(*record)) for disk_name, archive, *record in rows]
+
+    def sync(self, disk: BaseDisk, workers: int = SYNC_WORKERS) -> int:
+        """
+        Добавляет в индекс архивы с диска, которых в нём ещё нет, скачивая только их списки файлов.
+        Архивы без списка файлов, собранные старыми версиями, запоминаются пустыми. Свежий архив без списка
+        пропускается до следующей синхронизации: при потоковой загрузке список загружается после архива
+        :param disk: диск
+        :param workers: количество одновременных скачиваний
+        :return: количество добавленных архивов
+        """
+        disk_name = disk.__class__.__name__
+        remote_names = {remote_file.name for remote_file in disk.remote_files()}
+        missing = [
+            name for name in disk.filter_files(sorted(remote_names)) if not self.is_indexed(disk_name, name)
+        ]
+
+        def index(archive: str) -> bool:
+            manifest_name = file_manifest_path(archive)
+            if manifest_name not in remote_names:
+                if not _predates_manifest(archive):
+                    return False
+                self.add(disk_name, archive, [])
+                return True
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                local_path = os.path.join(tmp_dir, manifest_name)
+                disk.download(manifest_name, 1, local_path)
+                self.add(disk_name, archive, read_file_manifest(local_path))
+            return True
+
+        with ThreadPoolExecutor(workers, "catalog") as pool:
+            added = sum(pool.map(index, missing))
+        if added:
+            logging.info(f"Indexed {added} archives from {disk_name}")
+        return added
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,107 @@
+import random
+from typing import BinaryIO, Iterator
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+_gear_random = random.Random(0x6765617221)
+_GEAR = [_gear_random.getrandbits(32) for _ in range(256)]
+_GEAR_ARRAY = numpy.array(_GEAR, dtype=numpy.uint32) if numpy is not None else None
+# после 32 сдвигов вклад байта уходит за пределы 32-битного хеша
+HASH_WINDOW = 32
+SEARCH_BLOCK_SIZE = 128 * 1024
+
+
+def _boundary_mask(avg_size: int) -> int:
+    """
+    Строит маску из старших бит хеша, дающую в среднем одну границу на avg_size байт
+    """
+    bits = max(avg_size.bit_length() - 1, 1)
+    return ((1 << bits) - 1) << (32 - bits)
+
+
+def find_boundary(data: bytes, min_size: int, max_size: int, mask: int) -> int:
+    """
+    Ищет границу чанка скользящим gear-хешем. Первые min_size байт пропускаются без хеширования.
+    С numpy хеши считаются векторно, без него — побайтово, границы совпадают
+    :param data: буфер, начинающийся с начала очередного чанка
+    :return: длина чанка
+    """
+    end = min(len(data), max_size)
+    if end <= min_size:
+        return end
+    if numpy is None:
+        return _find_boundary_python(data, min_size, end, mask)
+    return _find_boundary_numpy(data, min_size, end, mask)
+
+
+def _find_boundary_python(data: bytes, start: int, end: int, mask: int) -> int:
+    gear = _GEAR
+    h = 0
+    for i in range(start, end):
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+        if not h & mask:
+            return i + 1
+    return end
+
+
+def _find_boundary_numpy(data: bytes, start: int, end: int, mask: int) -> int:
+    """
+    Хеш после байта i равен сумме gear[data[i - k]] << k по последним HASH_WINDOW байтам.
+    Такие суммы для всех позиций блока складываются удвоением окна: из сумм по w байтам
+    получаются суммы по 2w байтам, поэтому блок проходится log2(HASH_WINDOW) раз
+    """
+    view = numpy.frombuffer(data, dtype=numpy.uint8)
+    mask = numpy.uint32(mask)
+    for block_start in range(start, end, SEARCH_BLOCK_SIZE):
+        block_end = min(block_start + SEARCH_BLOCK_SIZE, end)
+        history = max(block_start - HASH_WINDOW + 1, start)
+        gear = _GEAR_ARRAY[view[history:block_end]]
+        hashes = gear
+        width = 1
+        while width < HASH_WINDOW:
+            hashes[width:] += hashes[:-width] << numpy.uint32(width)
+            width *= 2
+        hits = numpy.flatnonzero((hashes[block_start - history:] & mask) == 0)
+        if len(hits):
+            return block_start + int(hits[0]) + 1
+    return end
+
+
+def iter_chunks(
+        stream: BinaryIO,
+        min_size: int = MIN_CHUNK_SIZE,
+        avg_size: int = AVG_CHUNK_SIZE,
+        max_size: int = MAX_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Разбивает поток на чанки, границы которых определяются содержимым,
+    поэтому вставка или изменение данных сдвигает только соседние чанки
+    :param stream: бинарный поток
+    :param min_size: минимальный размер чанка
+    :param avg_size: ожидаемый средний размер чанка
+    :param max_size: максимальный размер чанка
+    :return: итератор по чанкам
+    """
+    mask = _boundary_mask(avg_size)
+    buffer = b""
+    eof = False
+    while True:
+        while not eof and len(buffer) < max_size:
+            data = stream.read(max_size)
+            if not data:
+                eof = True
+            buffer += data
+
+        if not buffer:
+            return
+
+        cut = find_boundary(buffer, min_size, max_size, mask)
+        yield buffer[:cut]
+        buffer = buffer[cut:]
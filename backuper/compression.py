@@ -0,0 +1,270 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import zipfile
+import zlib
+from typing import BinaryIO, Iterator, Optional
+
+from backuper.scanner import FileStat
+
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".aac", ".ogg", ".opus", ".flac", ".m4a",
+    ".mp4", ".mkv", ".avi", ".mov", ".webm", ".m4v",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4", ".7z", ".rar",
+    ".jar", ".apk", ".docx", ".xlsx", ".pptx", ".odt", ".pdf",
+}
+SAMPLE_SIZE = 64 * 1024
+MIN_SAMPLE_FILE_SIZE = 4 * 1024
+MIN_COMPRESSION_GAIN = 0.05
+
+
+class Codec:
+    """
+    Способ сжатия элементов архива.
+    Кодеки, которые zip не поддерживает, сохраняют элемент без сжатия zip
+    в виде сжатого файла с расширением suffix, который распаковывается стандартной утилитой
+    """
+    name = ""
+    compress_type = zipfile.ZIP_STORED
+    suffix = ""
+
+    def __init__(self, level: Optional[int] = None):
+        self.level = level
+
+    def compress_block(self, data: bytes, last: bool) -> bytes:
+        """
+        Независимо сжимает блок файла так, чтобы склеенные блоки образовывали корректный поток
+        :param data: блок данных
+        :param last: является ли блок последним в файле
+        :return: сжатый блок
+        """
+        return data
+
+    def compressor(self):
+        """
+        :return: потоковый компрессор с методами compress и flush
+        """
+        raise NotImplementedError
+
+    def open_reader(self, fileobj: BinaryIO) -> BinaryIO:
+        """
+        :param fileobj: сжатые данные, открытые на чтение
+        :return: файловый объект, из которого по частям читаются распакованные данные
+        """
+        return fileobj
+
+
+class StoreCodec(Codec):
+    name = "store"
+
+
+class DeflateCodec(Codec):
+    name = "deflate"
+    compress_type = zipfile.ZIP_DEFLATED
+
+    def __init__(self, level: Optional[int] = None):
+        super().__init__(6 if level is None else level)
+
+    def compress_block(self, data: bytes, last: bool) -> bytes:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    suffix = ".zst"
+
+    def __init__(self, level: Optional[int] = None):
+        super().__init__(3 if level is None else level)
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd codec requires the 'zstandard' package")
+        self._zstandard = zstandard
+
+    def compress_block(self, data: bytes, last: bool) -> bytes:
+        return self._zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressor(self):
+        return self._zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def open_reader(self, fileobj: BinaryIO) -> BinaryIO:
+        return self._zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+
+
+class Lz4Codec(Codec):
+    name = "lz4"
+    suffix = ".lz4"
+
+    def __init__(self, level: Optional[int] = None):
+        super().__init__(0 if level is None else level)
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ValueError("lz4 codec requires the 'lz4' package")
+        self._lz4_frame = lz4.frame
+
+    def compress_block(self, data: bytes, last: bool) -> bytes:
+        return self._lz4_frame.compress(data, compression_level=self.level)
+
+    def compressor(self):
+        return _Lz4StreamCompressor(self._lz4_frame.LZ4FrameCompressor(compression_level=self.level))
+
+    def open_reader(self, fileobj: BinaryIO) -> BinaryIO:
+        return self._lz4_frame.LZ4FrameFile(fileobj)
+
+
+class _Lz4StreamCompressor:
+    def __init__(self, compressor):
+        self._compressor = compressor
+        self._header = compressor.begin()
+
+    def compress(self, data: bytes) -> bytes:
+        header, self._header = self._header, b""
+        return header + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        header, self._header = self._header, b""
+        return header + self._compressor.flush()
+
+
+CODECS = {codec.name: codec for codec in (StoreCodec, DeflateCodec, ZstdCodec, Lz4Codec)}
+
+
+def get_codec(name: str, level: Optional[int] = None) -> Codec:
+    """
+    Возвращает кодек по имени
+    :param name: имя кодека (store, deflate, zstd, lz4)
+    :param level: уровень сжатия, None для уровня по умолчанию
+    :return: объект кодека
+    """
+    if name not in CODECS:
+        raise ValueError("Invalid codec name")
+    return CODECS[name](level)
+
+
+def is_compressible(sample: bytes) -> bool:
+    """
+    Оценивает сжимаемость данных по быстрому сжатию образца
+    :param sample: образец данных
+    :return: True, если сжатие экономит хотя бы MIN_COMPRESSION_GAIN объёма
+    """
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * (1 - MIN_COMPRESSION_GAIN)
+
+
+class CodecSelector:
+    """
+    Выбирает кодек для каждого файла. В автоматическом режиме файлы с расширениями
+    уже сжатых форматов и файлы, образец которых не сжимается, сохраняются без сжатия
+    """
+
+    def __init__(self, codec: Codec, auto: bool = False):
+        self.codec = codec
+        self.auto = auto
+        self._store = StoreCodec()
+
+    def for_file(self, entry: FileStat) -> Codec:
+        """
+        :param entry: запись о файле
+        :return: кодек для файла
+        """
+        if not self.auto or isinstance(self.codec, StoreCodec):
+            return self.codec
+        if os.path.splitext(entry.path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return self._store
+        if entry.size < MIN_SAMPLE_FILE_SIZE:
+            return self.codec
+
+        try:
+            with open(entry.path, "rb") as f:
+                f.seek(max(entry.size // 2 - SAMPLE_SIZE // 2, 0))
+                sample = f.read(SAMPLE_SIZE)
+        except OSError:
+            return self.codec
+        return self.codec if is_compressible(sample) else self._store
+
+    def for_data(self, data: bytes) -> Codec:
+        """
+        :param data: содержимое элемента архива
+        :return: кодек для элемента
+        """
+        if not self.auto or is_compressible(data[:SAMPLE_SIZE]):
+            return self.codec
+        return self._store
+
+
+class HashingReader:
+    """
+    Обёртка над файлом, считающая sha256 прочитанных данных, чтобы хеш содержимого получался
+    в том же проходе, что и сжатие
+    """
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self._digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self._digest.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        """
+        :return: sha256 всего прочитанного
+        """
+        return self._digest.hexdigest()
+
+
+def copy_compressed(src: BinaryIO, dst: BinaryIO, codec: Codec, chunk_size: int = 1024 * 1024) -> None:
+    """
+    Копирует данные в элемент архива, сжимая их кодеком, если zip не сжимает их сам
+    :param src: источник данных
+    :param dst: элемент архива, открытый на запись
+    :param codec: кодек элемента
+    :param chunk_size: размер читаемых блоков
+    """
+    if not codec.suffix:
+        shutil.copyfileobj(src, dst, chunk_size)
+        return
+
+    compressor = codec.compressor()
+    for data in iter(lambda: src.read(chunk_size), b""):
+        dst.write(compressor.compress(data))
+    dst.write(compressor.flush())
+
+
+@contextlib.contextmanager
+def open_member(zf: zipfile.ZipFile, name: str) -> Iterator[BinaryIO]:
+    """
+    Открывает элемент архива на потоковое чтение, распаковывая его, если он был сжат кодеком,
+    который zip не поддерживает
+    :param zf: архив
+    :param name: имя элемента без суффикса кодека
+    :return: файловый объект с распакованным содержимым элемента
+    """
+    codec = StoreCodec()
+    if name not in zf.NameToInfo:
+        for codec_class in CODECS.values():
+            if codec_class.suffix and name + codec_class.suffix in zf.NameToInfo:
+                codec = codec_class()
+                name += codec.suffix
+                break
+        else:
+            raise KeyError(f"There is no item named {name!r} in the archive")
+    with zf.open(name) as src, codec.open_reader(src) as reader:
+        yield reader
+
+
+def read_member(zf: zipfile.ZipFile, name: str) -> bytes:
+    """
+    Читает элемент архива целиком. Подходит для небольших элементов, таких как чанки и манифесты
+    :param zf: архив
+    :param name: имя элемента без суффикса кодека
+    :return: содержимое элемента
+    """
+    with open_member(zf, name) as reader:
+        return reader.read()
@@ -0,0 +1,226 @@
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from backuper.backup_loop import BackupJob
+from backuper.compression import CodecSelector, get_codec
+from backuper.controller import Controller, InfiniteController
+from backuper.defs import daemon_pid_file, processes_info_file
+from backuper.disk_utils import get_disk
+from backuper.disks.base_disk import BaseDisk
+from backuper.hash_cache import DEFAULT_HASH_LIMIT
+from backuper.pipeline import DEFAULT_READ_AHEAD, DEFAULT_UPLOAD_QUEUE
+from backuper.processes_repository import ProcessesRepository
+from backuper.retention import RetentionPolicy
+from backuper.schedule import OVERRUN_SKIP, CronSchedule, Scheduler
+from backuper.utils import lock_daemon_pid, make_app_dirs
+
+DEFAULT_JOB_WORKERS = 8
+POLL_INTERVAL = 5
+
+
+class ScheduledJob:
+    """
+    Зарегистрированная в планировщике задача и её расписание
+    """
+
+    def __init__(self, name: str, info: dict, job: BackupJob, schedule: CronSchedule):
+        self.name = name
+        self.info = info
+        self.job = job
+        self.schedule = schedule
+        self.future: Optional[Future] = None
+
+    @property
+    def running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+
+class BackupDaemon:
+    """
+    Планировщик, который выполняет все задачи бэкапа в одном процессе.
+    Задачи берутся из репозитория процессов: start и stop добавляют и удаляют записи, а планировщик
+    периодически перечитывает репозиторий. Запуски задач выполняются в общем пуле потоков,
+    у каждой задачи свой клиент диска, потому что клиенты хранят HTTP-соединения, которые нельзя
+    использовать из нескольких потоков
+    """
+
+    def __init__(
+            self, processes_repository: ProcessesRepository,
+            workers: int = DEFAULT_JOB_WORKERS, poll_interval: float = POLL_INTERVAL
+    ):
+        self.processes_repository = processes_repository
+        self.poll_interval = poll_interval
+        self.jobs: dict[str, ScheduledJob] = {}
+        self._retired: list[ScheduledJob] = []
+        self._closing: dict[str, Future] = {}
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self._closer = ThreadPoolExecutor(1, thread_name_prefix="close")
+        self._scheduler = Scheduler()
+        self._finished = collections.deque()
+        self._wakeup = threading.Event()
+
+    @staticmethod
+    def get_disk(disk_name: str) -> BaseDisk:
+        """
+        Создаёт клиент диска для новой задачи
+        :param disk_name: имя диска
+        """
+        disk = get_disk(disk_name)()
+        logging.info(f"Authorized in {disk_name} disk")
+        return disk
+
+    def sync(self) -> None:
+        """
+        Приводит набор задач в соответствие с репозиторием процессов.
+        Записи с pid принадлежат отдельным процессам backup_loop и пропускаются.
+        Изменённая задача добавляется заново только после того, как прежняя закрылась,
+        потому что обе работают с одними и теми же индексами и директорией архивов
+        """
+        registered = {
+            name: info for name, info in self.processes_repository.load().items() if "pid" not in info
+        }
+
+        for name, scheduled in list(self.jobs.items()):
+            if registered.get(name) != scheduled.info:
+                logging.info(f"Remove job {name}")
+                self._scheduler.remove(name)
+                self._retired.append(self.jobs.pop(name))
+        self._close_retired()
+
+        for name, info in registered.items():
+            if name in self.jobs or self._is_closing(name):
+                continue
+            try:
+                scheduled = self._make_job(name, info)
+            except Exception as e:
+                logging.exception(e)
+                continue
+            self.jobs[name] = scheduled
+            self._scheduler.add(name, scheduled.schedule.next_fire)
+            logging.info(f"Add job {name} with path {info['path']} and cron {info['cron']}")
+
+    def run_pending(self) -> None:
+        """
+        Ставит завершившиеся задачи на следующий запуск по расписанию
+        и отправляет в пул задачи, время запуска которых наступило
+        """
+        now = time.time()
+        while self._finished:
+            scheduled = self._finished.popleft()
+            if self.jobs.get(scheduled.name) is scheduled:
+                self._scheduler.add(scheduled.name, scheduled.schedule.advance(now))
+
+        for name in self._scheduler.pop_due(now):
+            scheduled = self.jobs[name]
+            scheduled.future = self._pool.submit(self._run, scheduled)
+
+    def run(self, controller: Controller) -> None:
+        """
+        Основной цикл планировщика. Между запусками спит до ближайшего таймера,
+        следующего чтения репозитория или завершения одной из задач
+        """
+        last_sync = None
+        while controller.should_continue():
+            if last_sync is None or time.monotonic() - last_sync >= self.poll_interval:
+                self.sync()
+                last_sync = time.monotonic()
+            self._wakeup.clear()
+            self.run_pending()
+
+            timeout = self.poll_interval - (time.monotonic() - last_sync)
+            next_fire = self._scheduler.next_fire()
+            if next_fire is not None:
+                timeout = min(timeout, next_fire - time.time())
+            self._wakeup.wait(max(timeout, 0))
+
+    def close(self) -> None:
+        """
+        Дожидается завершения запущенных задач и загрузки их архивов
+        """
+        self._retired.extend(self.jobs.values())
+        self.jobs = {}
+        self._pool.shutdown(wait=True)
+        self._close_retired()
+        self._closer.shutdown(wait=True)
+
+    def _make_job(self, name: str, info: dict) -> ScheduledJob:
+        codec = get_codec(info.get("codec", "deflate"), info.get("level"))
+        codec_selector = CodecSelector(codec, info.get("auto", False))
+        job = BackupJob(
+            name, Path(info["path"]), self.get_disk(info["disk"]),
+            info.get("dedup", False), info.get("stream", False), info.get("workers", 1),
+            codec_selector, info.get("upload_workers", 1), info.get("watch", False),
+            RetentionPolicy(info.get("keep_hourly", 0), info.get("keep_daily", 0), info.get("keep_weekly", 0)),
+            info.get("delta", False), info.get("volume_size"),
+            info.get("read_ahead", DEFAULT_READ_AHEAD), info.get("upload_queue", DEFAULT_UPLOAD_QUEUE),
+            info.get("hash_limit", DEFAULT_HASH_LIMIT)
+        )
+        schedule = CronSchedule(info["cron"], info.get("overrun", OVERRUN_SKIP))
+        return ScheduledJob(name, info, job, schedule)
+
+    def _run(self, scheduled: ScheduledJob) -> None:
+        try:
+            scheduled.job.run_once(scheduled.schedule.next_fire)
+        finally:
+            self._finished.append(scheduled)
+            self._wakeup.set()
+
+    def _close_retired(self) -> None:
+        """
+        Закрывает удалённые задачи, которые не выполняются. Закрытие ждёт загрузки архивов,
+        поэтому выполняется в отдельном потоке и не задерживает запуск остальных задач
+        """
+        still_running = []
+        for scheduled in self._retired:
+            if scheduled.running:
+                still_running.append(scheduled)
+            else:
+                self._closing[scheduled.name] = self._closer.submit(self._close_job, scheduled)
+        self._retired = still_running
+
+    def _is_closing(self, name: str) -> bool:
+        """
+        :return: True, если прежний экземпляр задачи ещё выполняется или закрывается
+        """
+        if any(scheduled.name == name for scheduled in self._retired):
+            return True
+        future = self._closing.get(name)
+        if future is not None and future.done():
+            del self._closing[name]
+            future = None
+        return future is not None
+
+    @staticmethod
+    def _close_job(scheduled: ScheduledJob) -> None:
+        try:
+            scheduled.job.close()
+        except Exception as e:
+            logging.exception(e)
+        logging.info(f"Closed job {scheduled.name}")
+
+
+if __name__ == '__main__':  # pragma: no cover
+    make_app_dirs()
+    pid_lock = lock_daemon_pid()
+    if pid_lock is None:
+        raise SystemExit("Backup daemon is already running")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    logging.info("Start backup daemon")
+    daemon = BackupDaemon(ProcessesRepository(processes_info_file))
+    try:
+        daemon.run(InfiniteController())
+    except Exception as e:
+        logging.exception(e)
+    finally:
+        daemon.close()
+        daemon_pid_file.unlink(missing_ok=True)
+        os.close(pid_lock)
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from backuper.archive_maker import RECONCILE_INTERVAL, ArchiveMaker
+from backuper.chunker import MIN_CHUNK_SIZE, AVG_CHUNK_SIZE, MAX_CHUNK_SIZE, iter_chunks
+from backuper.compression import CodecSelector, open_member
+from backuper.file_index import FileIndex
+from backuper.hash_cache import DEFAULT_HASH_LIMIT, HashCache
+from backuper.parallel_zip import ParallelZipWriter
+from backuper.scanner import FileStat
+from backuper.watcher import InotifyWatcher
+
+MANIFEST_NAME = "manifest.json"
+CHUNKS_DIR = "chunks"
+
+
+class ChunkIndex:
+    """
+    Локальный индекс чанков, которые уже лежат в собранных архивах.
+    Для каждого чанка хранит имя архива, в котором он лежит
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "hash TEXT PRIMARY KEY, "
+            "archive TEXT NOT NULL, "
+            "size INTEGER NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get(self, chunk_hash: str) -> Optional[str]:
+        """
+        Возвращает имя архива, содержащего чанк
+        :param chunk_hash: хеш чанка
+        :return: имя архива или None, если чанка нет на диске
+        """
+        row = self.connection.execute("SELECT archive FROM chunks WHERE hash = ?", (chunk_hash,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, chunks: dict[str, tuple[str, int]]) -> None:
+        """
+        Добавляет загруженные чанки в индекс
+        :param chunks: словарь хеш -> (имя архива, размер)
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO chunks (hash, archive, size) VALUES (?, ?, ?)",
+                ((chunk_hash, archive, size) for chunk_hash, (archive, size) in chunks.items())
+            )
+
+    def remove_archive(self, archive: str) -> None:
+        """
+        Удаляет из индекса чанки, которые лежат в архиве
+        :param archive: имя архива
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM chunks WHERE archive = ?", (archive,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __contains__(self, item):
+        return self.get(item) is not None
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+class DedupArchiveMaker(ArchiveMaker):
+    """
+    Собирает дедуплицирующие снимки: изменённые файлы режутся на чанки по содержимому,
+    в архив попадают только чанки, которых ещё нет на диске, и манифест со ссылками на чанки
+    """
+    min_chunk_size = MIN_CHUNK_SIZE
+    avg_chunk_size = AVG_CHUNK_SIZE
+    max_chunk_size = MAX_CHUNK_SIZE
+
+    def __init__(
+            self, path, file_index: Optional[FileIndex] = None,
+            chunk_index: Optional[ChunkIndex] = None, workers: int = 1,
+            codec_selector: Optional[CodecSelector] = None,
+            watcher: Optional[InotifyWatcher] = None, reconcile_interval: float = RECONCILE_INTERVAL,
+            volume_size: Optional[int] = None,
+            hash_cache: Optional[HashCache] = None, hash_limit: Optional[int] = DEFAULT_HASH_LIMIT
+    ):
+        super().__init__(
+            path, file_index, workers, codec_selector, watcher, reconcile_interval, volume_size,
+            hash_cache=hash_cache, hash_limit=hash_limit
+        )
+        self.chunk_index = chunk_index if chunk_index is not None else ChunkIndex()
+        self._new_chunks = {}
+
+    def write_archive(
+            self, target, archive_name: str, files: Iterable[FileStat],
+            on_hashed: Optional[Callable[[FileStat, str], None]] = None
+    ) -> None:
+        """
+        Пишет снимок: новые чанки изменённых файлов и манифест со ссылками на чанки
+        :param target: путь до архива или файловый объект
+        :param archive_name: имя архива на диске, на которое будут ссылаться новые чанки
+        :param files: записи о файлах для архивации
+        :param on_hashed: вызывается с sha256 каждого файла, посчитанным по его чанкам
+        """
+        new_chunks = {}
+        manifest_files = []
+
+        with zipfile.ZipFile(target, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            writer = ParallelZipWriter(zf, self.workers) if self.workers > 1 else None
+            try:
+                for entry in files:
+                    file_chunks = []
+                    digest = hashlib.sha256()
+                    with open(entry.path, "rb") as f:
+                        for chunk in iter_chunks(f, self.min_chunk_size, self.avg_chunk_size, self.max_chunk_size):
+                            digest.update(chunk)
+                            chunk_hash = hashlib.sha256(chunk).hexdigest()
+                            location = self.chunk_index.get(chunk_hash)
+                            if location is None and chunk_hash in self._new_chunks:
+                                location = self._new_chunks[chunk_hash][0]
+                            if location is None:
+                                if chunk_hash not in new_chunks:
+                                    self._write_chunk(zf, writer, chunk_hash, chunk)
+                                    new_chunks[chunk_hash] = (archive_name, len(chunk))
+                                location = archive_name
+                            file_chunks.append([chunk_hash, location])
+                    if on_hashed is not None:
+                        on_hashed(entry, digest.hexdigest())
+
+                    manifest_files.append({
+                        "path": os.path.relpath(entry.path, self.path).replace(os.sep, "/"),
+                        "size": entry.size,
+                        "mtime_ns": entry.mtime_ns,
+                        "mode": entry.mode,
+                        "chunks": file_chunks,
+                    })
+
+                if writer is not None:
+                    writer.flush()
+            finally:
+                if writer is not None:
+                    writer.shutdown()
+
+            zf.writestr(MANIFEST_NAME, json.dumps({"root": str(self.path), "files": manifest_files}))
+
+        self._new_chunks.update(new_chunks)
+
+    def _write_chunk(
+            self, zf: zipfile.ZipFile, writer: Optional[ParallelZipWriter], chunk_hash: str, chunk: bytes
+    ) -> None:
+        codec = self.codec_selector.for_data(chunk)
+        zinfo = zipfile.ZipInfo(f"{CHUNKS_DIR}/{chunk_hash}{codec.suffix}", time.localtime()[:6])
+        zinfo.compress_type = codec.compress_type
+        zinfo._compresslevel = codec.level
+        if writer is not None:
+            writer.writestr(zinfo, chunk, codec)
+        elif codec.suffix:
+            zf.writestr(zinfo, codec.compress_block(chunk, last=True))
+        else:
+            zf.writestr(zinfo, chunk)
+
+    def make_fresh_archive(self, on_volume: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        try:
+            archive_path = super().make_fresh_archive(on_volume)
+        except BaseException:
+            self._new_chunks = {}
+            raise
+        self._commit_chunks()
+        return archive_path
+
+    def stream_fresh_archive(self, disk, on_volume: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        try:
+            archive_name = super().stream_fresh_archive(disk, on_volume)
+        except BaseException:
+            self._new_chunks = {}
+            raise
+        self._commit_chunks()
+        return archive_name
+
+    def discard(self, archive_path: str) -> None:
+        self.chunk_index.remove_archive(os.path.basename(archive_path))
+        super().discard(archive_path)
+
+    def _commit_chunks(self) -> None:
+        self.chunk_index.add(self._new_chunks)
+        self._new_chunks = {}
+
+
+def restore_snapshot(archive_path: Path, target_dir: Path) -> None:
+    """
+    Восстанавливает файлы из дедуплицирующего снимка.
+    Архивы, на чанки которых ссылается манифест, должны лежать рядом со снимком
+    :param archive_path: путь до архива снимка
+    :param target_dir: директория, в которую восстанавливаются файлы
+    """
+    archive_path = Path(archive_path)
+    opened_archives = {}
+    try:
+        snapshot = zipfile.ZipFile(archive_path)
+        opened_archives[archive_path.name] = snapshot
+        manifest = json.loads(snapshot.read(MANIFEST_NAME))
+
+        for file_info in manifest["files"]:
+            file_path = Path(target_dir) / file_info["path"]
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(file_path, "wb") as f:
+                for chunk_hash, archive_name in file_info["chunks"]:
+                    if archive_name not in opened_archives:
+                        opened_archives[archive_name] = zipfile.ZipFile(archive_path.parent / archive_name)
+                    with open_member(opened_archives[archive_name], f"{CHUNKS_DIR}/{chunk_hash}") as reader:
+                        shutil.copyfileobj(reader, f, 1024 * 1024)
+            os.chmod(file_path, file_info["mode"] & 0o7777)
+            os.utime(file_path, ns=(file_info["mtime_ns"], file_info["mtime_ns"]))
+    finally:
+        for archive in opened_archives.values():
+            archive.close()
@@ -2,9 +2,18 @@ from pathlib import Path
 
 root_save = Path.home() / ".backuper"
 
-processes_info_file = root_save / "processes.json"
+processes_info_file = root_save / "processes.sqlite"
+daemon_pid_file = root_save / "daemon.pid"
 secrets_file = root_save / "secrets.json"
 archives_dir = root_save / "archives"
+indexes_dir = root_save / "indexes"
+upload_sessions_file = root_save / "uploads.sqlite"
+remote_manifest_file = root_save / "remote.sqlite"
+restore_index_file = root_save / "restore.sqlite"
+catalog_file = root_save / "catalog.sqlite"
+cache_file = root_save / "cache.sqlite"
+metrics_file = root_save / "metrics.sqlite"
+metrics_textfile = root_save / "backuper.prom"
 logs_file = root_save / "logs.txt"
 google_secrets_file = root_save / "google_secrets.json"
 google_credentials = root_save / "mycreds.json"
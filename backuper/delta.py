@@ -0,0 +1,470 @@
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from typing import BinaryIO, Callable, Iterable, NamedTuple, Optional
+
+from backuper.archive_maker import RECONCILE_INTERVAL, ArchiveMaker
+from backuper.compression import CodecSelector, HashingReader, copy_compressed
+from backuper.file_index import FileIndex
+from backuper.hash_cache import DEFAULT_HASH_LIMIT, HashCache
+from backuper.scanner import FileStat
+from backuper.utils import make_zip_info
+from backuper.watcher import InotifyWatcher
+
+DELTA_SUFFIX = ".bkdelta"
+DELTA_COMMENT_PREFIX = "delta:"
+DELTA_MIN_SIZE = 8 * 1024 * 1024
+DELTA_BLOCK_SIZE = 64 * 1024
+MAX_BLOCKS = 1 << 18
+# после стольких дельт подряд файл снова сохраняется целиком, чтобы восстановление не разбирало длинные цепочки
+MAX_CHAIN_LENGTH = 8
+DEFAULT_SIGNATURE_CACHE_SIZE = 256 * 1024 * 1024
+STRONG_HASH_SIZE = 16
+ADLER_MOD = 65521
+# поиск сдвинутого блока побайтно идёт в Python, поэтому после нескольких неудачных поисков подряд
+# сравниваются только блоки на текущей позиции, а поиск повторяется раз в ROLL_RETRY_INTERVAL блоков
+MAX_FAILED_ROLLS = 4
+ROLL_RETRY_INTERVAL = 64
+LITERAL_BUFFER_SIZE = 1024 * 1024
+
+DELTA_MAGIC = b"BKDELTA1"
+OP_END, OP_COPY, OP_LITERAL = 0, 1, 2
+BLOCK_RECORD = struct.Struct(f"<I{STRONG_HASH_SIZE}s")
+
+
+class Signature(NamedTuple):
+    """
+    Подписи блоков версии файла: слабая кольцевая сумма adler32 и сильный хеш каждого блока
+    """
+    block_size: int
+    blocks: list[tuple[int, bytes]]
+
+
+class StoredSignature(NamedTuple):
+    """
+    Подпись последней сохранённой версии файла
+    """
+    archive: str
+    chain: list[str]
+    signature: Signature
+
+
+def choose_block_size(size: int) -> int:
+    """
+    :param size: размер файла
+    :return: размер блока, при котором у файла не больше MAX_BLOCKS блоков
+    """
+    block_size = DELTA_BLOCK_SIZE
+    while size > block_size * MAX_BLOCKS:
+        block_size *= 2
+    return block_size
+
+
+def strong_hash(block: bytes) -> bytes:
+    return hashlib.blake2b(block, digest_size=STRONG_HASH_SIZE).digest()
+
+
+def compute_signature(f: BinaryIO, block_size: int) -> Signature:
+    """
+    :param f: файл, открытый на чтение
+    :param block_size: размер блока
+    :return: подписи блоков файла
+    """
+    blocks = [(zlib.adler32(block), strong_hash(block)) for block in iter(lambda: f.read(block_size), b"")]
+    return Signature(block_size, blocks)
+
+
+class SigningReader:
+    """
+    Обёртка над файлом, считающая подпись прочитанных данных. Подпись считается по тем же байтам,
+    что попали в архив, поэтому следующая дельта не разойдётся с сохранённой версией, даже если файл
+    менялся во время чтения
+    """
+
+    def __init__(self, f: BinaryIO, block_size: int):
+        self.f = f
+        self.block_size = block_size
+        self.blocks = []
+        self._pending = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self._pending += data
+        if len(self._pending) >= self.block_size:
+            full = len(self._pending) - len(self._pending) % self.block_size
+            with memoryview(self._pending) as view:
+                for start in range(0, full, self.block_size):
+                    with view[start:start + self.block_size] as block:
+                        self.blocks.append((zlib.adler32(block), strong_hash(block)))
+            del self._pending[:full]
+        return data
+
+    def signature(self) -> Signature:
+        """
+        :return: подпись всего прочитанного
+        """
+        if self._pending:
+            self.blocks.append((zlib.adler32(self._pending), strong_hash(self._pending)))
+            self._pending = bytearray()
+        return Signature(self.block_size, self.blocks)
+
+
+def pack_blocks(blocks: list[tuple[int, bytes]]) -> bytes:
+    return b"".join(BLOCK_RECORD.pack(weak, strong) for weak, strong in blocks)
+
+
+def unpack_blocks(data: bytes) -> list[tuple[int, bytes]]:
+    return list(BLOCK_RECORD.iter_unpack(data))
+
+
+class DeltaWriter:
+    """
+    Пишет операции дельты, склеивая соседние копирования и накапливая литералы
+    """
+
+    def __init__(self, out: BinaryIO):
+        self.out = out
+        self.copied = 0
+        self.literal = 0
+        self._copy = None
+        self._literal = bytearray()
+        out.write(DELTA_MAGIC)
+
+    def copy(self, offset: int, length: int) -> None:
+        self._flush_literal()
+        if self._copy is not None and self._copy[0] + self._copy[1] == offset:
+            self._copy = (self._copy[0], self._copy[1] + length)
+        else:
+            self._flush_copy()
+            self._copy = (offset, length)
+        self.copied += length
+
+    def add_literal(self, data: bytes) -> None:
+        self._flush_copy()
+        self._literal += data
+        self.literal += len(data)
+        if len(self._literal) >= LITERAL_BUFFER_SIZE:
+            self._flush_literal()
+
+    def close(self) -> None:
+        self._flush_copy()
+        self._flush_literal()
+        self.out.write(bytes([OP_END]) + struct.pack("<Q", self.copied + self.literal))
+
+    def _flush_copy(self) -> None:
+        if self._copy is not None:
+            self.out.write(bytes([OP_COPY]) + struct.pack("<QQ", *self._copy))
+            self._copy = None
+
+    def _flush_literal(self) -> None:
+        if self._literal:
+            self.out.write(bytes([OP_LITERAL]) + struct.pack("<Q", len(self._literal)))
+            self.out.write(self._literal)
+            self._literal = bytearray()
+
+
+def write_delta(src: BinaryIO, signature: Signature, out: BinaryIO) -> tuple[int, int]:
+    """
+    Пишет дельту файла относительно версии с известной подписью по алгоритму rsync.
+    Сначала блок сравнивается с подписями по слабой сумме, а при совпадении — по сильному хешу.
+    Если блок не найден, кольцевая сумма сдвигается побайтно, чтобы найти блоки, сдвинутые вставкой
+    :param src: новая версия файла
+    :param signature: подпись предыдущей версии
+    :param out: куда писать дельту
+    :return: (скопировано из предыдущей версии, передано литералами) в байтах
+    """
+    block_size = signature.block_size
+    table: dict[int, dict[bytes, int]] = {}
+    for number, (weak, strong) in enumerate(signature.blocks):
+        table.setdefault(weak, {}).setdefault(strong, number)
+
+    def find(weak: int, start: int, end: int) -> Optional[int]:
+        candidates = table.get(weak)
+        if candidates is None:
+            return None
+        return candidates.get(strong_hash(bytes(buffer[start:end])))
+
+    writer = DeltaWriter(out)
+    buffer = bytearray()
+    pos = 0
+    eof = False
+    failed_rolls = 0
+    literal_blocks = 0
+
+    def fill(needed: int) -> None:
+        nonlocal buffer, pos, eof
+        if pos > len(buffer) // 2 and pos > block_size:
+            del buffer[:pos]
+            pos = 0
+        while not eof and len(buffer) - pos < needed:
+            data = src.read(max(needed, 4 * block_size))
+            if not data:
+                eof = True
+            buffer += data
+
+    while True:
+        fill(2 * block_size)
+        end = min(pos + block_size, len(buffer))
+        if pos == end:
+            break
+
+        weak = zlib.adler32(bytes(buffer[pos:end]))
+        number = find(weak, pos, end)
+        if number is not None:
+            writer.copy(number * block_size, end - pos)
+            pos = end
+            failed_rolls = literal_blocks = 0
+            continue
+
+        roll = end - pos == block_size and (failed_rolls < MAX_FAILED_ROLLS or literal_blocks % ROLL_RETRY_INTERVAL == 0)
+        shift = _roll(buffer, pos, block_size, weak, find) if roll else None
+        if shift is not None:
+            writer.add_literal(bytes(buffer[pos:pos + shift]))
+            pos += shift
+            failed_rolls = literal_blocks = 0
+            continue
+
+        if roll:
+            failed_rolls += 1
+        literal_blocks += 1
+        writer.add_literal(bytes(buffer[pos:end]))
+        pos = end
+
+    writer.close()
+    return writer.copied, writer.literal
+
+
+def _roll(buffer: bytearray, pos: int, block_size: int, weak: int, find) -> Optional[int]:
+    """
+    Сдвигает окно размером в блок побайтно, пересчитывая кольцевую сумму adler32
+    :return: сдвиг, на котором окно совпало с блоком предыдущей версии, или None
+    """
+    a, b = weak & 0xFFFF, weak >> 16
+    last = min(pos + 2 * block_size, len(buffer)) - block_size
+    for start in range(pos, last):
+        removed, added = buffer[start], buffer[start + block_size]
+        a = (a - removed + added) % ADLER_MOD
+        b = (b - block_size * removed + a - 1) % ADLER_MOD
+        if find((b << 16) | a, start + 1, start + 1 + block_size) is not None:
+            return start + 1 - pos
+    return None
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated delta")
+    return data
+
+
+def apply_delta(base: BinaryIO, delta: BinaryIO, out: BinaryIO, chunk_size: int = 1024 * 1024) -> None:
+    """
+    Восстанавливает новую версию файла из предыдущей и дельты
+    :param base: предыдущая версия, открытая на чтение
+    :param delta: дельта
+    :param out: куда писать новую версию
+    """
+    if _read_exact(delta, len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError("Not a delta")
+    written = 0
+    while True:
+        op = _read_exact(delta, 1)[0]
+        if op == OP_END:
+            target_size, = struct.unpack("<Q", _read_exact(delta, 8))
+            break
+        if op == OP_COPY:
+            offset, length = struct.unpack("<QQ", _read_exact(delta, 16))
+            base.seek(offset)
+            source = base
+        elif op == OP_LITERAL:
+            length, = struct.unpack("<Q", _read_exact(delta, 8))
+            source = delta
+        else:
+            raise ValueError(f"Unknown delta operation {op}")
+        written += length
+        while length:
+            data = _read_exact(source, min(length, chunk_size))
+            out.write(data)
+            length -= len(data)
+    if written != target_size:
+        raise ValueError(f"Delta produced {written} bytes instead of {target_size}")
+
+
+class SignatureStore:
+    """
+    Ограниченный по объёму кэш подписей последних сохранённых версий больших файлов.
+    Когда объём превышен, удаляются подписи, которые дольше всего не использовались,
+    и такие файлы при следующем изменении сохраняются целиком
+    """
+
+    def __init__(self, db_path: str = ":memory:", max_bytes: int = DEFAULT_SIGNATURE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "path TEXT PRIMARY KEY, "
+            "archive TEXT NOT NULL, "
+            "chain TEXT NOT NULL, "
+            "block_size INTEGER NOT NULL, "
+            "blocks BLOB NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS signatures_archive ON signatures (archive)")
+        self.connection.commit()
+
+    def get(self, path: str) -> Optional[StoredSignature]:
+        """
+        :param path: путь до файла
+        :return: подпись последней сохранённой версии или None
+        """
+        with self._lock, self.connection:
+            row = self.connection.execute(
+                "SELECT archive, chain, block_size, blocks FROM signatures WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE signatures SET last_used = ? WHERE path = ?", (time.time(), path))
+        archive, chain, block_size, blocks = row
+        return StoredSignature(archive, json.loads(chain), Signature(block_size, unpack_blocks(blocks)))
+
+    def put(self, signatures: dict[str, StoredSignature]) -> None:
+        """
+        Сохраняет подписи новых версий файлов и вытесняет старые подписи, если кэш переполнен
+        :param signatures: словарь путь -> подпись
+        """
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO signatures (path, archive, chain, block_size, blocks, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((path, stored.archive, json.dumps(stored.chain), stored.signature.block_size,
+                  pack_blocks(stored.signature.blocks), now) for path, stored in signatures.items())
+            )
+            rows = self.connection.execute(
+                "SELECT path, LENGTH(blocks) FROM signatures ORDER BY last_used DESC"
+            ).fetchall()
+            total = 0
+            evicted = []
+            for path, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    evicted.append((path,))
+            self.connection.executemany("DELETE FROM signatures WHERE path = ?", evicted)
+
+    def remove_archive(self, archive: str) -> None:
+        """
+        Удаляет подписи версий, сохранённых в архиве
+        :param archive: имя архива
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM signatures WHERE archive = ?", (archive,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+
+class DeltaArchiveMaker(ArchiveMaker):
+    """
+    Собирает архивы, в которых большие изменённые файлы хранятся дельтой относительно их версии
+    в предыдущем бэкапе: ссылками на блоки предыдущей версии и новыми данными.
+    В комментарии элемента дельты перечислены архивы с предыдущими версиями, начиная с полной копии
+    """
+
+    def __init__(
+            self, path, file_index: Optional[FileIndex] = None,
+            signature_store: Optional[SignatureStore] = None, workers: int = 1,
+            codec_selector: Optional[CodecSelector] = None,
+            watcher: Optional[InotifyWatcher] = None, reconcile_interval: float = RECONCILE_INTERVAL,
+            min_delta_size: int = DELTA_MIN_SIZE, volume_size: Optional[int] = None,
+            hash_cache: Optional[HashCache] = None, hash_limit: Optional[int] = DEFAULT_HASH_LIMIT
+    ):
+        super().__init__(
+            path, file_index, workers, codec_selector, watcher, reconcile_interval, volume_size,
+            hash_cache=hash_cache, hash_limit=hash_limit
+        )
+        self.signature_store = signature_store if signature_store is not None else SignatureStore()
+        self.min_delta_size = min_delta_size
+        self._new_signatures = {}
+
+    def write_archive(
+            self, target, archive_name: str, files: Iterable[FileStat],
+            on_hashed: Optional[Callable[[FileStat, str], None]] = None
+    ) -> None:
+        """
+        Пишет архив: большие файлы с подписью предыдущей версии — дельтой, остальные — целиком.
+        Элементы пишутся по одному, поэтому workers не используется
+        :param target: путь до архива или файловый объект
+        :param archive_name: имя архива на диске, на которое будут ссылаться следующие дельты
+        :param files: записи о файлах для архивации
+        :param on_hashed: вызывается с sha256 каждого файла, посчитанным в том же проходе, что и запись
+        """
+        new_signatures = {}
+        with zipfile.ZipFile(target, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for entry in files:
+                arcname = os.path.relpath(entry.path, self.path)
+                if entry.size < self.min_delta_size:
+                    codec = self.codec_selector.for_file(entry)
+                    with open(entry.path, "rb") as f, zf.open(make_zip_info(entry, arcname, codec), "w") as dst:
+                        hashing = HashingReader(f)
+                        copy_compressed(hashing, dst, codec)
+                    if on_hashed is not None:
+                        on_hashed(entry, hashing.hexdigest())
+                    continue
+
+                stored = self.signature_store.get(entry.path)
+                with open(entry.path, "rb") as f:
+                    hashing = HashingReader(f)
+                    src = SigningReader(hashing, choose_block_size(entry.size))
+                    if stored is not None and len(stored.chain) + 1 < MAX_CHAIN_LENGTH:
+                        chain = stored.chain + [stored.archive]
+                        zinfo = make_zip_info(entry, arcname + DELTA_SUFFIX)
+                        zinfo.comment = (DELTA_COMMENT_PREFIX + ",".join(chain)).encode()
+                        with zf.open(zinfo, "w", force_zip64=True) as dst:
+                            write_delta(src, stored.signature, dst)
+                    else:
+                        chain = []
+                        codec = self.codec_selector.for_file(entry)
+                        with zf.open(make_zip_info(entry, arcname, codec), "w") as dst:
+                            copy_compressed(src, dst, codec)
+                new_signatures[entry.path] = StoredSignature(archive_name, chain, src.signature())
+                if on_hashed is not None:
+                    on_hashed(entry, hashing.hexdigest())
+        self._new_signatures.update(new_signatures)
+
+    def make_fresh_archive(self, on_volume: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        try:
+            archive_path = super().make_fresh_archive(on_volume)
+        except BaseException:
+            self._new_signatures = {}
+            raise
+        self._commit_signatures()
+        return archive_path
+
+    def stream_fresh_archive(self, disk, on_volume: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        try:
+            archive_name = super().stream_fresh_archive(disk, on_volume)
+        except BaseException:
+            self._new_signatures = {}
+            raise
+        self._commit_signatures()
+        return archive_name
+
+    def discard(self, archive_path: str) -> None:
+        self.signature_store.remove_archive(os.path.basename(archive_path))
+        super().discard(archive_path)
+
+    def _commit_signatures(self) -> None:
+        self.signature_store.put(self._new_signatures)
+        self._new_signatures = {}
@@ -3,6 +3,7 @@ from typing import Type
 from .utils import extract_secrets_from_json
 from .disks.base_disk import BaseDisk
 from .disks.google_disk import GoogleDisk
+from .disks.local_disk import LocalDisk
 from .disks.yandex_disk import YandexDisk
 
 
@@ -17,6 +18,8 @@ def get_disk(name: str) -> Type[BaseDisk]:
         return YandexDisk
     if name == "google":
         return GoogleDisk
+    if name == "local":
+        return LocalDisk
     else:
         raise ValueError("Invalid disk name")
 
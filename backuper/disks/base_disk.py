@@ -1,9 +1,22 @@
 import abc
+import io
+import logging
 import re
-from typing import Optional
+import time
+from typing import BinaryIO, Optional
 
+import requests
+
+from backuper.download_engine import DEFAULT_DOWNLOAD_CONNECTIONS, DownloadEngine, RangeReader
+from backuper.remote_manifest import RemoteFile
 from backuper.utils import extract_secrets_from_json, save_secrets
 
+MANIFEST_TTL = 15 * 60
+REMOTE_READ_BUFFER = 256 * 1024
+FILE_MANIFEST_SUFFIX = ".files.json.gz"
+DELETE_BATCH_SIZE = 50
+DELETE_RATE = 10
+
 
 class BaseDisk: # pragma: no cover
     """
@@ -47,18 +60,146 @@ class BaseDisk: # pragma: no cover
         """
 
     @abc.abstractmethod
-    def list_of_files(self) -> list[str]: \
+    def upload_stream(self, stream: BinaryIO, filename: str) -> None: \
+        """
+        Загружает на диск данные из потока заранее неизвестного размера
+        :param stream: поток, чтение из которого возвращает пустые байты в конце данных
+        :param filename: имя файла на диске
+        """
+
+    def list_of_files(self, refresh: bool = False) -> list[str]:
         """
         Извлекает список файлов, находящихся на диске
+        :param refresh: обойти диск заново, не доверяя локальному манифесту
         :return: список файлов
         """
+        return self.filter_files([remote_file.name for remote_file in self.remote_files(refresh)])
+
+    def remote_files(self, refresh: bool = False) -> list[RemoteFile]:
+        """
+        Возвращает бэкапы и их списки файлов на диске из локального манифеста, обновляя его, если он устарел
+        :param refresh: обойти диск заново, не доверяя манифесту
+        :return: записи о файлах
+        """
+        disk_name = self.__class__.__name__
+        if refresh or not self.manifest.is_fresh(disk_name, MANIFEST_TTL):
+            self._refresh_manifest(full=refresh)
+        return self.manifest.list(disk_name)
+
+    def find_remote_file(self, filename: str) -> Optional[RemoteFile]:
+        """
+        Находит бэкап по имени в манифесте, а если его там нет, обновляет манифест и ищет ещё раз
+        :param filename: имя бэкапа
+        :return: запись о бэкапе или None, если его нет на диске
+        """
+        disk_name = self.__class__.__name__
+        remote_file = self.manifest.get(disk_name, filename)
+        if remote_file is None:
+            self._refresh_manifest(full=False)
+            remote_file = self.manifest.get(disk_name, filename)
+        return remote_file
+
+    def _refresh_manifest(self, full: bool) -> None:
+        """
+        Сверяет манифест с диском. По умолчанию диск обходится целиком,
+        диски с журналом изменений могут применять только изменения
+        :param full: обойти диск целиком
+        """
+        self.manifest.replace_all(self.__class__.__name__, self._list_remote())
 
     @abc.abstractmethod
-    def download(self, filename: str) -> None: \
+    def _list_remote(self) -> list[RemoteFile]: \
         """
-        Скачивает запрошенный файл с диска
+        Обходит корень диска
+        :return: записи о всех бэкапах на диске
         """
 
+    def download(
+            self, filename: str, connections: int = DEFAULT_DOWNLOAD_CONNECTIONS, destination: Optional[str] = None
+    ) -> None:
+        """
+        Скачивает запрошенный файл с диска в несколько соединений
+        :param filename: имя файла на диске
+        :param connections: количество одновременных range-запросов
+        :param destination: куда сохранить файл, по умолчанию в текущую директорию под тем же именем
+        """
+        remote_file = self.find_remote_file(filename)
+        if remote_file is None:
+            raise ValueError("No such file on disk")
+
+        destination = filename if destination is None else str(destination)
+        engine = DownloadEngine(connections)
+        try:
+            engine.download(self._download_url(remote_file), destination, remote_file.size,
+                            remote_file.checksum, self._download_headers)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            self._refresh_manifest(full=False)
+            remote_file = self.manifest.get(self.__class__.__name__, filename)
+            if remote_file is None:
+                raise ValueError("No such file on disk")
+            engine.download(self._download_url(remote_file), destination, remote_file.size,
+                            remote_file.checksum, self._download_headers)
+
+    def open_remote(self, remote_file: RemoteFile) -> io.BufferedReader:
+        """
+        Открывает файл на диске на чтение с произвольного места без скачивания целиком
+        :param remote_file: запись о файле из манифеста
+        :return: файловый объект с поддержкой seek
+        """
+        if remote_file.size is None:
+            raise ValueError(f"Size of {remote_file.name} is unknown")
+        reader = RangeReader(self._download_url(remote_file), remote_file.size, self._download_headers)
+        return io.BufferedReader(reader, buffer_size=REMOTE_READ_BUFFER)
+
+    def delete_files(
+            self, remote_files: list[RemoteFile], batch_size: int = DELETE_BATCH_SIZE, rate: float = DELETE_RATE
+    ) -> list[RemoteFile]:
+        """
+        Удаляет файлы с диска пачками, не превышая заданную частоту удалений
+        :param remote_files: записи о файлах
+        :param batch_size: количество файлов в одном запросе
+        :param rate: максимум удалений в секунду
+        :return: записи об удалённых файлах
+        """
+        deleted = []
+        for start in range(0, len(remote_files), batch_size):
+            batch = remote_files[start:start + batch_size]
+            started = time.monotonic()
+            try:
+                batch_deleted = self._delete_batch(batch)
+            except Exception as e:
+                logging.exception(e)
+                batch_deleted = []
+            self.manifest.remove_ids(self.__class__.__name__, [remote_file.remote_id for remote_file in batch_deleted])
+            deleted.extend(batch_deleted)
+
+            if start + batch_size < len(remote_files):
+                time.sleep(max(len(batch) / rate - (time.monotonic() - started), 0))
+        return deleted
+
+    @abc.abstractmethod
+    def _delete_batch(self, remote_files: list[RemoteFile]) -> list[RemoteFile]: \
+        """
+        Удаляет пачку файлов с диска
+        :param remote_files: записи о файлах
+        :return: записи об удалённых файлах, в том числе уже отсутствовавших на диске
+        """
+
+    @abc.abstractmethod
+    def _download_url(self, remote_file: RemoteFile) -> str: \
+        """
+        :param remote_file: запись о бэкапе
+        :return: ссылка на содержимое файла, поддерживающая range-запросы
+        """
+
+    def _download_headers(self) -> dict:
+        """
+        :return: заголовки для запросов на скачивание
+        """
+        return {}
+
     @staticmethod
     def filter_files(files: list) -> list:
         """
@@ -68,6 +209,16 @@ class BaseDisk: # pragma: no cover
         """
         return list(filter(lambda x: re.fullmatch(r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_.*.zip", x), files))
 
+    @classmethod
+    def is_tracked(cls, name: str) -> bool:
+        """
+        Проверяет, попадает ли файл на диске в манифест: это бэкап или список файлов бэкапа
+        :param name: имя файла на диске
+        """
+        if name.endswith(FILE_MANIFEST_SUFFIX):
+            name = name[:-len(FILE_MANIFEST_SUFFIX)]
+        return bool(cls.filter_files([name]))
+
 
     def __repr__(self):
         return f"{self.__class__.__name__}()"
\ No newline at end of file
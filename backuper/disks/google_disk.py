@@ -1,5 +1,8 @@
 import json
+import logging
 import os
+import threading
+import time
 
 import requests
 from pydrive.auth import GoogleAuth
@@ -7,15 +10,26 @@ from pydrive.drive import GoogleDrive
 
 from backuper.utils import extract_secrets_from_json
 from .base_disk import BaseDisk
-from backuper.defs import google_secrets_file, google_credentials
+from backuper.defs import google_secrets_file, google_credentials, upload_sessions_file, remote_manifest_file
+from backuper.remote_manifest import RemoteFile, RemoteManifest
+from backuper.upload_sessions import UploadSessions
+
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v2/files"
+UPLOAD_CHUNK_SIZE = 32 * 256 * 1024
+UPLOAD_RETRIES = 5
+CHANGES_FIELDS = "items(deleted,fileId,file(id,title,fileSize,md5Checksum,parents(isRoot),labels(trashed)))," \
+                 "nextPageToken,newStartPageToken"
 
 
 class GoogleDisk(BaseDisk): # pragma: no cover
     """
-    Класс для работы с Google Drive
+    Класс для работы с Google Drive. Запросы через pydrive и googleapiclient идут по одному соединению httplib2,
+    которое нельзя использовать из нескольких потоков, поэтому они выполняются под self._http_lock.
+    Загрузка и скачивание данных идут через requests и выполняются параллельно
     """
 
     def __init__(self):
+        self._http_lock = threading.RLock()
         self.gauth = GoogleAuth()
         secrets = extract_secrets_from_json(self.__class__.__name__)
         if not secrets:
@@ -24,6 +38,8 @@ class GoogleDisk(BaseDisk): # pragma: no cover
         self.gauth.LoadCredentialsFile(google_credentials)
         self.drive = GoogleDrive(self.gauth)
         self.root_path = 'root'
+        self.upload_sessions = UploadSessions(upload_sessions_file)
+        self.manifest = RemoteManifest(remote_manifest_file)
 
     def _auth_app(self):
         client_id = input("input client id: ")
@@ -51,24 +67,257 @@ class GoogleDisk(BaseDisk): # pragma: no cover
         self.gauth.SaveCredentialsFile(google_credentials)
 
     def upload(self, file_to_upload_path) -> None:
-        file_drive = self.drive.CreateFile({'title': os.path.basename(file_to_upload_path)})
-        file_drive.SetContentFile(file_to_upload_path)
-        file_drive.Upload()
-        print("Upload finished")
-
-    def list_of_files(self) -> list[str]:
-        file_list = self.drive.ListFile({'q': "'root' in parents and trashed=false"}).GetList()
-        names = [file['title'] for file in file_list]
-        return self.filter_files(names)
-
-    def download(self, filename: str) -> None:
-        file_list = self.drive.ListFile({'q': "'root' in parents and trashed=false"}).GetList()
-        for file in file_list:
-            if file['title'] == filename:
-                file.GetContentFile(filename)
+        path = str(file_to_upload_path)
+        stat = os.stat(path)
+        size = stat.st_size
+        disk_name = self.__class__.__name__
+
+        offset = None
+        session = self.upload_sessions.get(disk_name, path, size, stat.st_mtime_ns)
+        if session is not None:
+            session_url, _ = session
+            offset = self._query_upload_offset(session_url, size)
+        if offset is None:
+            session_url = self._create_upload_session(os.path.basename(path))
+            offset = 0
+            self.upload_sessions.save(disk_name, path, session_url, size, stat.st_mtime_ns, offset)
+
+        retries = 0
+        with open(path, "rb") as f:
+            while True:
+                f.seek(offset)
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                if chunk:
+                    content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+                else:
+                    content_range = f"bytes */{size}"
+
+                try:
+                    response = requests.put(
+                        session_url, data=chunk, headers={"Content-Range": content_range}, timeout=250
+                    )
+                except requests.RequestException:
+                    response = None
+
+                if response is not None and response.status_code in (200, 201):
+                    self._record_upload(response)
+                    break
+                if response is not None and response.status_code == 308:
+                    offset = self._confirmed_offset(response)
+                    self.upload_sessions.save(disk_name, path, session_url, size, stat.st_mtime_ns, offset)
+                    retries = 0
+                    continue
+                if response is not None and response.status_code < 500:
+                    raise ValueError(f"Upload failed with status {response.status_code}")
+
+                retries += 1
+                if retries > UPLOAD_RETRIES:
+                    raise ValueError("Upload failed, it will be resumed on the next run")
+                time.sleep(2 ** retries)
+                try:
+                    offset = self._query_upload_offset(session_url, size)
+                except requests.RequestException:
+                    continue
+                if offset is None:
+                    self.upload_sessions.remove(disk_name, path)
+                    raise ValueError("Upload session expired")
+
+        self.upload_sessions.remove(disk_name, path)
+        logging.info(f"Uploaded {path} ({size} bytes)")
+
+    def upload_stream(self, stream, filename) -> None:
+        session_url = self._create_upload_session(filename)
+        offset = 0
+        pending = bytearray()
+        exhausted = False
+        retries = 0
+        while True:
+            while not exhausted and len(pending) <= UPLOAD_CHUNK_SIZE:
+                data = stream.read(UPLOAD_CHUNK_SIZE)
+                exhausted = not data
+                pending += data
+            chunk = bytes(pending[:UPLOAD_CHUNK_SIZE])
+            total = str(offset + len(chunk)) if exhausted and len(pending) <= UPLOAD_CHUNK_SIZE else "*"
+            if chunk:
+                content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{total}"
+            else:
+                content_range = f"bytes */{total}"
+
+            try:
+                response = requests.put(
+                    session_url, data=chunk, headers={"Content-Range": content_range}, timeout=250
+                )
+            except requests.RequestException:
+                response = None
+
+            while response is None or response.status_code >= 500:
+                retries += 1
+                if retries > UPLOAD_RETRIES:
+                    raise ValueError("Upload failed, the stream can't be resumed")
+                time.sleep(2 ** retries)
+                try:
+                    response = requests.put(session_url, headers={"Content-Range": f"bytes */{total}"}, timeout=250)
+                except requests.RequestException:
+                    response = None
+
+            if response.status_code in (200, 201):
+                self._record_upload(response)
+                offset += len(pending)
                 break
-        else:
-            raise ValueError("No such file on disk")
+            if response.status_code != 308:
+                raise ValueError(f"Upload failed with status {response.status_code}")
+
+            confirmed = self._confirmed_offset(response)
+            if not offset <= confirmed <= offset + len(pending):
+                raise ValueError(f"Upload session confirmed unexpected offset {confirmed}")
+            if confirmed > offset:
+                retries = 0
+            del pending[:confirmed - offset]
+            offset = confirmed
+        logging.info(f"Uploaded {filename} ({offset} bytes)")
+
+    def _create_upload_session(self, filename: str) -> str:
+        """
+        Открывает сессию возобновляемой загрузки Google Drive
+        :param filename: имя файла на диске
+        :return: адрес сессии загрузки
+        """
+        response = requests.post(
+            UPLOAD_URL,
+            params={"uploadType": "resumable"},
+            headers=self._download_headers(),
+            json={"title": filename},
+            timeout=250
+        )
+        if response.status_code != 200:
+            raise ValueError(f"Can't create upload session, status {response.status_code}")
+        return response.headers["Location"]
+
+    @staticmethod
+    def _query_upload_offset(session_url: str, size: int):
+        """
+        Узнаёт у Google Drive, сколько байт сессии загрузки уже получено
+        :param session_url: адрес сессии загрузки
+        :param size: полный размер файла
+        :return: подтверждённое смещение или None, если сессия больше не существует
+        """
+        response = requests.put(session_url, headers={"Content-Range": f"bytes */{size}"}, timeout=250)
+        if response.status_code in (200, 201):
+            return size
+        if response.status_code == 308:
+            return GoogleDisk._confirmed_offset(response)
+        return None
+
+    @staticmethod
+    def _confirmed_offset(response) -> int:
+        """
+        Извлекает из ответа 308 Resume Incomplete смещение, до которого данные получены
+        """
+        received = response.headers.get("Range")
+        if not received:
+            return 0
+        return int(received.rsplit("-", 1)[1]) + 1
+
+    def _download_url(self, remote_file: RemoteFile) -> str:
+        return f"https://www.googleapis.com/drive/v2/files/{remote_file.remote_id}?alt=media"
+
+    def _download_headers(self) -> dict:
+        with self._http_lock:
+            if self.gauth.access_token_expired:
+                self.gauth.Refresh()
+            return {"Authorization": f"Bearer {self.gauth.credentials.access_token}"}
+
+    def _delete_batch(self, remote_files: list[RemoteFile]) -> list[RemoteFile]:
+        with self._http_lock:
+            return self._delete_batch_locked(remote_files)
+
+    def _delete_batch_locked(self, remote_files: list[RemoteFile]) -> list[RemoteFile]:
+        service = self._drive_service()
+        deleted = []
+
+        def callback(request_id, response, exception):
+            remote_file = remote_files[int(request_id)]
+            if exception is None or getattr(getattr(exception, "resp", None), "status", None) == 404:
+                deleted.append(remote_file)
+            else:
+                logging.warning(f"Can't delete {remote_file.name}: {exception}")
+
+        batch = service.new_batch_http_request(callback=callback)
+        for number, remote_file in enumerate(remote_files):
+            batch.add(service.files().delete(fileId=remote_file.remote_id), request_id=str(number))
+        batch.execute()
+        return deleted
+
+    def _list_remote(self) -> list[RemoteFile]:
+        with self._http_lock:
+            file_list = self.drive.ListFile({'q': "'root' in parents and trashed=false"}).GetList()
+        return [self._remote_file(file) for file in file_list if self.is_tracked(file['title'])]
+
+    def _refresh_manifest(self, full: bool) -> None:
+        """
+        Применяет к манифесту журнал изменений Google Drive с сохранённого токена.
+        Диск обходится целиком только при первом обновлении или по запросу
+        """
+        with self._http_lock:
+            self._refresh_manifest_locked(full)
+
+    def _refresh_manifest_locked(self, full: bool) -> None:
+        disk_name = self.__class__.__name__
+        service = self._drive_service()
+        token = self.manifest.get_state(disk_name, "change_token")
+        if full or token is None:
+            start_token = service.changes().getStartPageToken().execute()["startPageToken"]
+            super()._refresh_manifest(full)
+            self.manifest.set_state(disk_name, "change_token", start_token)
+            return
+
+        changed, removed = [], []
+        while True:
+            response = service.changes().list(pageToken=token, includeDeleted=True, fields=CHANGES_FIELDS).execute()
+            for change in response.get("items", []):
+                metadata = change.get("file")
+                if change.get("deleted") or metadata is None or not self._is_tracked(metadata):
+                    removed.append(change["fileId"])
+                else:
+                    changed.append(self._remote_file(metadata))
+            if "nextPageToken" not in response:
+                token = response["newStartPageToken"]
+                break
+            token = response["nextPageToken"]
+
+        self.manifest.remove_ids(disk_name, removed + [remote_file.remote_id for remote_file in changed])
+        self.manifest.put(disk_name, changed)
+        self.manifest.set_state(disk_name, "change_token", token)
+        self.manifest.mark_refreshed(disk_name)
+
+    def _drive_service(self):
+        if self.gauth.access_token_expired:
+            self.gauth.Refresh()
+        if self.gauth.service is None:
+            self.gauth.Authorize()
+        return self.gauth.service
+
+    def _record_upload(self, response) -> None:
+        """
+        Добавляет в манифест загруженный файл по метаданным из ответа на последний запрос загрузки
+        """
+        try:
+            metadata = response.json()
+        except ValueError:
+            return
+        if self.is_tracked(metadata.get("title", "")):
+            self.manifest.put(self.__class__.__name__, [self._remote_file(metadata)])
+
+    def _is_tracked(self, metadata: dict) -> bool:
+        in_root = any(parent.get("isRoot") for parent in metadata.get("parents", []))
+        trashed = metadata.get("labels", {}).get("trashed", False)
+        return in_root and not trashed and self.is_tracked(metadata.get("title", ""))
+
+    @staticmethod
+    def _remote_file(metadata: dict) -> RemoteFile:
+        size = metadata.get("fileSize")
+        return RemoteFile(metadata["title"], metadata["id"], int(size) if size is not None else None,
+                          metadata.get("md5Checksum"))
 
     @staticmethod
     def _get_auth_json(client_id, client_secret):
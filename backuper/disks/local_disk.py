@@ -0,0 +1,190 @@
+import errno
+import fcntl
+import io
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from .base_disk import BaseDisk
+from ..download_engine import DEFAULT_DOWNLOAD_CONNECTIONS
+from ..remote_manifest import RemoteFile, RemoteManifest
+from ..utils import extract_secrets_from_json
+
+# ioctl клонирования файла целиком (Linux, btrfs/xfs/ocfs2 и NFS 4.2 с поддержкой на сервере)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+FSYNC_BATCH_FILES = 64
+FSYNC_BATCH_BYTES = 1024 * 1024 * 1024
+PART_SUFFIX = ".part"
+# ошибки, после которых вместо reflink или copy_file_range нужно копировать обычным способом
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF}
+
+
+class LocalDisk(BaseDisk):
+    """
+    Диск в локальной директории или на сетевом ресурсе (NFS, SMB).
+    Файлы копируются через reflink, если файловая система его поддерживает, иначе через copy_file_range
+    без копирования данных в пространство пользователя. Файл пишется под временным именем и появляется
+    под своим только после записи. fsync выполняется пачками: файлы накапливаются и сбрасываются
+    на диск вместе с директорией, когда загружается архив бэкапа или пачка становится слишком большой
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        if root is None:
+            secrets = extract_secrets_from_json(self.__class__.__name__)
+            if not secrets:
+                self.disk_authentication()
+                secrets = extract_secrets_from_json(self.__class__.__name__)
+            root = secrets["path"]
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest = RemoteManifest()
+        self._reflink = True
+        self._copy_file_range = hasattr(os, "copy_file_range")
+        self._unsynced = []
+        self._unsynced_bytes = 0
+
+    def _auth_app(self) -> dict[str]:
+        path = Path(input("Enter backup directory: ")).expanduser().resolve()
+        path.mkdir(parents=True, exist_ok=True)
+        return {"path": str(path)}
+
+    def _auth_user(self) -> Optional[dict[str]]:
+        return None
+
+    def upload(self, file_path: str) -> None:
+        filename = os.path.basename(file_path)
+        part_path = self.root / f"{filename}{PART_SUFFIX}"
+        try:
+            with open(file_path, "rb") as src, open(part_path, "wb") as dst:
+                self.copy(src, dst)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        self._commit(part_path, self.root / filename)
+
+    def upload_stream(self, stream: BinaryIO, filename: str) -> None:
+        part_path = self.root / f"{filename}{PART_SUFFIX}"
+        try:
+            with open(part_path, "wb") as dst:
+                shutil.copyfileobj(stream, dst, COPY_CHUNK_SIZE)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        self._commit(part_path, self.root / filename)
+
+    def remote_files(self, refresh: bool = False) -> list[RemoteFile]:
+        """
+        Обход директории дешевле, чем поддержка манифеста в согласованном состоянии,
+        когда в неё пишут другие машины, поэтому манифест обновляется при каждом запросе
+        """
+        self._refresh_manifest(full=True)
+        return self.manifest.list(self.__class__.__name__)
+
+    def _list_remote(self) -> list[RemoteFile]:
+        remote_files = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and self.is_tracked(entry.name):
+                    remote_files.append(RemoteFile(entry.name, entry.name, entry.stat().st_size, None))
+        return remote_files
+
+    def download(
+            self, filename: str, connections: int = DEFAULT_DOWNLOAD_CONNECTIONS, destination: Optional[str] = None
+    ) -> None:
+        """
+        Копирует файл из директории диска. Соединения не используются: копирование идёт на скорости устройства
+        """
+        source = self.root / filename
+        if not self.is_tracked(filename) or not source.is_file():
+            raise ValueError("No such file on disk")
+        destination = filename if destination is None else str(destination)
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            self.copy(src, dst)
+
+    def open_remote(self, remote_file: RemoteFile) -> io.BufferedReader:
+        return open(self.root / remote_file.name, "rb")
+
+    def _delete_batch(self, remote_files: list[RemoteFile]) -> list[RemoteFile]:
+        deleted = []
+        for remote_file in remote_files:
+            try:
+                (self.root / remote_file.name).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Can't delete {remote_file.name}: {e}")
+                continue
+            deleted.append(remote_file)
+        self._fsync_directory()
+        return deleted
+
+    def _download_url(self, remote_file: RemoteFile) -> str:
+        return (self.root / remote_file.name).as_uri()
+
+    def copy(self, src: BinaryIO, dst: BinaryIO) -> None:
+        """
+        Копирует содержимое файла: клонированием блоков, затем copy_file_range в ядре, затем обычным чтением
+        :param src: файл, открытый на чтение
+        :param dst: пустой файл, открытый на запись
+        """
+        if self._reflink:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                self._reflink = False
+
+        if self._copy_file_range:
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), COPY_CHUNK_SIZE):
+                    pass
+                return
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                self._copy_file_range = False
+
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+    def flush(self) -> None:
+        """
+        Сбрасывает на устройство записанные файлы и директорию диска
+        """
+        for path in self._unsynced:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._unsynced = []
+        self._unsynced_bytes = 0
+        self._fsync_directory()
+
+    def _commit(self, part_path: Path, path: Path) -> None:
+        """
+        Переименовывает записанный файл в его имя. Архив бэкапа загружается последним,
+        после его загрузки задача считает файлы сохранёнными, поэтому на нём пачка сбрасывается на диск
+        """
+        os.replace(part_path, path)
+        self._unsynced.append(path)
+        self._unsynced_bytes += path.stat().st_size
+        if (self.filter_files([path.name]) or len(self._unsynced) >= FSYNC_BATCH_FILES
+                or self._unsynced_bytes >= FSYNC_BATCH_BYTES):
+            self.flush()
+        if self.is_tracked(path.name):
+            self.manifest.put(self.__class__.__name__, [RemoteFile(path.name, path.name, path.stat().st_size, None)])
+
+    def _fsync_directory(self) -> None:
+        fd = os.open(self.root, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -1,11 +1,18 @@
+import logging
 import os
 
+import requests
 import yadisk
 from yadisk.exceptions import PathNotFoundError, BadRequestError
 
 from .base_disk import BaseDisk
+from ..defs import remote_manifest_file
+from ..remote_manifest import RemoteFile, RemoteManifest
 from ..utils import extract_secrets_from_json
 
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 5
+
 
 class YandexDisk(BaseDisk):  # pragma: no cover
     """
@@ -23,6 +30,7 @@ class YandexDisk(BaseDisk):  # pragma: no cover
         self.disk = yadisk.YaDisk(app_id, app_secret)
         self.disk.token = secrets["token"]
         self.root_path = "/"
+        self.manifest = RemoteManifest(remote_manifest_file)
 
     def _auth_app(self):
         app_id = input("Enter app id: ")
@@ -47,16 +55,50 @@ class YandexDisk(BaseDisk):  # pragma: no cover
 
     def upload(self, file_to_upload_path) -> None:
         with open(file_to_upload_path, "rb") as f:
-            self.disk.upload(f, f"/{os.path.basename(file_to_upload_path)}", overwrite=True, timeout=250)
+            self.disk.upload(
+                f, f"/{os.path.basename(file_to_upload_path)}",
+                overwrite=True, timeout=250, n_retries=UPLOAD_RETRIES, retry_interval=10
+            )
+        self._record_upload(os.path.basename(file_to_upload_path))
 
-    def list_of_files(self) -> list[str]:
-        files = list(self.disk.listdir("/"))
-        names = [resource_obj['name'] for resource_obj in files]
-        return self.filter_files(names)
+    def upload_stream(self, stream, filename) -> None:
+        link = self.disk.get_upload_link(f"/{filename}", overwrite=True)
+        response = requests.put(link, data=iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""), timeout=250)
+        if response.status_code not in (201, 202):
+            raise ValueError(f"Upload failed with status {response.status_code}")
+        self._record_upload(filename)
 
-    def download(self, filename: str) -> None:
+    def _download_url(self, remote_file: RemoteFile) -> str:
         try:
-            self.disk.download(f"{self.root_path}{filename}", filename)
+            return self.disk.get_download_link(f"{self.root_path}{remote_file.name}")
         except PathNotFoundError:
-            os.remove(filename)
+            self.manifest.remove_ids(self.__class__.__name__, [remote_file.remote_id])
             raise ValueError("No such file on disk")
+
+    def _delete_batch(self, remote_files: list[RemoteFile]) -> list[RemoteFile]:
+        deleted = []
+        for remote_file in remote_files:
+            try:
+                self.disk.remove(f"{self.root_path}{remote_file.name}", permanently=True)
+            except PathNotFoundError:
+                pass
+            except yadisk.exceptions.YaDiskError as e:
+                logging.warning(f"Can't delete {remote_file.name}: {e}")
+                continue
+            deleted.append(remote_file)
+        return deleted
+
+    def _list_remote(self) -> list[RemoteFile]:
+        return [self._remote_file(resource) for resource in self.disk.listdir("/") if self.is_tracked(resource.name)]
+
+    def _record_upload(self, filename: str) -> None:
+        """
+        Добавляет в манифест загруженный файл
+        """
+        if self.is_tracked(filename):
+            resource = self.disk.get_meta(f"/{filename}", fields=["name", "resource_id", "path", "size", "md5"])
+            self.manifest.put(self.__class__.__name__, [self._remote_file(resource)])
+
+    @staticmethod
+    def _remote_file(resource) -> RemoteFile:
+        return RemoteFile(resource.name, resource.resource_id or resource.path, resource.size, resource.md5)
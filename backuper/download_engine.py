@@ -0,0 +1,200 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+import requests
+
+DOWNLOAD_PART_SIZE = 64 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 5
+DEFAULT_DOWNLOAD_CONNECTIONS = 4
+
+
+class DownloadEngine:
+    """
+    Скачивает большой файл несколькими соединениями: файл заранее выделяется на диске,
+    делится на части, и каждая часть скачивается отдельным range-запросом и пишется по своему смещению.
+    Оборвавшаяся часть докачивается с последнего записанного байта.
+    После скачивания файл сверяется с контрольной суммой с диска
+    """
+
+    def __init__(
+            self, connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+            part_size: int = DOWNLOAD_PART_SIZE, retries: int = DOWNLOAD_RETRIES
+    ):
+        self.connections = connections
+        self.part_size = part_size
+        self.retries = retries
+        self._local = threading.local()
+
+    def download(
+            self, url: str, destination: str, size: Optional[int], checksum: Optional[str] = None,
+            headers: Callable[[], dict] = dict
+    ) -> None:
+        """
+        Скачивает файл
+        :param url: ссылка на содержимое файла
+        :param destination: путь, по которому нужно сохранить файл
+        :param size: размер файла или None, если он неизвестен
+        :param checksum: md5 файла или None, если сверять не с чем
+        :param headers: возвращает заголовки для очередного запроса, например с обновлённым токеном
+        """
+        part_path = f"{destination}.part"
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if size is None:
+                self._download_whole(url, fd, headers)
+            else:
+                self._preallocate(fd, size)
+                ranges = [(start, min(start + self.part_size, size)) for start in range(0, size, self.part_size)]
+                failed = threading.Event()
+
+                def download_range(start: int, end: int) -> None:
+                    if failed.is_set():
+                        return
+                    try:
+                        self._download_range(url, fd, start, end, headers)
+                    except BaseException:
+                        failed.set()
+                        raise
+
+                with ThreadPoolExecutor(max(min(self.connections, len(ranges)), 1), "download") as pool:
+                    futures = [pool.submit(download_range, start, end) for start, end in ranges]
+                    for future in as_completed(futures):
+                        future.result()
+                os.fsync(fd)
+        except BaseException:
+            os.close(fd)
+            os.remove(part_path)
+            raise
+        os.close(fd)
+
+        if checksum is not None and self._md5(part_path) != checksum.lower():
+            os.remove(part_path)
+            raise ValueError("Downloaded file does not match the checksum on disk")
+        os.replace(part_path, destination)
+
+    def _download_range(self, url: str, fd: int, start: int, end: int, headers: Callable[[], dict]) -> None:
+        offset = start
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._session().get(
+                    url, headers={**headers(), "Range": f"bytes={offset}-{end - 1}"}, stream=True, timeout=60
+                )
+                with response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise ValueError("Server ignored the range request")
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        chunk = chunk[:end - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                if offset == end:
+                    return
+                raise requests.ConnectionError(f"Range {start}-{end - 1} ended at {offset}")
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code < 500 and e.response.status_code != 429:
+                    raise
+                error = e
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                logging.warning(f"Range {start}-{end - 1} failed at {offset}: {error}, retrying")
+                time.sleep(min(2 ** attempt, 30))
+        raise error
+
+    def _download_whole(self, url: str, fd: int, headers: Callable[[], dict]) -> None:
+        with self._session().get(url, headers=headers(), stream=True, timeout=60) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                os.write(fd, chunk)
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    @staticmethod
+    def _preallocate(fd: int, size: int) -> None:
+        os.ftruncate(fd, size)
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _md5(path: str) -> str:
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+class RangeReader(io.RawIOBase):
+    """
+    Файл на диске, открытый на чтение с произвольного места через range-запросы.
+    Позволяет zipfile прочитать центральный каталог и отдельные элементы архива, не скачивая его целиком
+    """
+
+    def __init__(self, url: str, size: int, headers: Callable[[], dict] = dict, retries: int = DOWNLOAD_RETRIES):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.headers = headers
+        self.retries = retries
+        self._position = 0
+        self._session = requests.Session()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self.size)
+        if end <= self._position:
+            return 0
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._session.get(
+                    self.url, headers={**self.headers(), "Range": f"bytes={self._position}-{end - 1}"}, timeout=60
+                )
+                response.raise_for_status()
+                break
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+        if response.status_code != 206:
+            raise ValueError("Server ignored the range request")
+
+        data = response.content[:end - self._position]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._session.close()
+        super().close()
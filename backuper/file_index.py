@@ -0,0 +1,207 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+from backuper.scanner import FileStat
+
+
+class FileIndex:
+    """
+    Персистентный индекс состояния забэкапленных файлов.
+    Для каждого файла хранит размер, время изменения в наносекундах и inode.
+    Индекс может переходить между потоками планировщика, а во время сборки архива
+    его одновременно читает поток сканирования
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.db_path = str(db_path)
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS queue ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "archive TEXT NOT NULL UNIQUE)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS queued_files ("
+            "archive TEXT NOT NULL, "
+            "path TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "mode INTEGER NOT NULL, "
+            "PRIMARY KEY (archive, path))"
+        )
+        self.connection.commit()
+
+    def get(self, path: str) -> Optional[tuple[int, int, int]]:
+        """
+        Возвращает сохранённое состояние файла
+        :param path: путь к файлу
+        :return: (size, mtime_ns, inode) или None, если файла нет в индексе
+        """
+        with self._lock:
+            return self.connection.execute(
+                "SELECT size, mtime_ns, inode FROM files WHERE path = ?", (path,)
+            ).fetchone()
+
+    def is_changed(self, entry: FileStat) -> bool:
+        """
+        Проверяет, отличается ли текущее состояние файла от сохранённого в индексе
+        :param entry: запись о файле, полученная при сканировании
+        :return: True, если файл новый или изменился
+        """
+        return self.get(entry.path) != (entry.size, entry.mtime_ns, entry.inode)
+
+    def update(self, entries: Iterable[FileStat]) -> None:
+        """
+        Записывает состояние файлов в индекс одной транзакцией
+        :param entries: записи о файлах, полученные при сканировании
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode) VALUES (?, ?, ?, ?)",
+                ((entry.path, entry.size, entry.mtime_ns, entry.inode) for entry in entries)
+            )
+
+    def touch(self, entries: Iterable[FileStat]) -> None:
+        """
+        Записывает новое состояние файлов, содержимое которых не изменилось. Состояние обновляется
+        и в очереди, чтобы потерянный архив по-прежнему вернул эти файлы в следующий
+        :param entries: записи о файлах, полученные при сканировании
+        """
+        with self._lock, self.connection:
+            for entry in entries:
+                self.connection.execute(
+                    "UPDATE queued_files SET size = ?, mtime_ns = ?, inode = ? "
+                    "WHERE path = ? AND (size, mtime_ns, inode) = "
+                    "(SELECT size, mtime_ns, inode FROM files WHERE path = ?)",
+                    (entry.size, entry.mtime_ns, entry.inode, entry.path, entry.path)
+                )
+                self.connection.execute(
+                    "UPDATE files SET size = ?, mtime_ns = ?, inode = ? WHERE path = ?",
+                    (entry.size, entry.mtime_ns, entry.inode, entry.path)
+                )
+
+    def remove(self, paths: Iterable[str]) -> None:
+        """
+        Удаляет файлы из индекса
+        :param paths: пути к файлам
+        """
+        with self._lock, self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in paths))
+
+    def remove_trees(self, paths: Iterable[str]) -> int:
+        """
+        Удаляет из индекса файлы и всё содержимое директорий с такими путями
+        :param paths: пути к файлам или директориям
+        :return: количество удалённых файлов
+        """
+        removed = 0
+        with self._lock, self.connection:
+            for path in paths:
+                removed += self.connection.execute(
+                    "DELETE FROM files WHERE path = ? OR (path > ? AND path < ?)",
+                    (path, path + os.sep, path + chr(ord(os.sep) + 1))
+                ).rowcount
+        return removed
+
+    def begin_scan(self) -> None:
+        """
+        Начинает учёт файлов, найденных полным сканированием. Пути хранятся во временной таблице SQLite,
+        а не в памяти процесса
+        """
+        with self._lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM seen")
+
+    def mark_seen(self, entries: Iterable[FileStat]) -> None:
+        """
+        :param entries: записи о файлах, найденных сканированием
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO seen (path) VALUES (?)", ((entry.path,) for entry in entries)
+            )
+
+    def remove_unseen(self) -> int:
+        """
+        Удаляет из индекса файлы, которых не нашло законченное полное сканирование
+        :return: количество удалённых файлов
+        """
+        with self._lock, self.connection:
+            removed = self.connection.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM seen)").rowcount
+            self.connection.execute("DELETE FROM seen")
+        return removed
+
+    def enqueue(self, archive: str, entries: Iterable[FileStat]) -> None:
+        """
+        Ставит собранный архив в очередь на загрузку и сразу записывает состояние его файлов в индекс,
+        чтобы следующие сканирования не архивировали их повторно, пока архив ждёт загрузки
+        :param archive: путь до архива
+        :param entries: записи о файлах в архиве
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode) VALUES (?, ?, ?, ?)",
+                ((entry.path, entry.size, entry.mtime_ns, entry.inode) for entry in entries)
+            )
+            self.connection.execute("INSERT OR IGNORE INTO queue (archive) VALUES (?)", (archive,))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO queued_files (archive, path, size, mtime_ns, inode, mode) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((archive, entry.path, entry.size, entry.mtime_ns, entry.inode, entry.mode) for entry in entries)
+            )
+
+    def queued(self) -> list[str]:
+        """
+        :return: архивы, ожидающие загрузки, в порядке постановки в очередь
+        """
+        with self._lock:
+            return [row[0] for row in self.connection.execute("SELECT archive FROM queue ORDER BY id")]
+
+    def dequeue(self, archive: str) -> None:
+        """
+        Убирает загруженный архив из очереди
+        :param archive: путь до архива
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM queued_files WHERE archive = ?", (archive,))
+            self.connection.execute("DELETE FROM queue WHERE archive = ?", (archive,))
+
+    def discard(self, archive: str) -> None:
+        """
+        Убирает из очереди потерянный архив и забывает состояние его файлов,
+        если с тех пор они не попали в другой архив, чтобы следующее сканирование собрало их заново
+        :param archive: путь до архива
+        """
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM files WHERE path IN ("
+                "SELECT queued_files.path FROM queued_files JOIN files ON files.path = queued_files.path "
+                "WHERE queued_files.archive = ? AND files.size = queued_files.size "
+                "AND files.mtime_ns = queued_files.mtime_ns AND files.inode = queued_files.inode)",
+                (archive,)
+            )
+            self.connection.execute("DELETE FROM queued_files WHERE archive = ?", (archive,))
+            self.connection.execute("DELETE FROM queue WHERE archive = ?", (archive,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __contains__(self, item):
+        return self.get(item) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
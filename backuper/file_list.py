@@ -0,0 +1,75 @@
+import os
+from array import array
+from typing import Iterable, Iterator
+
+from backuper.scanner import FileStat
+
+
+class FileList:
+    """
+    Компактный список записей о файлах для деревьев с миллионами файлов. Каждая директория хранится один раз,
+    имена файлов лежат подряд в одном bytearray, а размер, время изменения, inode, права и устройство —
+    в массивах array. FileStat собирается заново при чтении, поэтому запись занимает около 50 байт
+    плюс длина имени вместо нескольких сотен байт на кортеж с полным путём
+    """
+
+    def __init__(self, entries: Iterable[FileStat] = ()):
+        self._dir_ids = {}
+        self._dirs = []
+        self._dir = array("L")
+        self._names = bytearray()
+        self._name_ends = array("Q")
+        self._size = array("q")
+        self._mtime_ns = array("q")
+        self._inode = array("Q")
+        self._mode = array("L")
+        self._device = array("Q")
+        self.extend(entries)
+
+    def append(self, entry: FileStat) -> None:
+        """
+        :param entry: запись о файле
+        """
+        directory, name = os.path.split(entry.path)
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self._dirs)
+            self._dirs.append(directory)
+        self._dir.append(dir_id)
+        self._names += os.fsencode(name)
+        self._name_ends.append(len(self._names))
+        self._size.append(entry.size)
+        self._mtime_ns.append(entry.mtime_ns)
+        self._inode.append(entry.inode)
+        self._mode.append(entry.mode)
+        self._device.append(entry.device)
+
+    def extend(self, entries: Iterable[FileStat]) -> None:
+        """
+        :param entries: записи о файлах
+        """
+        for entry in entries:
+            self.append(entry)
+
+    def __getitem__(self, index: int) -> FileStat:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("FileList index out of range")
+        start = self._name_ends[index - 1] if index else 0
+        name = os.fsdecode(bytes(self._names[start:self._name_ends[index]]))
+        return FileStat(
+            os.path.join(self._dirs[self._dir[index]], name), self._size[index], self._mtime_ns[index],
+            self._inode[index], self._mode[index], self._device[index]
+        )
+
+    def __iter__(self) -> Iterator[FileStat]:
+        return (self[index] for index in range(len(self)))
+
+    def __len__(self):
+        return len(self._size)
+
+    def __eq__(self, other):
+        if isinstance(other, (FileList, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
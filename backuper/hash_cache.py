@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+from backuper.catalog import hash_file
+from backuper.scanner import FileStat
+
+DEFAULT_HASH_LIMIT = 64 * 1024 * 1024
+
+
+class HashCache:
+    """
+    Персистентный кэш хешей содержимого файлов. Хеш действителен, пока у файла те же устройство, inode,
+    размер и время изменения. Для каждого inode хранится хеш одной версии, а хеши inode, которых не нашло
+    полное сканирование, удаляются, поэтому кэш не растёт от замены файлов через переименование
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "device INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "sha256 TEXT NOT NULL, "
+            "PRIMARY KEY (device, inode))"
+        )
+        self.connection.commit()
+
+    def get(self, device: int, inode: int, size: int, mtime_ns: int) -> Optional[str]:
+        """
+        :return: sha256 версии файла с таким состоянием или None, если её хеш неизвестен
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT sha256 FROM hashes WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                (device, inode, size, mtime_ns)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def hash(self, entry: FileStat) -> str:
+        """
+        Возвращает хеш из кэша или читает файл. Прочитанный хеш запоминается,
+        только если файл не изменился, пока читался
+        :param entry: запись о файле, полученная при сканировании
+        :return: sha256 содержимого файла
+        """
+        sha256 = self.get(entry.device, entry.inode, entry.size, entry.mtime_ns)
+        if sha256 is not None:
+            return sha256
+
+        sha256 = hash_file(entry.path)
+        self.put(entry, sha256)
+        return sha256
+
+    def put(self, entry: FileStat, sha256: str) -> None:
+        """
+        Запоминает хеш, посчитанный при чтении файла, если файл не изменился с момента сканирования
+        :param entry: запись о файле, полученная при сканировании
+        :param sha256: хеш прочитанного содержимого
+        """
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return
+        if (stat.st_size, stat.st_mtime_ns, stat.st_ino) != (entry.size, entry.mtime_ns, entry.inode):
+            return
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO hashes (device, inode, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                (entry.device, entry.inode, entry.size, entry.mtime_ns, sha256)
+            )
+
+    def begin_scan(self) -> None:
+        """
+        Начинает учёт inode, найденных полным сканированием
+        """
+        with self._lock, self.connection:
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS seen (device INTEGER, inode INTEGER, PRIMARY KEY (device, inode))"
+            )
+            self.connection.execute("DELETE FROM seen")
+
+    def mark_seen(self, entries: Iterable[FileStat]) -> None:
+        """
+        :param entries: записи о файлах, найденных сканированием
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO seen (device, inode) VALUES (?, ?)",
+                ((entry.device, entry.inode) for entry in entries)
+            )
+
+    def remove_unseen(self) -> int:
+        """
+        Удаляет хеши inode, которых не нашло законченное полное сканирование
+        :return: количество удалённых хешей
+        """
+        with self._lock, self.connection:
+            removed = self.connection.execute(
+                "DELETE FROM hashes WHERE (device, inode) NOT IN (SELECT device, inode FROM seen)"
+            ).rowcount
+            self.connection.execute("DELETE FROM seen")
+        return removed
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
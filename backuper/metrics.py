@@ -0,0 +1,232 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+HISTORY_SIZE = 100
+
+
+class IterationMetrics(NamedTuple):
+    """
+    Метрики одного запуска задачи бэкапа. В потоковом режиме сжатие и загрузка идут одновременно,
+    поэтому их общее время попадает в compression_seconds. Загрузки идут параллельно следующим запускам,
+    поэтому upload_* описывают загрузки, завершившиеся за время запуска
+    """
+    job: str
+    started: float
+    seconds: float
+    succeeded: bool
+    lag_seconds: float = 0.0
+    scan_seconds: float = 0.0
+    scanned_files: int = 0
+    changed_files: int = 0
+    raw_bytes: int = 0
+    compressed_bytes: int = 0
+    compression_seconds: float = 0.0
+    uploaded_archives: int = 0
+    uploaded_bytes: int = 0
+    upload_seconds: float = 0.0
+    upload_retries: int = 0
+    upload_backlog: int = 0
+
+    @property
+    def upload_throughput(self) -> float:
+        """
+        :return: скорость загрузки в байтах в секунду
+        """
+        return self.uploaded_bytes / self.upload_seconds if self.upload_seconds else 0.0
+
+
+class JobTotals(NamedTuple):
+    """
+    Накопленные счётчики задачи
+    """
+    job: str
+    runs: int
+    failed_runs: int
+    uploaded_bytes: int
+    upload_retries: int
+    last_success: Optional[float]
+
+
+# имя метрики, описание и значение для последнего запуска или счётчиков задачи
+GAUGES = (
+    ("backuper_last_run_timestamp_seconds", "Start time of the last run", lambda m: m.started),
+    ("backuper_run_duration_seconds", "Duration of the last run", lambda m: m.seconds),
+    ("backuper_schedule_lag_seconds", "How late the last run started relative to its schedule",
+     lambda m: m.lag_seconds),
+    ("backuper_scan_duration_seconds", "Duration of the last scan for changed files", lambda m: m.scan_seconds),
+    ("backuper_scanned_files", "Files checked by the last scan", lambda m: m.scanned_files),
+    ("backuper_changed_files", "Changed files found by the last scan", lambda m: m.changed_files),
+    ("backuper_raw_bytes", "Size of the changed files in the last archive", lambda m: m.raw_bytes),
+    ("backuper_compressed_bytes", "Size of the last archive", lambda m: m.compressed_bytes),
+    ("backuper_compression_duration_seconds", "Duration of writing the last archive",
+     lambda m: m.compression_seconds),
+    ("backuper_upload_duration_seconds", "Time spent on uploads finished during the last run",
+     lambda m: m.upload_seconds),
+    ("backuper_upload_throughput_bytes_per_second", "Throughput of uploads finished during the last run",
+     lambda m: m.upload_throughput),
+    ("backuper_upload_backlog_archives", "Archives waiting for upload after the last run",
+     lambda m: m.upload_backlog),
+)
+COUNTERS = (
+    ("backuper_runs_total", "Runs of the job", lambda t: t.runs),
+    ("backuper_failed_runs_total", "Runs that failed to build an archive", lambda t: t.failed_runs),
+    ("backuper_uploaded_bytes_total", "Bytes uploaded by the job", lambda t: t.uploaded_bytes),
+    ("backuper_upload_retries_total", "Failed uploads that were queued again", lambda t: t.upload_retries),
+)
+
+
+class MetricsRepository:
+    """
+    История запусков задач бэкапа в SQLite: последние HISTORY_SIZE запусков каждой задачи
+    и накопленные счётчики. Пишут задачи планировщика и отдельные процессы, читает команда stats
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.connection = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f"{field} {self._column_type(field)}" for field in IterationMetrics._fields)
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS iterations (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS iterations_job ON iterations (job, id)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS totals ("
+            "job TEXT PRIMARY KEY, "
+            "runs INTEGER NOT NULL, "
+            "failed_runs INTEGER NOT NULL, "
+            "uploaded_bytes INTEGER NOT NULL, "
+            "upload_retries INTEGER NOT NULL, "
+            "last_success REAL)"
+        )
+        self.connection.commit()
+
+    def record(self, metrics: IterationMetrics) -> None:
+        """
+        Сохраняет метрики запуска и обновляет счётчики задачи
+        """
+        placeholders = ", ".join("?" for _ in IterationMetrics._fields)
+        with self._lock, self.connection:
+            self.connection.execute(
+                f"INSERT INTO iterations ({', '.join(IterationMetrics._fields)}) VALUES ({placeholders})", metrics
+            )
+            self.connection.execute(
+                "DELETE FROM iterations WHERE job = ? AND id NOT IN "
+                "(SELECT id FROM iterations WHERE job = ? ORDER BY id DESC LIMIT ?)",
+                (metrics.job, metrics.job, HISTORY_SIZE)
+            )
+            self.connection.execute(
+                "INSERT INTO totals (job, runs, failed_runs, uploaded_bytes, upload_retries, last_success) "
+                "VALUES (?, 1, ?, ?, ?, ?) "
+                "ON CONFLICT (job) DO UPDATE SET runs = runs + 1, "
+                "failed_runs = failed_runs + excluded.failed_runs, "
+                "uploaded_bytes = uploaded_bytes + excluded.uploaded_bytes, "
+                "upload_retries = upload_retries + excluded.upload_retries, "
+                "last_success = COALESCE(excluded.last_success, last_success)",
+                (metrics.job, int(not metrics.succeeded), metrics.uploaded_bytes, metrics.upload_retries,
+                 metrics.started if metrics.succeeded else None)
+            )
+
+    def history(self, job: str, limit: int = HISTORY_SIZE) -> list[IterationMetrics]:
+        """
+        :param job: имя задачи
+        :param limit: количество запусков
+        :return: последние запуски задачи, от новых к старым
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(IterationMetrics._fields)} FROM iterations WHERE job = ? ORDER BY id DESC LIMIT ?",
+                (job, limit)
+            ).fetchall()
+        return [self._iteration(row) for row in rows]
+
+    def latest(self) -> list[IterationMetrics]:
+        """
+        :return: последний запуск каждой задачи
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(IterationMetrics._fields)} FROM iterations "
+                "WHERE id IN (SELECT MAX(id) FROM iterations GROUP BY job) ORDER BY job"
+            ).fetchall()
+        return [self._iteration(row) for row in rows]
+
+    def totals(self) -> list[JobTotals]:
+        """
+        :return: счётчики всех задач
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(JobTotals._fields)} FROM totals ORDER BY job"
+            ).fetchall()
+        return [JobTotals(*row) for row in rows]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @staticmethod
+    def _column_type(field: str) -> str:
+        default = IterationMetrics._field_defaults.get(field)
+        if field == "job":
+            return "TEXT NOT NULL"
+        if field == "succeeded" or isinstance(default, int):
+            return "INTEGER NOT NULL"
+        return "REAL NOT NULL"
+
+    @staticmethod
+    def _iteration(row) -> IterationMetrics:
+        metrics = IterationMetrics(*row)
+        return metrics._replace(succeeded=bool(metrics.succeeded))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_textfile(latest: list[IterationMetrics], totals: list[JobTotals]) -> str:
+    """
+    Формирует метрики в текстовом формате Prometheus
+    :param latest: последний запуск каждой задачи
+    :param totals: счётчики задач
+    :return: содержимое файла для textfile-коллектора node_exporter
+    """
+    lines = []
+    for name, description, value in GAUGES:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f'{name}{{job="{_escape_label(m.job)}"}} {float(value(m))!r}' for m in latest)
+    for name, description, value in COUNTERS:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        lines.extend(f'{name}{{job="{_escape_label(t.job)}"}} {value(t)}' for t in totals)
+
+    name = "backuper_last_success_timestamp_seconds"
+    lines.append(f"# HELP {name} Start time of the last run that built or skipped an archive without errors")
+    lines.append(f"# TYPE {name} gauge")
+    lines.extend(
+        f'{name}{{job="{_escape_label(t.job)}"}} {float(t.last_success)!r}' for t in totals if t.last_success is not None
+    )
+    return "\n".join(lines) + "\n"
+
+
+def export_textfile(repository: MetricsRepository, path: Path) -> None:
+    """
+    Атомарно перезаписывает файл метрик, чтобы коллектор не прочитал его наполовину записанным
+    :param repository: история запусков
+    :param path: путь до файла .prom
+    """
+    path = Path(path)
+    content = format_textfile(repository.latest(), repository.totals())
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
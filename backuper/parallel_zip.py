@@ -0,0 +1,183 @@
+import collections
+import os
+import struct
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from backuper.compression import Codec, CodecSelector, DeflateCodec
+from backuper.pipeline import DEFAULT_READ_AHEAD, Prefetcher, read_files
+from backuper.scanner import FileStat
+from backuper.utils import make_zip_info
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+_DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+_MASK_USE_DATA_DESCRIPTOR = 0x08
+
+
+class ParallelZipWriter:
+    """
+    Пишет элементы zip-архива, сжимая блоки файлов в пуле потоков.
+    zlib, zstd и lz4 отпускают GIL на время сжатия, поэтому потоки загружают все ядра.
+    Блоки записываются в архив строго по порядку, в памяти держится не больше 2 * workers блоков
+    """
+
+    def __init__(self, zf: zipfile.ZipFile, workers: int, block_size: int = BLOCK_SIZE):
+        self.zf = zf
+        self.block_size = block_size
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="compress")
+        self._max_in_flight = workers * 2
+        self._queue = collections.deque()
+        self._in_flight = 0
+        self._member = None
+
+    def write(self, zinfo: zipfile.ZipInfo, path: str, codec: Codec) -> None:
+        """
+        Добавляет файл в архив
+        :param zinfo: заголовок элемента архива
+        :param path: путь до файла
+        :param codec: кодек элемента
+        """
+        with open(path, "rb") as f:
+            self._write_blocks(zinfo, iter(lambda: f.read(self.block_size), b""), codec)
+
+    def write_blocks(self, zinfo: zipfile.ZipInfo, blocks: Iterator[bytes], codec: Codec) -> None:
+        """
+        Добавляет в архив элемент из уже прочитанных блоков
+        :param zinfo: заголовок элемента архива
+        :param blocks: блоки содержимого по порядку
+        :param codec: кодек элемента
+        """
+        self._write_blocks(zinfo, blocks, codec)
+
+    def writestr(self, zinfo: zipfile.ZipInfo, data: bytes, codec: Codec) -> None:
+        """
+        Добавляет в архив элемент с переданным содержимым
+        :param zinfo: заголовок элемента архива
+        :param data: содержимое элемента
+        :param codec: кодек элемента
+        """
+        view = memoryview(data)
+        blocks = (view[i:i + self.block_size] for i in range(0, len(view), self.block_size))
+        self._write_blocks(zinfo, blocks, codec)
+
+    def flush(self) -> None:
+        """
+        Дописывает в архив все сжатые блоки
+        """
+        while self._queue:
+            self._write_next()
+
+    def shutdown(self) -> None:
+        """
+        Останавливает пул, отменяя ещё не начатое сжатие
+        """
+        self._queue.clear()
+        self._pool.shutdown(cancel_futures=True)
+
+    def _write_blocks(self, zinfo: zipfile.ZipInfo, blocks: Iterator, codec: Codec) -> None:
+        zinfo.compress_type = codec.compress_type
+        self._queue.append(("begin", zinfo, codec))
+        crc = 0
+        size = 0
+        block = next(blocks, b"")
+        while True:
+            next_block = next(blocks, b"")
+            if not codec.suffix:
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+            self._submit(codec, bytes(block), last=not next_block)
+            if not next_block:
+                break
+            block = next_block
+        self._queue.append(("end", zinfo, crc, size))
+
+    def _submit(self, codec: Codec, block: bytes, last: bool) -> None:
+        while self._queue and (self._in_flight >= self._max_in_flight or self._queue[0][0] != "block"):
+            self._write_next()
+        self._queue.append(("block", self._pool.submit(codec.compress_block, block, last)))
+        self._in_flight += 1
+
+    def _write_next(self) -> None:
+        item = self._queue.popleft()
+        fp = self.zf.fp
+
+        if item[0] == "begin":
+            _, zinfo, codec = item
+            zinfo.flag_bits |= _MASK_USE_DATA_DESCRIPTOR
+            zinfo.CRC = 0
+            zinfo.compress_size = 0
+            zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+            zinfo.header_offset = fp.tell()
+            fp.write(zinfo.FileHeader(zip64))
+            self._member = (zinfo, zip64, codec, 0)
+
+        elif item[0] == "block":
+            data = item[1].result()
+            self._in_flight -= 1
+            zinfo, zip64, codec, crc = self._member
+            zinfo.compress_size += len(data)
+            if codec.suffix:
+                crc = zlib.crc32(data, crc)
+            self._member = (zinfo, zip64, codec, crc)
+            fp.write(data)
+
+        else:
+            _, zinfo, crc, size = item
+            _, zip64, codec, stored_crc = self._member
+            if codec.suffix:
+                crc, size = stored_crc, zinfo.compress_size
+            zinfo.CRC = crc
+            zinfo.file_size = size
+            if not zip64 and (size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT):
+                raise RuntimeError("File size too large for zip member without ZIP64 header")
+            fmt = "<LLQQ" if zip64 else "<LLLL"
+            fp.write(struct.pack(fmt, _DATA_DESCRIPTOR_SIGNATURE, crc, zinfo.compress_size, size))
+            self.zf.start_dir = fp.tell()
+            self.zf.filelist.append(zinfo)
+            self.zf.NameToInfo[zinfo.filename] = zinfo
+            self._member = None
+
+
+def write_parallel_archive(
+        target, root_path: Path, files: Iterable[FileStat], workers: int,
+        codec_selector: Optional[CodecSelector] = None, read_ahead: int = DEFAULT_READ_AHEAD,
+        on_hashed: Optional[Callable[[FileStat, str], None]] = None
+) -> None:
+    """
+    Пишет zip-архив конвейером: отдельный поток читает файлы на read_ahead байт вперёд,
+    пул сжимает блоки, а текущий поток пишет их в архив
+    :param target: путь до архива или файловый объект
+    :param root_path: путь до директории, откуда производится сжатие
+    :param files: записи о файлах для сжатия
+    :param workers: количество потоков сжатия
+    :param codec_selector: выбор кодека для каждого файла, по умолчанию deflate
+    :param read_ahead: сколько байт прочитанных файлов может ждать сжатия
+    :param on_hashed: вызывается из потока чтения с sha256 каждого прочитанного файла
+    """
+    codec_selector = codec_selector if codec_selector is not None else CodecSelector(DeflateCodec())
+    with zipfile.ZipFile(target, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        writer = ParallelZipWriter(zf, workers)
+        blocks = Prefetcher(read_files(files, BLOCK_SIZE, on_hashed), read_ahead // BLOCK_SIZE, "read")
+        try:
+            for entry, block in blocks:
+                codec = codec_selector.for_file(entry)
+                zinfo = make_zip_info(entry, os.path.relpath(entry.path, root_path), codec)
+                writer.write_blocks(zinfo, _file_blocks(block, blocks), codec)
+            writer.flush()
+        finally:
+            blocks.close()
+            writer.shutdown()
+
+
+def _file_blocks(first: bytes, blocks: Iterator[tuple[FileStat, Optional[bytes]]]) -> Iterator[bytes]:
+    """
+    :return: блоки одного файла из общего потока прочитанных блоков, включая маркер его конца
+    """
+    block = first
+    while block is not None:
+        yield block
+        _, block = next(blocks)
@@ -0,0 +1,187 @@
+import collections
+import hashlib
+import threading
+from typing import Callable, Iterable, Iterator, Optional
+
+from backuper.file_list import FileList
+from backuper.scanner import FileStat
+
+SCAN_QUEUE_SIZE = 10000
+SCAN_BATCH_SIZE = 256
+DEFAULT_READ_AHEAD = 16 * 1024 * 1024
+DEFAULT_UPLOAD_QUEUE = 2
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """
+    :return: элементы пачками по size штук
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Prefetcher:
+    """
+    Стадия конвейера: отдельный поток достаёт пачки элементов из итератора и складывает их в очередь
+    не больше чем из max_batches пачек, а потребитель забирает элементы по мере готовности.
+    Когда очередь заполнена, поток ждёт, поэтому стадия не убегает вперёд и память ограничена.
+    Элементы передаются пачками, потому что передача каждого мелкого файла между потоками
+    стоит дороже его обработки. Ошибка итератора выбрасывается потребителю
+    """
+
+    def __init__(self, batches: Iterable[list], max_batches: int, name: str = "prefetch"):
+        self.max_batches = max(max_batches, 1)
+        self._batch = iter(())
+        self._items = collections.deque()
+        self._finished = False
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._produce, args=(iter(batches),), name=name, daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for item in self._batch:
+            return item
+        with self._condition:
+            while not self._items and not self._finished:
+                self._condition.wait()
+            if self._items:
+                self._batch = iter(self._items.popleft())
+                self._condition.notify_all()
+                return next(self)
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            raise StopIteration
+
+    def close(self) -> None:
+        """
+        Останавливает поток стадии, не дожидаясь конца итератора
+        """
+        with self._condition:
+            self._closed = True
+            self._items.clear()
+            self._condition.notify_all()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _produce(self, batches: Iterator[list]) -> None:
+        try:
+            for batch in batches:
+                with self._condition:
+                    while len(self._items) >= self.max_batches and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                    self._items.append(batch)
+                    self._condition.notify_all()
+        except BaseException as e:
+            with self._condition:
+                self._error = e
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+
+def read_files(
+        files: Iterable[FileStat], block_size: int, on_hashed: Optional[Callable[[FileStat, str], None]] = None
+) -> Iterator[list[tuple[FileStat, Optional[bytes]]]]:
+    """
+    Читает файлы блоками по порядку. Блоки мелких файлов собираются в пачки примерно по block_size байт
+    :param files: записи о файлах
+    :param block_size: размер блока
+    :param on_hashed: вызывается с sha256 каждого прочитанного файла
+    :return: итератор по пачкам (файл, блок), после последнего блока файла идёт (файл, None).
+        У пустого файла один пустой блок
+    """
+    batch = []
+    batch_size = 0
+    for entry in files:
+        digest = hashlib.sha256() if on_hashed is not None else None
+        with open(entry.path, "rb") as f:
+            block = f.read(block_size)
+            while True:
+                if digest is not None:
+                    digest.update(block)
+                batch.append((entry, block))
+                batch_size += len(block)
+                if batch_size >= block_size:
+                    yield batch
+                    batch, batch_size = [], 0
+                block = f.read(block_size) if block else b""
+                if not block:
+                    break
+        if digest is not None:
+            on_hashed(entry, digest.hexdigest())
+        batch.append((entry, None))
+    if batch:
+        yield batch
+
+
+class VolumeSplitter:
+    """
+    Делит поток изменённых файлов на тома по мере сканирования, не дожидаясь его конца.
+    В томе не больше volume_size байт исходных данных. Файлы не режутся между томами,
+    поэтому файл больше тома попадает в отдельный том. Файлы тома хранятся в компактном FileList,
+    потому что без ограничения тома в нём оказываются все изменённые файлы
+    """
+
+    def __init__(self, files: Iterator[FileStat], volume_size: Optional[int] = None):
+        self.volume_size = volume_size
+        self.written = FileList()
+        self._files = files
+        self._next = next(files, None)
+
+    def __bool__(self):
+        return self._next is not None
+
+    def volume(self) -> Iterator[FileStat]:
+        """
+        :return: итератор по файлам следующего тома. Отданные файлы копятся в written
+        """
+        self.written = FileList()
+        return self._take_volume()
+
+    def _take_volume(self) -> Iterator[FileStat]:
+        size = 0
+        while self._next is not None:
+            entry = self._next
+            if self.volume_size and self.written and size + entry.size > self.volume_size:
+                return
+            self.written.append(entry)
+            size += entry.size
+            self._next = None
+            yield entry
+            self._next = next(self._files, None)
+
+    def remaining(self) -> FileList:
+        """
+        Дочитывает поток после ошибки
+        :return: файлы текущего тома и все файлы, которые ещё не попали в тома
+        """
+        remaining = self.written
+        if self._next is not None:
+            remaining.append(self._next)
+            self._next = None
+        try:
+            remaining.extend(self._files)
+        except Exception:
+            pass
+        self.written = FileList()
+        return remaining
@@ -1,68 +1,160 @@
 import json
 import os
 import signal
+import sqlite3
+from pathlib import Path
 from typing import Optional
 
 
+def process_start_time(pid: int) -> Optional[int]:
+    """
+    Возвращает время запуска процесса в тиках с загрузки системы из /proc/<pid>/stat
+    :param pid: pid процесса
+    :return: время запуска или None, если процесса нет или /proc недоступен
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # имя процесса в скобках может содержать пробелы, поэтому поля считаются после последней скобки
+    return int(stat[stat.rindex(b")") + 2:].split()[19])
+
+
+def is_process_alive(pid: int, started: Optional[int]) -> bool:
+    """
+    Проверяет, что процесс жив и это тот же процесс, а не новый с переиспользованным pid
+    :param pid: pid процесса
+    :param started: время запуска процесса, сохранённое при регистрации, или None, если оно неизвестно
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if started is None:
+        return True
+    return process_start_time(pid) in (started, None)
+
+
 class ProcessesRepository:
+    """
+    Репозиторий задач бэкапа в SQLite в режиме WAL. Каждая операция читает или меняет одну строку
+    в своей транзакции, поэтому одновременно запущенные процессы не теряют записи друг друга.
+    Для отдельных процессов вместе с pid хранится время его запуска, чтобы не остановить
+    чужой процесс, получивший тот же pid
+    """
+
     def __init__(self, filepath: str):
         self.filepath = filepath
+        self.connection = sqlite3.connect(str(filepath), timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS processes ("
+            "name TEXT PRIMARY KEY, "
+            "info TEXT NOT NULL, "
+            "pid INTEGER, "
+            "started INTEGER)"
+        )
+        self._import_json(Path(filepath).with_suffix(".json"))
 
     def load(self) -> dict[str, dict]:
         """
-        Загружает информацию о процессах из файла.
+        Загружает информацию о всех процессах
         """
-        try:
-            with open(self.filepath) as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.decoder.JSONDecodeError):
-            data = {}
-        return data
-
-    def save(self, data: dict[str, dict]):
-        """
-        Сохраняет информацию о процессах в файл.
-        """
-        with open(self.filepath, 'w') as f:
-            json.dump(data, f)
+        rows = self.connection.execute("SELECT name, info FROM processes ORDER BY name").fetchall()
+        return {name: json.loads(info) for name, info in rows}
 
     def get_process(self, name: str) -> Optional[dict]:
         """
         Возвращает информацию о процессе по его имени.
         """
-        processes = self.load()
-        return processes.get(name)
+        row = self.connection.execute("SELECT info FROM processes WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
 
     def add_process(self, name: str, info: dict):
         """
-        Добавляет новый процесс в репозиторий.
+        Добавляет новый процесс в репозиторий или заменяет процесс с тем же именем.
         """
-        processes = self.load()
-        processes[name] = info
-        self.save(processes)
+        pid = info.get("pid")
+        started = process_start_time(pid) if pid is not None else None
+        self.connection.execute(
+            "INSERT OR REPLACE INTO processes (name, info, pid, started) VALUES (?, ?, ?, ?)",
+            (name, json.dumps(info), pid, started)
+        )
 
     def remove_process(self, name: str):
         """
         Удаляет процесс из репозитория.
         """
-        processes = self.load()
-        if name in processes:
-            del processes[name]
-            self.save(processes)
+        self.connection.execute("DELETE FROM processes WHERE name = ?", (name,))
+
+    def is_running(self, name: str) -> bool:
+        """
+        Проверяет, что процесс зарегистрирован и, если у него есть свой pid, что этот процесс жив.
+        """
+        row = self.connection.execute("SELECT pid, started FROM processes WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return False
+        pid, started = row
+        return pid is None or is_process_alive(pid, started)
 
     def stop_process(self, name: str) -> bool:
         """
         Останавливает процесс по его имени.
+        Задачи планировщика не имеют своего pid, их достаточно удалить из репозитория.
+        Запись о процессе, который уже завершился, удаляется без отправки сигнала.
         """
-        process_info = self.get_process(name)
-        if process_info:
-            try:
-                os.kill(process_info["pid"], signal.SIGTERM)
-                self.remove_process(name)
-                return True
-            except ProcessLookupError:
-                return False
-        return False
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute("SELECT pid, started FROM processes WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                stopped = False
+            elif row[0] is None:
+                stopped = True
+            elif is_process_alive(*row):
+                try:
+                    os.kill(row[0], signal.SIGTERM)
+                    stopped = True
+                except ProcessLookupError:
+                    stopped = False
+            else:
+                stopped = False
+            self.connection.execute("DELETE FROM processes WHERE name = ?", (name,))
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return stopped
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _import_json(self, json_path: Path) -> None:
+        """
+        Переносит процессы из файла processes.json прежних версий и переименовывает его
+        """
+        if not json_path.is_file():
+            return
+        try:
+            with open(json_path) as f:
+                data = json.load(f)
+        except json.decoder.JSONDecodeError:
+            data = {}
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            for name, info in data.items():
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO processes (name, info, pid, started) VALUES (?, ?, ?, NULL)",
+                    (name, json.dumps(info), info.get("pid"))
+                )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        os.replace(json_path, json_path.with_suffix(".json.bak"))
 
     def __contains__(self, item):
-        return item in self.load()
+        return self.connection.execute("SELECT 1 FROM processes WHERE name = ?", (item,)).fetchone() is not None
@@ -0,0 +1,131 @@
+import sqlite3
+import threading
+import time
+from typing import Iterable, NamedTuple, Optional
+
+
+class RemoteFile(NamedTuple):
+    """
+    Запись о бэкапе на диске
+    """
+    name: str
+    remote_id: str
+    size: Optional[int]
+    checksum: Optional[str]
+
+
+class RemoteManifest:
+    """
+    Локальная копия списка бэкапов на дисках: имена, идентификаторы, размеры и контрольные суммы.
+    Позволяет показывать список бэкапов и находить бэкап по имени без обхода диска.
+    Может использоваться из нескольких потоков загрузки
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.connection = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "disk TEXT NOT NULL, "
+            "name TEXT NOT NULL, "
+            "remote_id TEXT NOT NULL, "
+            "size INTEGER, "
+            "checksum TEXT, "
+            "PRIMARY KEY (disk, name))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_remote_id ON files (disk, remote_id)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "disk TEXT NOT NULL, "
+            "key TEXT NOT NULL, "
+            "value TEXT NOT NULL, "
+            "PRIMARY KEY (disk, key))"
+        )
+        self.connection.commit()
+
+    def get(self, disk: str, name: str) -> Optional[RemoteFile]:
+        """
+        :param disk: имя диска
+        :param name: имя бэкапа
+        :return: запись о бэкапе или None, если его нет в манифесте
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT name, remote_id, size, checksum FROM files WHERE disk = ? AND name = ?", (disk, name)
+            ).fetchone()
+        return RemoteFile(*row) if row else None
+
+    def list(self, disk: str) -> list[RemoteFile]:
+        """
+        :param disk: имя диска
+        :return: записи о всех бэкапах диска, отсортированные по имени
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT name, remote_id, size, checksum FROM files WHERE disk = ? ORDER BY name", (disk,)
+            ).fetchall()
+        return [RemoteFile(*row) for row in rows]
+
+    def put(self, disk: str, files: Iterable[RemoteFile]) -> None:
+        """
+        Добавляет или обновляет записи о бэкапах
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files (disk, name, remote_id, size, checksum) VALUES (?, ?, ?, ?, ?)",
+                ((disk, *remote_file) for remote_file in files)
+            )
+
+    def remove_ids(self, disk: str, remote_ids: Iterable[str]) -> None:
+        """
+        Удаляет записи о бэкапах по их идентификаторам на диске
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM files WHERE disk = ? AND remote_id = ?", ((disk, remote_id) for remote_id in remote_ids)
+            )
+
+    def replace_all(self, disk: str, files: Iterable[RemoteFile]) -> None:
+        """
+        Заменяет манифест диска результатом полного обхода и отмечает время обновления
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM files WHERE disk = ?", (disk,))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files (disk, name, remote_id, size, checksum) VALUES (?, ?, ?, ?, ?)",
+                ((disk, *remote_file) for remote_file in files)
+            )
+            self._set_state(disk, "refreshed_at", str(time.time()))
+
+    def mark_refreshed(self, disk: str) -> None:
+        """
+        Отмечает, что манифест диска только что сверен с диском
+        """
+        with self._lock, self.connection:
+            self._set_state(disk, "refreshed_at", str(time.time()))
+
+    def is_fresh(self, disk: str, ttl: float) -> bool:
+        """
+        :param disk: имя диска
+        :param ttl: сколько секунд манифест считается актуальным после обновления
+        :return: True, если манифест обновлялся не раньше ttl секунд назад
+        """
+        refreshed_at = self.get_state(disk, "refreshed_at")
+        return refreshed_at is not None and time.time() - float(refreshed_at) < ttl
+
+    def get_state(self, disk: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM state WHERE disk = ? AND key = ?", (disk, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, disk: str, key: str, value: str) -> None:
+        with self._lock, self.connection:
+            self._set_state(disk, key, value)
+
+    def _set_state(self, disk: str, key: str, value: str) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO state (disk, key, value) VALUES (?, ?, ?)", (disk, key, value)
+        )
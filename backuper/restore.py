@@ -0,0 +1,401 @@
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from backuper.archive_cache import ArchiveCache
+from backuper.compression import CODECS, StoreCodec, open_member
+from backuper.dedup import CHUNKS_DIR, MANIFEST_NAME
+from backuper.defs import archives_dir
+from backuper.delta import DELTA_COMMENT_PREFIX, DELTA_SUFFIX, apply_delta
+from backuper.disks.base_disk import BaseDisk
+from backuper.download_engine import DEFAULT_DOWNLOAD_CONNECTIONS
+from backuper.remote_manifest import RemoteFile
+from backuper.utils import ARCHIVE_TIME_FORMAT
+
+DEFAULT_RESTORE_WORKERS = 4
+ARCHIVE_NAME_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:\.(\d+))?_(.+)\.zip")
+
+
+class RestoreEntry(NamedTuple):
+    """
+    Версия файла в одном из архивов. Для дельты base — архивы с предыдущими версиями файла,
+    начиная с полной копии
+    """
+    path: str
+    archive: str
+    member: Optional[str]
+    codec: Optional[str]
+    chunks: Optional[list]
+    mtime_ns: int
+    mode: int
+    base: Optional[list] = None
+
+
+class RestoreIndex:
+    """
+    Индекс путей в архивах на дисках. Архивы на диске не меняются, поэтому каждый архив
+    индексируется один раз, а для восстановления достаточно найти для каждого пути самый новый архив
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS archives ("
+            "disk TEXT NOT NULL, "
+            "archive TEXT NOT NULL, "
+            "PRIMARY KEY (disk, archive))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS members ("
+            "disk TEXT NOT NULL, "
+            "archive TEXT NOT NULL, "
+            "path TEXT NOT NULL, "
+            "member TEXT, "
+            "codec TEXT, "
+            "chunks TEXT, "
+            "mtime_ns INTEGER NOT NULL, "
+            "mode INTEGER NOT NULL, "
+            "base TEXT, "
+            "PRIMARY KEY (disk, archive, path))"
+        )
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(members)")}
+        if "base" not in columns:
+            self.connection.execute("ALTER TABLE members ADD COLUMN base TEXT")
+        self.connection.commit()
+
+    def is_indexed(self, disk: str, archive: str) -> bool:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM archives WHERE disk = ? AND archive = ?", (disk, archive)
+            ).fetchone()
+        return row is not None
+
+    def add(self, disk: str, archive: str, entries: Iterable[RestoreEntry]) -> None:
+        """
+        Сохраняет содержимое архива
+        :param disk: имя диска
+        :param archive: имя архива
+        :param entries: версии файлов в архиве
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO members (disk, archive, path, member, codec, chunks, mtime_ns, mode, base) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((disk, archive, entry.path, entry.member, entry.codec,
+                  None if entry.chunks is None else json.dumps(entry.chunks), entry.mtime_ns, entry.mode,
+                  None if entry.base is None else json.dumps(entry.base))
+                 for entry in entries)
+            )
+            self.connection.execute("INSERT OR IGNORE INTO archives (disk, archive) VALUES (?, ?)", (disk, archive))
+
+    def resolve(self, disk: str, archives: list[str]) -> dict[str, RestoreEntry]:
+        """
+        Находит для каждого пути последнюю версию
+        :param disk: имя диска
+        :param archives: имена архивов от старых к новым
+        :return: словарь путь -> версия файла из самого нового архива, где он есть
+        """
+        entries = {}
+        for archive in archives:
+            with self._lock:
+                rows = self.connection.execute(
+                    f"SELECT {', '.join(RestoreEntry._fields)} FROM members WHERE disk = ? AND archive = ?",
+                    (disk, archive)
+                ).fetchall()
+            for row in rows:
+                entries[row[0]] = self._entry(row)
+        return entries
+
+    def get(self, disk: str, archive: str, path: str) -> Optional[RestoreEntry]:
+        """
+        :param disk: имя диска
+        :param archive: имя архива
+        :param path: путь до файла
+        :return: версия файла в архиве или None
+        """
+        with self._lock:
+            row = self.connection.execute(
+                f"SELECT {', '.join(RestoreEntry._fields)} FROM members WHERE disk = ? AND archive = ? AND path = ?",
+                (disk, archive, path)
+            ).fetchone()
+        return None if row is None else self._entry(row)
+
+    def remove_archive(self, disk: str, archive: str) -> None:
+        """
+        Забывает архив, удалённый с диска
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM members WHERE disk = ? AND archive = ?", (disk, archive))
+            self.connection.execute("DELETE FROM archives WHERE disk = ? AND archive = ?", (disk, archive))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @staticmethod
+    def _entry(row) -> RestoreEntry:
+        entry = RestoreEntry(*row)
+        return entry._replace(
+            chunks=None if entry.chunks is None else json.loads(entry.chunks),
+            base=None if entry.base is None else json.loads(entry.base)
+        )
+
+
+def parse_archive_name(name: str, source: str) -> Optional[tuple[datetime.datetime, int]]:
+    """
+    Разбирает имя архива бэкапа директории вида <время>[.<номер>]_<директория>.zip.
+    Номер стоит до имени директории, поэтому архив директории data_2 не принимается за архив data
+    :param name: имя архива
+    :param source: имя бэкапируемой директории
+    :return: (время создания, номер архива в пределах секунды) или None, если архив от другой директории
+    """
+    match = ARCHIVE_NAME_PATTERN.fullmatch(name)
+    if match is None:
+        return None
+    if match.group(3) != source:
+        return None
+    created = datetime.datetime.strptime(match.group(1), ARCHIVE_TIME_FORMAT)
+    return created, int(match.group(2) or 0)
+
+
+def list_archive_entries(zf: zipfile.ZipFile, archive: str) -> list[RestoreEntry]:
+    """
+    Читает содержимое архива по центральному каталогу, а для дедуплицирующего снимка - по манифесту.
+    Архивы, на которые ссылается дельта, перечислены в комментарии её элемента
+    :param zf: открытый архив
+    :param archive: имя архива на диске
+    :return: версии файлов в архиве
+    """
+    if MANIFEST_NAME in zf.NameToInfo:
+        manifest = json.loads(zf.read(MANIFEST_NAME))
+        return [
+            RestoreEntry(file_info["path"], archive, None, None, file_info["chunks"],
+                         file_info["mtime_ns"], file_info["mode"])
+            for file_info in manifest["files"]
+        ]
+
+    entries = []
+    for zinfo in zf.infolist():
+        if zinfo.is_dir():
+            continue
+        path, codec, base = zinfo.filename, None, None
+        comment = zinfo.comment.decode(errors="ignore")
+        if comment in CODECS and CODECS[comment].suffix and path.endswith(CODECS[comment].suffix):
+            path, codec = path[:-len(CODECS[comment].suffix)], comment
+        elif comment.startswith(DELTA_COMMENT_PREFIX) and path.endswith(DELTA_SUFFIX):
+            path, base = path[:-len(DELTA_SUFFIX)], comment[len(DELTA_COMMENT_PREFIX):].split(",")
+        mtime_ns = int(time.mktime(zinfo.date_time + (0, 0, -1)) * 1e9)
+        entries.append(RestoreEntry(
+            path, archive, zinfo.filename, codec, None, mtime_ns, zinfo.external_attr >> 16, base
+        ))
+    return entries
+
+
+def source_archives(
+        remote_files: Iterable[RemoteFile], source: str, at: Optional[datetime.datetime] = None
+) -> list[tuple[datetime.datetime, RemoteFile]]:
+    """
+    :param remote_files: файлы на диске
+    :param source: имя бэкапируемой директории
+    :param at: момент времени, None для всех архивов
+    :return: (время создания, архив) для архивов директории, собранных не позже момента, от старых к новым
+    """
+    selected = []
+    for remote_file in remote_files:
+        parsed = parse_archive_name(remote_file.name, source)
+        if parsed is not None and (at is None or parsed[0] <= at):
+            selected.append((parsed, remote_file))
+    return [(parsed[0], remote_file) for parsed, remote_file in sorted(selected, key=lambda item: item[0])]
+
+
+def index_archives(
+        disk: BaseDisk, index: RestoreIndex, archives: Iterable[RemoteFile], workers: int = DEFAULT_RESTORE_WORKERS
+) -> None:
+    """
+    Добавляет в индекс архивы, которых в нём ещё нет, читая с диска только их центральные каталоги
+    :param disk: диск
+    :param index: индекс путей
+    :param archives: архивы на диске
+    :param workers: количество одновременно читаемых архивов
+    """
+    disk_name = disk.__class__.__name__
+
+    def index_archive(remote_file: RemoteFile) -> None:
+        with disk.open_remote(remote_file) as f, zipfile.ZipFile(f) as zf:
+            entries = list_archive_entries(zf, remote_file.name)
+        index.add(disk_name, remote_file.name, entries)
+
+    with ThreadPoolExecutor(workers, "index") as pool:
+        list(pool.map(index_archive, [
+            remote_file for remote_file in archives if not index.is_indexed(disk_name, remote_file.name)
+        ]))
+
+
+def required_archives(entries: Iterable[RestoreEntry]) -> set[str]:
+    """
+    :param entries: версии файлов
+    :return: имена архивов, в которых лежат эти версии, чанки их содержимого или предыдущие версии для дельт
+    """
+    needed = set()
+    for entry in entries:
+        if entry.chunks is None:
+            needed.add(entry.archive)
+        else:
+            needed.update(archive for _, archive in entry.chunks)
+        if entry.base is not None:
+            needed.update(entry.base)
+    return needed
+
+
+class Restorer:
+    """
+    Восстанавливает состояние директории на момент времени из цепочки инкрементальных архивов.
+    Содержимое архивов индексируется по их центральным каталогам, которые читаются с диска range-запросами,
+    скачиваются только архивы с последними версиями нужных файлов,
+    а из них в несколько потоков извлекаются только эти версии.
+    Удаления файлов архивы не хранят, поэтому восстанавливаются все файлы, которые были в бэкапах до этого момента
+    """
+
+    def __init__(
+            self, disk: BaseDisk, index: RestoreIndex,
+            workers: int = DEFAULT_RESTORE_WORKERS, connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+            cache: Optional[ArchiveCache] = None
+    ):
+        self.disk = disk
+        self.index = index
+        self.workers = workers
+        self.connections = connections
+        self.cache = cache
+        self._local = threading.local()
+        self._opened = []
+        self._opened_lock = threading.Lock()
+
+    def select_archives(self, source: str, at: datetime.datetime) -> list[RemoteFile]:
+        """
+        :param source: имя бэкапируемой директории
+        :param at: момент времени
+        :return: архивы директории, собранные не позже момента, от старых к новым
+        """
+        return [remote_file for _, remote_file in source_archives(self.disk.remote_files(), source, at)]
+
+    def restore(self, source: str, at: datetime.datetime, target_dir: Path) -> int:
+        """
+        :param source: имя бэкапируемой директории
+        :param at: момент времени
+        :param target_dir: директория, в которую восстанавливаются файлы
+        :return: количество восстановленных файлов
+        """
+        disk_name = self.disk.__class__.__name__
+        archives = self.select_archives(source, at)
+        if not archives:
+            raise ValueError("No backups before this time")
+
+        index_archives(self.disk, self.index, archives, self.workers)
+        entries = list(self.index.resolve(disk_name, [remote_file.name for remote_file in archives]).values())
+        needed = required_archives(entries)
+
+        work_dir = Path(tempfile.mkdtemp(prefix="restore-", dir=archives_dir))
+        try:
+            with ThreadPoolExecutor(self.workers, "download") as pool:
+                list(pool.map(lambda name: self._download(name, work_dir), sorted(needed)))
+            logging.info(f"Downloaded {len(needed)} of {len(archives)} archives")
+
+            with ThreadPoolExecutor(self.workers, "extract") as pool:
+                list(pool.map(lambda entry: self._extract(entry, work_dir, Path(target_dir), disk_name), entries))
+        finally:
+            for zf in self._opened:
+                zf.close()
+            self._opened = []
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return len(entries)
+
+    def _download(self, archive: str, work_dir: Path) -> None:
+        cached = self.cache.get(archive) if self.cache is not None else None
+        if cached is not None:
+            try:
+                os.link(cached, work_dir / archive)
+            except OSError:
+                shutil.copy(cached, work_dir / archive)
+            return
+        self.disk.download(archive, self.connections, str(work_dir / archive))
+
+    def _open(self, archive: str, work_dir: Path) -> zipfile.ZipFile:
+        if not hasattr(self._local, "archives"):
+            self._local.archives = {}
+        if archive not in self._local.archives:
+            zf = zipfile.ZipFile(work_dir / archive)
+            self._local.archives[archive] = zf
+            with self._opened_lock:
+                self._opened.append(zf)
+        return self._local.archives[archive]
+
+    def _extract(self, entry: RestoreEntry, work_dir: Path, target_dir: Path, disk_name: str) -> None:
+        file_path = target_dir / entry.path
+        if os.path.isabs(entry.path) or ".." in Path(entry.path).parts:
+            raise ValueError(f"Unsafe path in archive: {entry.path}")
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if entry.base is not None:
+            self._apply_deltas(entry, work_dir, file_path, disk_name)
+        else:
+            with open(file_path, "wb") as f:
+                self._write_entry(entry, work_dir, f)
+
+        if entry.mode & 0o7777:
+            os.chmod(file_path, entry.mode & 0o7777)
+        os.utime(file_path, ns=(entry.mtime_ns, entry.mtime_ns))
+
+    def _write_entry(self, entry: RestoreEntry, work_dir: Path, f) -> None:
+        if entry.chunks is not None:
+            for chunk_hash, archive in entry.chunks:
+                with open_member(self._open(archive, work_dir), f"{CHUNKS_DIR}/{chunk_hash}") as reader:
+                    shutil.copyfileobj(reader, f, 1024 * 1024)
+        else:
+            codec = CODECS[entry.codec]() if entry.codec is not None else StoreCodec()
+            with self._open(entry.archive, work_dir).open(entry.member) as src, codec.open_reader(src) as reader:
+                shutil.copyfileobj(reader, f, 1024 * 1024)
+
+    def _apply_deltas(self, entry: RestoreEntry, work_dir: Path, file_path: Path, disk_name: str) -> None:
+        """
+        Восстанавливает полную копию из первого архива цепочки и по очереди применяет к ней дельты
+        """
+        chain = []
+        for archive in entry.base:
+            version = self.index.get(disk_name, archive, entry.path)
+            if version is None:
+                raise ValueError(f"Previous version of {entry.path} is missing in {archive}")
+            chain.append(version)
+        if chain[0].base is not None:
+            raise ValueError(f"Delta chain of {entry.path} doesn't start with a full copy")
+
+        fd, previous = tempfile.mkstemp(prefix="delta-", dir=work_dir)
+        with os.fdopen(fd, "wb") as f:
+            self._write_entry(chain[0], work_dir, f)
+        try:
+            for number, version in enumerate(chain[1:] + [entry], start=1):
+                last = number == len(chain)
+                if last:
+                    output = str(file_path)
+                else:
+                    fd, output = tempfile.mkstemp(prefix="delta-", dir=work_dir)
+                    os.close(fd)
+                with open(previous, "rb") as base, open(output, "wb") as out, \
+                        self._open(version.archive, work_dir).open(version.member) as delta:
+                    apply_delta(base, delta, out)
+                os.unlink(previous)
+                previous = None if last else output
+        finally:
+            if previous is not None:
+                Path(previous).unlink(missing_ok=True)
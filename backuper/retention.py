@@ -0,0 +1,101 @@
+import datetime
+import logging
+from typing import NamedTuple
+
+from backuper.catalog import file_manifest_path
+from backuper.disks.base_disk import BaseDisk
+from backuper.remote_manifest import RemoteFile
+from backuper.restore import RestoreIndex, index_archives, required_archives, source_archives
+
+
+class RetentionPolicy(NamedTuple):
+    """
+    Сколько последних часов, дней и недель хранить по одному бэкапу.
+    Самый новый бэкап хранится всегда
+    """
+    hourly: int = 0
+    daily: int = 0
+    weekly: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return any(self)
+
+    def select(self, times: list[datetime.datetime]) -> set[datetime.datetime]:
+        """
+        Выбирает точки восстановления, которые нужно сохранить: самый новый бэкап в каждом из
+        последних hourly часов, daily дней и weekly недель, в которые были бэкапы
+        :param times: время создания бэкапов
+        :return: время сохраняемых бэкапов
+        """
+        newest_first = sorted(times, reverse=True)
+        kept = set(newest_first[:1])
+        buckets = (
+            (self.hourly, lambda t: (t.date(), t.hour)),
+            (self.daily, lambda t: t.date()),
+            (self.weekly, lambda t: t.isocalendar()[:2]),
+        )
+        for count, bucket in buckets:
+            seen = set()
+            for created in newest_first:
+                if len(seen) >= count:
+                    break
+                if bucket(created) not in seen:
+                    seen.add(bucket(created))
+                    kept.add(created)
+        return kept
+
+
+def plan_prune(
+        disk: BaseDisk, index: RestoreIndex, source: str, policy: RetentionPolicy
+) -> list[RemoteFile]:
+    """
+    Находит архивы директории, которые можно удалить с диска по политике хранения.
+    Архивы содержат только изменения, поэтому архив, не попавший в политику, всё равно сохраняется,
+    если в нём лежит последняя версия какого-то файла или чанк для одной из сохраняемых точек восстановления
+    :param disk: диск
+    :param index: индекс путей в архивах
+    :param source: имя бэкапируемой директории
+    :param policy: политика хранения
+    :return: архивы и их списки файлов для удаления
+    """
+    disk_name = disk.__class__.__name__
+    remote_files = disk.remote_files()
+    archives = source_archives(remote_files, source)
+    kept_times = policy.select([created for created, _ in archives])
+    index_archives(disk, index, [remote_file for _, remote_file in archives])
+
+    needed = set()
+    current = {}
+    for created, remote_file in archives:
+        current.update(index.resolve(disk_name, [remote_file.name]))
+        if created in kept_times:
+            needed.add(remote_file.name)
+            needed.update(required_archives(current.values()))
+
+    by_name = {remote_file.name: remote_file for remote_file in remote_files}
+    to_delete = []
+    for _, remote_file in archives:
+        if remote_file.name in needed:
+            continue
+        to_delete.append(remote_file)
+        manifest_name = file_manifest_path(remote_file.name)
+        if manifest_name in by_name:
+            to_delete.append(by_name[manifest_name])
+    return to_delete
+
+
+def prune(disk: BaseDisk, index: RestoreIndex, source: str, policy: RetentionPolicy) -> list[str]:
+    """
+    Удаляет с диска архивы директории, которые не нужны по политике хранения
+    :return: имена удалённых архивов
+    """
+    to_delete = plan_prune(disk, index, source, policy)
+    if not to_delete:
+        return []
+
+    deleted = disk.filter_files([remote_file.name for remote_file in disk.delete_files(to_delete)])
+    for name in deleted:
+        index.remove_archive(disk.__class__.__name__, name)
+    logging.info(f"Pruned {len(deleted)} archives of {source} from {disk.__class__.__name__}")
+    return deleted
@@ -0,0 +1,60 @@
+import os
+from stat import S_ISREG
+from typing import Iterable, Iterator, NamedTuple
+
+
+class FileStat(NamedTuple):
+    """
+    Результат единственного stat файла, полученного при обходе директории
+    """
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    mode: int
+    device: int = 0
+
+
+def scan_path(path) -> Iterator[FileStat]:
+    """
+    Обходит директорию через os.scandir, выполняя ровно один stat на каждый файл.
+    Символические ссылки на директории не обходятся, как и в os.walk
+    :param path: путь до директории
+    :return: итератор по записям о файлах
+    """
+    stack = [os.fspath(path)]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        yield FileStat(
+                            entry.path, stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_mode, stat.st_dev
+                        )
+                except OSError:
+                    continue
+
+
+def stat_paths(paths: Iterable[str]) -> Iterator[FileStat]:
+    """
+    Получает записи о перечисленных файлах. Пути, которых больше нет или которые не являются
+    обычными файлами, пропускаются
+    :param paths: пути до файлов
+    :return: итератор по записям о файлах
+    """
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if S_ISREG(stat.st_mode):
+            yield FileStat(path, stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_mode, stat.st_dev)
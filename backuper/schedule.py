@@ -0,0 +1,129 @@
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from typing import Hashable, Optional
+
+from croniter import croniter
+
+OVERRUN_SKIP = "skip"
+OVERRUN_RUN_ONCE = "run-once"
+OVERRUN_POLICIES = (OVERRUN_SKIP, OVERRUN_RUN_ONCE)
+
+
+class CronSchedule:
+    """
+    Расписание задачи по cron-выражению.
+    Следующий запуск считается от времени предыдущего запуска по расписанию, а не от окончания бэкапа,
+    поэтому расписание не сдвигается на длительность бэкапа. Первый запуск происходит сразу.
+    Если бэкап не уложился в свой слот, пропущенные запуски обрабатываются по политике overrun:
+    skip пропускает их и ждёт следующего слота, run-once сразу выполняет один запуск вместо всех пропущенных
+    """
+
+    def __init__(self, expression: str, overrun: str = OVERRUN_SKIP, start: Optional[float] = None):
+        if not croniter.is_valid(expression):
+            raise ValueError("Invalid cron format")
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError("Invalid overrun policy")
+
+        start = time.time() if start is None else start
+        self.expression = expression
+        self.overrun = overrun
+        self.next_fire = start
+        self.skipped = 0
+        self._iter = croniter(expression, datetime.datetime.fromtimestamp(start).astimezone())
+        self._deferred = None
+
+    def advance(self, now: float) -> float:
+        """
+        Переходит к следующему запуску после того, как выполнен запуск next_fire
+        :param now: текущее время
+        :return: время следующего запуска
+        """
+        if self._deferred is not None:
+            fire, self._deferred = self._deferred, None
+        else:
+            fire = self._iter.get_next(float)
+
+        missed = 0
+        while fire <= now:
+            missed += 1
+            fire = self._iter.get_next(float)
+
+        if missed and self.overrun == OVERRUN_RUN_ONCE:
+            self._deferred = fire
+            fire = now
+            missed -= 1
+        if missed:
+            self.skipped += missed
+            logging.warning(f"Backup overran its schedule {self.expression!r}, skipped {missed} runs")
+
+        self.next_fire = fire
+        return fire
+
+    def delay(self, now: float) -> float:
+        """
+        :param now: текущее время
+        :return: сколько секунд осталось до следующего запуска
+        """
+        return max(self.next_fire - now, 0)
+
+
+class Scheduler:
+    """
+    Очередь таймеров на двоичной куче: добавление и извлечение наступивших таймеров за O(log n),
+    поэтому в ней дёшево держать тысячи задач. Удалённые таймеры помечаются и выбрасываются при извлечении
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def add(self, key: Hashable, fire_time: float) -> None:
+        """
+        Ставит таймер задачи, заменяя предыдущий
+        :param key: ключ задачи
+        :param fire_time: время срабатывания
+        """
+        self.remove(key)
+        entry = [fire_time, next(self._counter), key]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Снимает таймер задачи, если он есть
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[2] = None
+
+    def pop_due(self, now: float) -> list:
+        """
+        Извлекает задачи, таймеры которых сработали
+        :param now: текущее время
+        :return: ключи задач в порядке срабатывания
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            if key is not None:
+                del self._entries[key]
+                due.append(key)
+        return due
+
+    def next_fire(self) -> Optional[float]:
+        """
+        :return: время ближайшего срабатывания или None, если таймеров нет
+        """
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
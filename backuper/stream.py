@@ -0,0 +1,146 @@
+import collections
+import threading
+from typing import Callable, BinaryIO
+
+DEFAULT_PIPE_SIZE = 32 * 1024 * 1024
+
+
+class PipeAbortedError(Exception):
+    """
+    Читающая сторона канала прекратила чтение
+    """
+
+
+class BoundedPipe:
+    """
+    Ограниченный по размеру канал в памяти между потоком, пишущим архив, и потоком загрузки.
+    Запись блокируется, пока в канале лежит больше max_size байт
+    """
+
+    def __init__(self, max_size: int = DEFAULT_PIPE_SIZE):
+        self.max_size = max_size
+        self._chunks = collections.deque()
+        self._size = 0
+        self._closed = False
+        self._aborted = False
+        self._error = None
+        self._condition = threading.Condition()
+        self.written = 0
+
+    def write(self, data) -> int:
+        """
+        Кладёт данные в канал, дожидаясь освобождения места
+        :param data: байты для записи
+        :return: количество записанных байт
+        """
+        data = bytes(data)
+        with self._condition:
+            while self._size >= self.max_size and not self._aborted:
+                self._condition.wait()
+            if self._aborted:
+                raise PipeAbortedError("Reader stopped consuming the pipe")
+            if self._closed:
+                raise ValueError("write to closed pipe")
+            self._chunks.append(data)
+            self._size += len(data)
+            self.written += len(data)
+            self._condition.notify_all()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        """
+        Сообщает читающей стороне, что данных больше не будет
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def fail(self, error: BaseException) -> None:
+        """
+        Завершает канал с ошибкой, которая будет выброшена читающей стороне
+        """
+        with self._condition:
+            self._error = error
+            self._closed = True
+            self._condition.notify_all()
+
+    def abort(self) -> None:
+        """
+        Прекращает чтение: все последующие записи завершатся PipeAbortedError
+        """
+        with self._condition:
+            self._aborted = True
+            self._chunks.clear()
+            self._size = 0
+            self._condition.notify_all()
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Читает из канала size байт, а если канал закрыт раньше, то всё оставшееся
+        :param size: количество байт, -1 чтобы прочитать всё до закрытия
+        :return: прочитанные байты, пустые байты в конце потока
+        """
+        with self._condition:
+            while not self._closed and (size < 0 or self._size < size):
+                self._condition.wait()
+            if self._error is not None:
+                raise self._error
+
+            if size < 0 or size >= self._size:
+                result = b"".join(self._chunks)
+                self._chunks.clear()
+            else:
+                parts = []
+                remaining = size
+                while remaining:
+                    chunk = self._chunks.popleft()
+                    if len(chunk) > remaining:
+                        self._chunks.appendleft(chunk[remaining:])
+                        chunk = chunk[:remaining]
+                    parts.append(chunk)
+                    remaining -= len(chunk)
+                result = b"".join(parts)
+
+            self._size -= len(result)
+            self._condition.notify_all()
+            return result
+
+
+def stream_to_disk(disk, filename: str, write: Callable[[BinaryIO], None], max_size: int = DEFAULT_PIPE_SIZE) -> int:
+    """
+    Загружает на диск данные, которые пишет функция write, не сохраняя их во временный файл.
+    Запись выполняется в отдельном потоке и идёт одновременно с загрузкой
+    :param disk: диск для загрузки
+    :param filename: имя файла на диске
+    :param write: функция, пишущая данные в переданный ей файловый объект
+    :param max_size: максимальный объём данных в памяти между записью и загрузкой
+    :return: количество загруженных байт
+    """
+    pipe = BoundedPipe(max_size)
+    errors = []
+
+    def produce():
+        try:
+            write(pipe)
+        except BaseException as e:
+            errors.append(e)
+            pipe.fail(e)
+        else:
+            pipe.close()
+
+    producer = threading.Thread(target=produce, name=f"archive-writer-{filename}", daemon=True)
+    producer.start()
+    try:
+        disk.upload_stream(pipe, filename)
+    finally:
+        pipe.abort()
+        producer.join()
+
+    if errors and not isinstance(errors[0], PipeAbortedError):
+        raise errors[0]
+    if errors:
+        raise ValueError("Upload finished before the whole archive was written")
+    return pipe.written
@@ -0,0 +1,169 @@
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from backuper.catalog import file_manifest_path
+from backuper.disks.base_disk import BaseDisk
+
+
+class WorkerStats:
+    """
+    Статистика загрузок одного потока
+    """
+
+    def __init__(self):
+        self.archives = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        :return: средняя скорость загрузки в байтах в секунду
+        """
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+class UploadEngine:
+    """
+    Пул потоков, которые загружают архивы на диск, пока цикл бэкапа собирает следующие архивы.
+    Список файлов архива загружается перед самим архивом, поэтому на диске не бывает архива без списка.
+    Очередь архивов в памяти дублируется очередью в индексе файлов, поэтому после перезапуска
+    процесса незагруженные архивы снова передаются движку
+    """
+
+    def __init__(self, disk: BaseDisk, workers: int = 1):
+        self.disk = disk
+        self.stats = [WorkerStats() for _ in range(workers)]
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._uploaded = threading.Condition(self._lock)
+        self._queued = {}
+        self._in_flight = {}
+        self._completed = collections.deque()
+        self._threads = [
+            threading.Thread(target=self._work, args=(number,), name=f"upload-{number}", daemon=True)
+            for number in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, archive_path: str) -> bool:
+        """
+        Ставит архив в очередь на загрузку
+        :param archive_path: путь до архива
+        :return: False, если архив уже ждёт загрузки или загружается
+        """
+        try:
+            size = os.path.getsize(archive_path)
+        except OSError:
+            size = 0
+
+        with self._lock:
+            if archive_path in self._queued or archive_path in self._in_flight:
+                return False
+            self._queued[archive_path] = size
+        self._queue.put(archive_path)
+        return True
+
+    def completed(self) -> list[tuple[str, Optional[Exception]]]:
+        """
+        Забирает результаты завершившихся загрузок
+        :return: список (путь до архива, ошибка загрузки или None)
+        """
+        results = []
+        while self._completed:
+            results.append(self._completed.popleft())
+        return results
+
+    def wait_for_backlog(self, max_archives: int) -> None:
+        """
+        Ждёт, пока в очереди и в загрузке останется не больше max_archives архивов,
+        чтобы сборка не обгоняла загрузку и не занимала диск архивами
+        :param max_archives: допустимое количество незагруженных архивов
+        """
+        with self._uploaded:
+            while len(self._queued) + len(self._in_flight) > max_archives:
+                self._uploaded.wait()
+
+    @property
+    def backlog(self) -> tuple[int, int]:
+        """
+        :return: (количество архивов, объём в байтах), ожидающих загрузки
+        """
+        with self._lock:
+            return len(self._queued), sum(self._queued.values())
+
+    @property
+    def in_flight_bytes(self) -> int:
+        """
+        :return: объём архивов, которые загружаются прямо сейчас
+        """
+        with self._lock:
+            return sum(self._in_flight.values())
+
+    def totals(self) -> WorkerStats:
+        """
+        :return: суммарная статистика загрузок всех потоков
+        """
+        total = WorkerStats()
+        for stats in self.stats:
+            total.archives += stats.archives
+            total.bytes += stats.bytes
+            total.seconds += stats.seconds
+        return total
+
+    def log_stats(self) -> None:
+        archives, backlog_bytes = self.backlog
+        throughput = ", ".join(
+            f"{number}: {stats.throughput / 1024 / 1024:.2f} MB/s" for number, stats in enumerate(self.stats)
+        )
+        logging.info(
+            f"Upload backlog {archives} archives ({backlog_bytes} bytes), "
+            f"{self.in_flight_bytes} bytes in flight, workers throughput {throughput}"
+        )
+
+    def close(self) -> None:
+        """
+        Дожидается загрузки поставленных в очередь архивов и останавливает потоки
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, number: int) -> None:
+        stats = self.stats[number]
+        while True:
+            archive_path = self._queue.get()
+            if archive_path is None:
+                return
+
+            with self._lock:
+                size = self._queued.pop(archive_path)
+                self._in_flight[archive_path] = size
+
+            error = None
+            started = time.monotonic()
+            try:
+                if os.path.isfile(file_manifest_path(archive_path)):
+                    self.disk.upload(file_manifest_path(archive_path))
+                self.disk.upload(archive_path)
+            except Exception as e:
+                logging.exception(e)
+                error = e
+            elapsed = time.monotonic() - started
+
+            with self._lock:
+                del self._in_flight[archive_path]
+                self._uploaded.notify_all()
+            if error is None:
+                stats.archives += 1
+                stats.bytes += size
+                stats.seconds += elapsed
+                logging.info(f"Worker {number} uploaded {archive_path} ({size} bytes) in {elapsed:.1f} s")
+            self._completed.append((archive_path, error))
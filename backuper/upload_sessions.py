@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+from typing import Optional
+
+
+class UploadSessions:
+    """
+    Персистентное хранилище незавершённых сессий загрузки.
+    Для каждого архива хранит адрес сессии и последнее подтверждённое диском смещение.
+    Может использоваться из нескольких потоков загрузки
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.connection = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "disk TEXT NOT NULL, "
+            "path TEXT NOT NULL, "
+            "session_url TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "offset INTEGER NOT NULL, "
+            "PRIMARY KEY (disk, path))"
+        )
+        self.connection.commit()
+
+    def get(self, disk: str, path: str, size: int, mtime_ns: int) -> Optional[tuple[str, int]]:
+        """
+        Возвращает незавершённую сессию загрузки архива.
+        Сессия отбрасывается, если архив изменился с момента её создания
+        :param disk: имя диска
+        :param path: путь до архива
+        :param size: текущий размер архива
+        :param mtime_ns: текущее время изменения архива
+        :return: (адрес сессии, подтверждённое смещение) или None
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT session_url, size, mtime_ns, offset FROM sessions WHERE disk = ? AND path = ?", (disk, path)
+            ).fetchone()
+        if row is None:
+            return None
+        session_url, saved_size, saved_mtime_ns, offset = row
+        if (saved_size, saved_mtime_ns) != (size, mtime_ns):
+            self.remove(disk, path)
+            return None
+        return session_url, offset
+
+    def save(self, disk: str, path: str, session_url: str, size: int, mtime_ns: int, offset: int) -> None:
+        """
+        Сохраняет сессию загрузки и подтверждённое смещение
+        """
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions (disk, path, session_url, size, mtime_ns, offset) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (disk, path, session_url, size, mtime_ns, offset)
+            )
+
+    def remove(self, disk: str, path: str) -> None:
+        """
+        Удаляет сессию загрузки
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM sessions WHERE disk = ? AND path = ?", (disk, path))
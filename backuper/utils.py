@@ -1,12 +1,20 @@
 import json
 import os
+import re
+import time
 import zipfile
 import datetime
+import fcntl
 from json import JSONDecodeError
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Callable, Iterable, Optional
 
-from .defs import secrets_file, archives_dir, root_save
+from .defs import secrets_file, archives_dir, root_save, indexes_dir, daemon_pid_file
+from .compression import Codec, CodecSelector, DeflateCodec, HashingReader, copy_compressed
+from .scanner import FileStat
+
+ARCHIVE_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+ARCHIVE_TIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}")
 
 
 def make_app_dirs() -> None:
@@ -15,6 +23,7 @@ def make_app_dirs() -> None:
     """
     os.makedirs(root_save, exist_ok=True)
     os.makedirs(archives_dir, exist_ok=True)
+    os.makedirs(indexes_dir, exist_ok=True)
 
 
 def extract_secrets_from_json(disk: str = None) -> dict:
@@ -55,45 +64,127 @@ def save_secrets(disk: str, secrets: Optional[dict]) -> None:
         json.dump(data, f)
 
 
-def cron_parser(cron_expression):
+def read_daemon_pid() -> Optional[int]:
     """
-    Парсит крон для извлечения периодичности бэкапа
-    :param cron: значение строки cron
-    :return: периодичность в секундах
+    :return: pid запущенного планировщика или None, если он не запущен
     """
+    try:
+        pid = int(daemon_pid_file.read_text())
+        os.kill(pid, 0)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        return None
+    except PermissionError:
+        pass
+    return pid
 
-    cron_parts = cron_expression.split()
 
-    if cron_parts[0] == '*':
-        return 60
-    elif cron_parts[0].startswith('*/'):
-        minutes = int(cron_parts[0][2:])
-        return minutes * 60
-    elif cron_parts[1] == '*':
-        return 60 * 60
-    elif cron_parts[1].startswith('*/'):
-        hours = int(cron_parts[1][2:])
-        return hours * 60 * 60
-    else:
-        raise ValueError("Unsupported cron format")
+def lock_daemon_pid(pid_file: Path = daemon_pid_file) -> Optional[int]:
+    """
+    Записывает pid текущего процесса в pid-файл планировщика и держит на файле исключительную блокировку,
+    поэтому два одновременно запущенных планировщика не могут оба решить, что других нет
+    :param pid_file: путь до pid-файла
+    :return: дескриптор заблокированного файла, который остаётся открытым, пока работает планировщик,
+     или None, если планировщик уже запущен
+    """
+    while True:
+        fd = os.open(pid_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            if os.stat(pid_file).st_ino == os.fstat(fd).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        # файл удалил завершившийся планировщик, пока мы его открывали
+        os.close(fd)
+
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    return fd
+
+
+def make_zip_info(entry: FileStat, arcname: str, codec: Optional[Codec] = None) -> zipfile.ZipInfo:
+    """
+    Формирует заголовок элемента архива из уже полученного stat, не обращаясь к файловой системе
+    :param entry: запись о файле
+    :param arcname: имя файла внутри архива
+    :param codec: кодек элемента, по умолчанию deflate
+    :return: заголовок элемента архива
+    """
+    codec = codec if codec is not None else DeflateCodec()
+    date_time = time.localtime(entry.mtime_ns / 1e9)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+
+    zinfo = zipfile.ZipInfo(arcname + codec.suffix, date_time)
+    zinfo.external_attr = (entry.mode & 0xFFFF) << 16
+    zinfo.file_size = entry.size
+    zinfo.compress_type = codec.compress_type
+    zinfo._compresslevel = codec.level
+    if codec.suffix:
+        zinfo.comment = codec.name.encode()
+    return zinfo
+
+
+def make_archive_name(root_path: Path) -> str:
+    """
+    Формирует имя архива по текущему времени и имени бэкапируемой директории
+    :param root_path: путь до директории, откуда производится сжатие
+    :return: имя архива
+    """
+    return f"{datetime.datetime.now().strftime(ARCHIVE_TIME_FORMAT)}_{root_path.name}.zip"
 
 
-def make_archive(root_path: Path, files: list) -> str:
+def numbered_archive_name(name: str, number: int) -> str:
+    """
+    Добавляет номер к времени в имени архива: 2024-01-02_03-04-05.2_data.zip.
+    Номер стоит до имени директории, поэтому не совпадёт с архивом директории data_2
+    :param name: имя архива
+    :param number: номер архива
+    :return: имя архива с номером
+    """
+    created = ARCHIVE_TIME_PATTERN.match(name)
+    position = created.end() if created is not None else len(os.path.splitext(name)[0])
+    return f"{name[:position]}.{number}{name[position:]}"
+
+
+def write_archive(
+        target, root_path: Path, files: Iterable[FileStat], codec_selector: Optional[CodecSelector] = None,
+        on_hashed: Optional[Callable[[FileStat, str], None]] = None
+) -> None:
+    """
+    Пишет zip-архив в файл или в файловый объект, в том числе не поддерживающий seek
+    :param target: путь до архива или файловый объект
+    :param root_path: путь до директории, откуда производится сжатие
+    :param files: записи о файлах для сжатия
+    :param codec_selector: выбор кодека для каждого файла, по умолчанию deflate
+    :param on_hashed: вызывается с sha256 каждого файла, посчитанным при его сжатии
+    """
+    codec_selector = codec_selector if codec_selector is not None else CodecSelector(DeflateCodec())
+    with zipfile.ZipFile(target, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for entry in files:
+            codec = codec_selector.for_file(entry)
+            zinfo = make_zip_info(entry, os.path.relpath(entry.path, root_path), codec)
+            with open(entry.path, "rb") as f, zf.open(zinfo, "w") as dst:
+                src = HashingReader(f)
+                copy_compressed(src, dst, codec)
+            if on_hashed is not None:
+                on_hashed(entry, src.hexdigest())
+
+
+def make_archive(root_path: Path, files: Iterable[FileStat]) -> str:
     """
     Собирает архив для загрузки
     :param root_path: путь до директории, откуда производится сжатие
-    :param files: список файлов для сэатия
+    :param files: записи о файлах для сжатия
     :return: путь до результирующего архива
     """
-    archive_name = f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{root_path.name}.zip"
-    archive_path = archives_dir / archive_name
+    archive_path = archives_dir / make_archive_name(root_path)
     os.chdir(archives_dir)
-
-    with zipfile.ZipFile(archive_path, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for full_path in files:
-            relative_path = os.path.relpath(full_path, root_path)
-            zf.write(full_path, relative_path)
-
+    write_archive(archive_path, root_path, files)
     return str(archive_path)
 
 
@@ -0,0 +1,182 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(_libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+    return _libc
+
+
+class InotifyWatcher:
+    """
+    Следит за директорией через inotify и копит между циклами бэкапа множество путей,
+    которые были созданы, изменены или удалены. Для директории, перенесённой из дерева, в множество
+    попадает путь самой директории. События читаются в фоновом потоке.
+    Если очередь событий ядра переполнилась или за частью дерева следить не удалось,
+    выставляется флаг overflowed, и следующий цикл должен просканировать директорию целиком
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._libc = _get_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._dirty = set()
+        self._overflowed = False
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._closed = False
+
+        self._watch_tree(self.path, mark_dirty=False)
+        self._thread = threading.Thread(target=self._read_loop, name=f"inotify-{self.path}", daemon=True)
+        self._thread.start()
+
+    def drain(self) -> tuple[set[str], bool]:
+        """
+        Забирает накопленные изменения
+        :return: (изменённые пути, нужно ли полное сканирование)
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            overflowed, self._overflowed = self._overflowed, False
+        return dirty, overflowed
+
+    def mark_dirty(self, paths) -> None:
+        """
+        Возвращает пути в множество изменённых, например если архив с ними собрать не удалось
+        """
+        with self._lock:
+            self._dirty.update(paths)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        os.write(self._wakeup_write, b"\0")
+        self._thread.join()
+        for fd in (self._fd, self._wakeup_read, self._wakeup_write):
+            os.close(fd)
+
+    def _watch_tree(self, directory: str, mark_dirty: bool) -> None:
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOSPC, errno.ENOMEM):
+                    logging.warning(f"Can't watch {current}: {os.strerror(error)}, falling back to full scans")
+                    self._overflowed = True
+                continue
+            self._watches[wd] = current
+
+            try:
+                entries = os.scandir(current)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif mark_dirty:
+                            self._dirty.add(entry.path)
+                    except OSError:
+                        continue
+
+    def _unwatch_tree(self, directory: str) -> None:
+        prefix = directory + os.sep
+        for wd, watched in list(self._watches.items()):
+            if watched == directory or watched.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _read_loop(self) -> None:
+        while True:
+            ready, _, _ = select.select([self._fd, self._wakeup_read], [], [])
+            if self._wakeup_read in ready:
+                return
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                continue
+            with self._lock:
+                self._handle_events(data)
+
+    def _handle_events(self, data: bytes) -> None:
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                self._overflowed = True
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if mask & IN_MOVE_SELF:
+                if directory == self.path:
+                    self._overflowed = True
+                continue
+            if not name:
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path, mark_dirty=True)
+                elif mask & IN_MOVED_FROM:
+                    # файлы перенесённой директории событий не получают, поэтому изменённой считается
+                    # сама директория, и индекс забудет всё, что под ней лежало
+                    self._unwatch_tree(path)
+                    self._dirty.add(path)
+            else:
+                self._dirty.add(path)
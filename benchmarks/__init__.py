@@ -0,0 +1,4 @@
+"""
+Сквозные бенчмарки сканирования, сборки архивов и полного цикла бэкапа на синтетических деревьях.
+Запуск: python -m benchmarks --help
+"""
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from benchmarks.cases import CASES
+from benchmarks.trees import PROFILES, generate_tree
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+DEFAULT_TOLERANCE = 0.2
+# метрики, рост которых — ускорение, и метрики, рост которых — регрессия
+HIGHER_IS_BETTER = ("files_per_s", "mb_per_s")
+LOWER_IS_BETTER = ("peak_rss_kb", "rss_kb_per_million_files", "read_syscalls", "write_syscalls")
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_isolated(case: str, tree: Path, work_dir: Path, workers: int) -> dict:
+    """
+    Выполняет замер в отдельном процессе с HOME во временной директории
+    :return: метрики замера
+    """
+    home = work_dir / "home"
+    home.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ, HOME=str(home), PYTHONPATH=os.pathsep.join(
+        path for path in (str(PROJECT_ROOT), os.environ.get("PYTHONPATH")) if path
+    ))
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cases", case, str(tree), str(work_dir), "-w", str(workers)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """
+    Сравнивает замеры с сохранёнными
+    :param results: метрики по имени замера
+    :param baseline: сохранённые метрики по имени замера
+    :param tolerance: допустимое относительное ухудшение метрики
+    :return: описания регрессий
+    """
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            current, previous = metrics.get(key), base.get(key)
+            if current is None or not previous:
+                continue
+            change = (current - previous) / previous
+            if key in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(f"{name}: {key} {previous:.6g} -> {current:.6g} ({change:+.0%} worse)")
+    return regressions
+
+
+def format_results(results: dict[str, dict]) -> str:
+    rows = [(
+        "benchmark", "files", "MB", "s", "files/s", "MB/s", "peak RSS MB", "RSS MB/M files", "read sc", "write sc"
+    )]
+    for name, metrics in results.items():
+        rows.append((
+            name, str(metrics["files"]), f"{metrics['bytes'] / 1024 ** 2:.1f}", f"{metrics['seconds']:.2f}",
+            f"{metrics['files_per_s']:.0f}", f"{metrics['mb_per_s']:.1f}", f"{metrics['peak_rss_kb'] / 1024:.1f}",
+            f"{metrics['rss_kb_per_million_files'] / 1024:.1f}",
+            str(metrics["read_syscalls"]), str(metrics["write_syscalls"]),
+        ))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def _parse_args(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-p", "--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("-c", "--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--scale", help="multiplier for the number of files in each profile", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-w", "--workers", help="number of compression threads", type=int, default=1)
+    parser.add_argument("--trees", help="directory to keep generated trees between runs", type=Path,
+                        default=Path(tempfile.gettempdir()) / "backuper-benchmark-trees")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", help="store these results as the new baseline", action="store_true")
+    parser.add_argument("--tolerance", help="allowed relative slowdown before a regression is reported",
+                        type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = _parse_args(argv)
+    results = {}
+    for profile_name in args.profiles:
+        tree = generate_tree(args.trees, PROFILES[profile_name], args.scale, args.seed)
+        for case in args.cases:
+            name = f"{case}/{profile_name}@{args.scale:g}/w{args.workers}"
+            with tempfile.TemporaryDirectory(prefix="backuper-benchmark-") as work_dir:
+                results[name] = run_isolated(case, tree, Path(work_dir), args.workers)
+            print(f"{name}: {results[name]['seconds']:.2f}s", file=sys.stderr)
+
+    print(format_results(results))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.is_file() else {}
+    if args.save_baseline:
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True))
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Один замер в отдельном процессе, чтобы пиковый RSS и счётчики системных вызовов относились
+только к нему. HOME процесса указывает во временную директорию, поэтому индексы, очередь
+и архивы бэкапа не попадают в настоящий ~/.backuper
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+CASES = ("scan", "archive", "backup", "chunk")
+
+
+def read_io_counters() -> Optional[dict[str, int]]:
+    """
+    :return: счётчики ввода-вывода процесса из /proc/self/io или None, если они недоступны
+    """
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f.read().splitlines())}
+    except OSError:
+        return None
+
+
+def measure(run: Callable[[], tuple[int, int]]) -> dict:
+    """
+    Замеряет время, системные вызовы чтения и записи, пиковый RSS и его прирост за замер
+    в пересчёте на миллион файлов
+    :param run: функция замера, возвращающая (количество файлов, количество байт)
+    :return: метрики замера
+    """
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    io_before = read_io_counters()
+    started = time.perf_counter()
+    files, size = run()
+    seconds = time.perf_counter() - started
+    io_after = read_io_counters()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    result = {
+        "files": files,
+        "bytes": size,
+        "seconds": seconds,
+        "files_per_s": files / seconds if seconds else 0.0,
+        "mb_per_s": size / seconds / 1024 ** 2 if seconds else 0.0,
+        "peak_rss_kb": peak_rss,
+        "rss_kb_per_million_files": (peak_rss - rss_before) * 10 ** 6 / files if files else 0.0,
+        "read_syscalls": None,
+        "write_syscalls": None,
+    }
+    if io_before is not None and io_after is not None:
+        result["read_syscalls"] = io_after["syscr"] - io_before["syscr"]
+        result["write_syscalls"] = io_after["syscw"] - io_before["syscw"]
+    return result
+
+
+def run_case(case: str, tree: Path, work_dir: Path, workers: int = 1) -> dict:
+    """
+    :param case: scan — поиск изменённых файлов первого бэкапа, то есть всех файлов дерева,
+        archive — сборка архива из всех файлов,
+        backup — полный запуск задачи бэкапа с загрузкой на локальный диск,
+        chunk — нарезка всех файлов на чанки для дедуплицирующего режима
+    :param tree: бэкапируемая директория
+    :param work_dir: директория для архивов и загруженных файлов
+    :param workers: количество потоков сжатия
+    :return: метрики замера
+    """
+    from backuper.utils import make_app_dirs
+
+    # backup_loop при импорте открывает лог в ~/.backuper, поэтому директории создаются до него
+    make_app_dirs()
+    from backuper.archive_maker import ArchiveMaker
+    from backuper.backup_loop import BackupJob
+    from backuper.chunker import iter_chunks
+    from backuper.scanner import scan_path
+    from backuper.disks.local_disk import LocalDisk
+
+    total_files = total_size = 0
+    for entry in scan_path(tree):
+        total_files += 1
+        total_size += entry.size
+
+    if case == "scan":
+        def run():
+            return len(ArchiveMaker(tree).get_files_from_path()), total_size
+    elif case == "archive":
+        maker = ArchiveMaker(tree, workers=workers)
+        entries = list(scan_path(tree))
+
+        def run():
+            maker.write_archive(work_dir / "archive.zip", "archive.zip", entries)
+            return len(entries), total_size
+    elif case == "backup":
+        disk = LocalDisk(work_dir / "remote")
+
+        def run():
+            job = BackupJob("benchmark", tree, disk, workers=workers)
+            job.run_once()
+            job.close()
+            return total_files, total_size
+    elif case == "chunk":
+        def run():
+            for entry in scan_path(tree):
+                with open(entry.path, "rb") as f:
+                    for _ in iter_chunks(f):
+                        pass
+            return total_files, total_size
+    else:
+        raise ValueError(f"Unknown benchmark case {case}")
+    return measure(run)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("case", choices=CASES)
+    parser.add_argument("tree", type=Path)
+    parser.add_argument("work_dir", type=Path)
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(args.work_dir)
+    json.dump(run_case(args.case, args.tree, args.work_dir, args.workers), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
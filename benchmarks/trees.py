@@ -0,0 +1,78 @@
+import json
+import os
+import random
+from pathlib import Path
+from typing import NamedTuple
+
+FILES_PER_DIR = 1000
+TREE_MTIME_NS = 1_700_000_000 * 10 ** 9
+SPARSE_EXTENT = 1024 * 1024
+
+
+class TreeProfile(NamedTuple):
+    """
+    Параметры синтетического дерева
+    """
+    name: str
+    files: int
+    min_size: int
+    max_size: int
+    sparse: bool = False
+
+
+PROFILES = {
+    "tiny": TreeProfile("tiny", 1_000_000, 0, 1024),
+    "medium": TreeProfile("medium", 10_000, 32 * 1024, 128 * 1024),
+    "sparse": TreeProfile("sparse", 3, 2 * 1024 ** 3, 2 * 1024 ** 3, sparse=True),
+}
+
+
+def _content(rng: random.Random, size: int) -> bytes:
+    """
+    Половина содержимого случайная, половина хорошо сжимается, чтобы кодеку было что делать
+    """
+    half = size // 2
+    text = b"backuper benchmark " * (size // 19 + 1)
+    return rng.randbytes(half) + text[:size - half]
+
+
+def _write_sparse(path: Path, rng: random.Random, size: int) -> None:
+    with open(path, "wb") as f:
+        f.truncate(size)
+        for offset in (0, size // 2, size - SPARSE_EXTENT):
+            f.seek(offset)
+            f.write(rng.randbytes(SPARSE_EXTENT))
+
+
+def generate_tree(root: Path, profile: TreeProfile, scale: float = 1.0, seed: int = 0) -> Path:
+    """
+    Создаёт воспроизводимое дерево файлов. При одинаковых профиле, масштабе и seed содержимое,
+    размеры и время изменения файлов совпадают. Готовое дерево переиспользуется
+    :param root: директория для деревьев
+    :param profile: профиль дерева
+    :param scale: множитель количества файлов
+    :param seed: seed генератора содержимого
+    :return: путь до дерева
+    """
+    tree = Path(root) / f"{profile.name}-{scale:g}-{seed}"
+    marker = tree.with_suffix(".json")
+    params = {"profile": list(profile), "scale": scale, "seed": seed}
+    if marker.is_file() and json.loads(marker.read_text()) == params:
+        return tree
+
+    rng = random.Random(seed)
+    files = max(1, round(profile.files * scale))
+    for number in range(files):
+        directory = tree / f"d{number // FILES_PER_DIR:04d}"
+        if number % FILES_PER_DIR == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"f{number:07d}.bin"
+        size = rng.randint(profile.min_size, profile.max_size)
+        if profile.sparse:
+            _write_sparse(path, rng, size)
+        else:
+            path.write_bytes(_content(rng, size))
+        os.utime(path, ns=(TREE_MTIME_NS, TREE_MTIME_NS + number))
+
+    marker.write_text(json.dumps(params))
+    return tree
@@ -5,8 +5,13 @@ setup(
     version='0.1.0',
     url='https://github.com/WoodieDudy/backuper',
     author='marga and woodie',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=['croniter==1.3.8', 'PyDrive==1.3.1', 'yadisk==1.3.2'],
+    extras_require={
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+        'dedup': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'backuper=backuper.backup:main',
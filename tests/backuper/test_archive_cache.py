@@ -0,0 +1,60 @@
+from unittest.mock import patch
+
+import pytest
+
+from backuper.archive_cache import ArchiveCache
+from backuper.catalog import file_manifest_path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ArchiveCache(tmp_path / "cache.sqlite", tmp_path)
+    yield cache
+    cache.close()
+
+
+def _archive(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return path
+
+
+def test_evicts_least_recently_used(tmp_path, cache):
+    cache.max_bytes = 250
+    with patch("backuper.archive_cache.time.time", side_effect=[1, 2, 3, 4]):
+        for name in ["a.zip", "b.zip", "c.zip"]:
+            cache.add(_archive(tmp_path, name, 100))
+        assert cache.get("a.zip") == tmp_path / "a.zip"
+
+    assert cache.evict() == ["b.zip"]
+    assert not (tmp_path / "b.zip").exists()
+    assert (tmp_path / "a.zip").exists()
+    assert cache.usage() == (2, 200)
+
+
+def test_counts_and_removes_file_list(tmp_path, cache):
+    archive = _archive(tmp_path, "a.zip", 100)
+    manifest = _archive(tmp_path, file_manifest_path("a.zip"), 10)
+    cache.add(archive)
+    assert cache.usage() == (1, 110)
+
+    cache.remove("a.zip")
+    assert not archive.exists()
+    assert not manifest.exists()
+    assert cache.get("a.zip") is None
+
+
+def test_forgets_missing_archive(tmp_path, cache):
+    archive = _archive(tmp_path, "a.zip", 100)
+    cache.add(archive)
+    archive.unlink()
+
+    assert cache.get("a.zip") is None
+    assert cache.usage() == (0, 0)
+
+
+def test_max_bytes_is_persisted(tmp_path, cache):
+    cache.max_bytes = 123
+    reopened = ArchiveCache(tmp_path / "cache.sqlite", tmp_path)
+    assert reopened.max_bytes == 123
+    reopened.close()
@@ -0,0 +1,315 @@
+import datetime
+import hashlib
+import os
+import io
+import zipfile
+from unittest.mock import Mock, patch
+
+import pytest
+
+from backuper.archive_maker import ArchiveMaker
+from backuper.catalog import file_manifest_path, read_file_manifest
+from backuper.disks.base_disk import FILE_MANIFEST_SUFFIX
+from backuper.dedup import DedupArchiveMaker
+from backuper.delta import DeltaArchiveMaker
+from backuper.file_index import FileIndex
+from backuper.hash_cache import HashCache
+from backuper.restore import parse_archive_name
+
+
+@pytest.fixture
+def archives_dir(tmp_path):
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    with patch('backuper.archive_maker.archives_dir', archives):
+        yield archives
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data = tmp_path / "data"
+    (data / "sub").mkdir(parents=True)
+    (data / "a.txt").write_text("a")
+    (data / "sub" / "b.txt").write_text("b")
+    return data
+
+
+def test_first_archive_contains_all_files(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir)
+
+    archive_path = archive_maker.make_fresh_archive()
+
+    with zipfile.ZipFile(archive_path) as zf:
+        assert sorted(zf.namelist()) == ["a.txt", "sub/b.txt"]
+
+
+def test_no_archive_after_upload_without_changes(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir)
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    assert archive_maker.make_fresh_archive() is None
+
+
+def test_queued_files_are_not_archived_again(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir)
+    archive_path = archive_maker.make_fresh_archive()
+
+    assert archive_maker.make_fresh_archive() is None
+    assert archive_maker.pending_archives() == [archive_path]
+
+
+def test_archive_names_do_not_collide(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir)
+    with patch('backuper.archive_maker.make_archive_name', return_value="same.zip"):
+        first_archive = archive_maker.make_fresh_archive()
+        (data_dir / "a.txt").write_text("changed")
+        second_archive = archive_maker.make_fresh_archive()
+
+    assert first_archive != second_archive
+    assert archive_maker.pending_archives() == [first_archive, second_archive]
+
+
+def test_archive_number_stays_out_of_directory_name(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir)
+    with patch('backuper.archive_maker.make_archive_name', return_value="2024-01-02_03-04-05_data.zip"):
+        archive_maker.make_fresh_archive()
+        (data_dir / "a.txt").write_text("changed")
+        second_archive = archive_maker.make_fresh_archive()
+
+    assert os.path.basename(second_archive) == "2024-01-02_03-04-05.1_data.zip"
+    assert parse_archive_name(os.path.basename(second_archive), "data") == (datetime.datetime(2024, 1, 2, 3, 4, 5), 1)
+    assert parse_archive_name(os.path.basename(second_archive), "data_1") is None
+
+
+def test_restart_continues_from_index(data_dir, archives_dir, tmp_path):
+    db_path = tmp_path / "job.sqlite"
+    archive_maker = ArchiveMaker(data_dir, FileIndex(db_path))
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    (data_dir / "a.txt").write_text("changed")
+    restarted = ArchiveMaker(data_dir, FileIndex(db_path))
+    archive_path = restarted.make_fresh_archive()
+
+    with zipfile.ZipFile(archive_path) as zf:
+        assert zf.namelist() == ["a.txt"]
+
+
+def test_stream_fresh_archive_does_not_stage_files(data_dir, archives_dir):
+    uploaded = {}
+
+    class Disk:
+        def upload_stream(self, stream, filename):
+            uploaded[filename] = stream.read()
+
+        def upload(self, file_path):
+            uploaded[os.path.basename(file_path)] = read_file_manifest(file_path)
+
+    archive_maker = ArchiveMaker(data_dir)
+    archive_name = archive_maker.stream_fresh_archive(Disk())
+
+    assert [path.name for path in archives_dir.iterdir()] == [archive_name + FILE_MANIFEST_SUFFIX]
+    with zipfile.ZipFile(io.BytesIO(uploaded[archive_name])) as zf:
+        assert sorted(zf.namelist()) == ["a.txt", "sub/b.txt"]
+    assert sorted(record.path for record in uploaded[archive_name + FILE_MANIFEST_SUFFIX]) == ["a.txt", "sub/b.txt"]
+
+
+def test_archive_has_file_manifest(data_dir, archives_dir):
+    archive_path = ArchiveMaker(data_dir).make_fresh_archive()
+
+    records = {record.path: record for record in read_file_manifest(file_manifest_path(archive_path))}
+
+    assert sorted(records) == ["a.txt", "sub/b.txt"]
+    assert records["a.txt"].size == 1
+    assert records["a.txt"].sha256 == hashlib.sha256(b"a").hexdigest()
+
+
+def test_parallel_archive_maker(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir, workers=4)
+
+    archive_path = archive_maker.make_fresh_archive()
+
+    with zipfile.ZipFile(archive_path) as zf:
+        assert zf.read("a.txt") == b"a"
+        assert zf.read("sub/b.txt") == b"b"
+
+
+def test_pending_archives_after_restart(data_dir, archives_dir, tmp_path):
+    db_path = tmp_path / "job.sqlite"
+    archive_path = ArchiveMaker(data_dir, FileIndex(db_path)).make_fresh_archive()
+
+    restarted = ArchiveMaker(data_dir, FileIndex(db_path))
+    assert restarted.pending_archives() == [archive_path]
+    restarted.mark_uploaded(archive_path)
+
+    assert restarted.pending_archives() == []
+    assert restarted.make_fresh_archive() is None
+
+
+def test_lost_archive_files_are_archived_again(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir)
+    os.remove(archive_maker.make_fresh_archive())
+
+    assert archive_maker.pending_archives() == []
+    assert archive_maker.make_fresh_archive() is not None
+
+
+def test_deleted_file_is_removed_from_index(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir)
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+    stat = os.stat(data_dir / "sub" / "b.txt")
+
+    (data_dir / "sub" / "b.txt").unlink()
+    assert archive_maker.make_fresh_archive() is None
+    assert str(data_dir / "sub" / "b.txt") not in archive_maker.file_index
+    assert str(data_dir / "a.txt") in archive_maker.file_index
+
+    (data_dir / "sub" / "b.txt").write_text("b")
+    os.utime(data_dir / "sub" / "b.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    with zipfile.ZipFile(archive_maker.make_fresh_archive()) as zf:
+        assert zf.namelist() == ["sub/b.txt"]
+
+
+def test_watched_deleted_file_is_removed_from_index(data_dir, archives_dir):
+    watcher = Mock()
+    watcher.drain.return_value = (set(), False)
+    archive_maker = ArchiveMaker(data_dir, watcher=watcher)
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    (data_dir / "a.txt").unlink()
+    watcher.drain.return_value = ({str(data_dir / "a.txt")}, False)
+    assert archive_maker.make_fresh_archive() is None
+
+    assert str(data_dir / "a.txt") not in archive_maker.file_index
+    assert str(data_dir / "sub" / "b.txt") in archive_maker.file_index
+
+
+def test_watched_directory_moved_out_is_removed_from_index(data_dir, archives_dir, tmp_path):
+    (data_dir / "subling").mkdir()
+    (data_dir / "subling" / "c.txt").write_text("c")
+    watcher = Mock()
+    watcher.drain.return_value = (set(), False)
+    archive_maker = ArchiveMaker(data_dir, watcher=watcher)
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    (data_dir / "sub").rename(tmp_path / "moved")
+    watcher.drain.return_value = ({str(data_dir / "sub")}, False)
+    assert archive_maker.make_fresh_archive() is None
+
+    assert str(data_dir / "sub" / "b.txt") not in archive_maker.file_index
+    assert str(data_dir / "subling" / "c.txt") in archive_maker.file_index
+    assert str(data_dir / "a.txt") in archive_maker.file_index
+
+
+def test_watched_archive_maker_checks_only_dirty_paths(data_dir, archives_dir):
+    watcher = Mock()
+    watcher.drain.return_value = (set(), False)
+    archive_maker = ArchiveMaker(data_dir, watcher=watcher)
+    archive_maker.make_fresh_archive()
+
+    (data_dir / "a.txt").write_text("changed")
+    (data_dir / "sub" / "b.txt").write_text("changed")
+    watcher.drain.return_value = ({str(data_dir / "a.txt"), str(data_dir / "gone.txt")}, False)
+    archive_path = archive_maker.make_fresh_archive()
+
+    with zipfile.ZipFile(archive_path) as zf:
+        assert zf.namelist() == ["a.txt"]
+
+
+def test_watched_archive_maker_rescans_after_overflow(data_dir, archives_dir):
+    watcher = Mock()
+    watcher.drain.return_value = (set(), False)
+    archive_maker = ArchiveMaker(data_dir, watcher=watcher)
+    archive_maker.make_fresh_archive()
+
+    (data_dir / "sub" / "b.txt").write_text("changed")
+    watcher.drain.return_value = (set(), True)
+    archive_path = archive_maker.make_fresh_archive()
+
+    with zipfile.ZipFile(archive_path) as zf:
+        assert zf.namelist() == ["sub/b.txt"]
+
+
+def test_watched_archive_maker_returns_files_after_failure(data_dir, archives_dir):
+    watcher = Mock()
+    watcher.drain.return_value = (set(), False)
+    archive_maker = ArchiveMaker(data_dir, watcher=watcher)
+
+    with patch.object(ArchiveMaker, 'write_archive', side_effect=OSError()), pytest.raises(OSError):
+        archive_maker.make_fresh_archive()
+
+    assert sorted(watcher.mark_dirty.call_args.args[0]) == [str(data_dir / "a.txt"), str(data_dir / "sub" / "b.txt")]
+
+
+def test_volumes_are_uploaded_while_next_is_written(data_dir, archives_dir):
+    (data_dir / "c.txt").write_text("c" * 10)
+    archive_maker = ArchiveMaker(data_dir, volume_size=2)
+    submitted = []
+
+    def on_volume(archive_path):
+        submitted.append(archive_path)
+        assert archive_maker.pending_archives() == submitted
+
+    last_volume = archive_maker.make_fresh_archive(on_volume)
+
+    volumes = submitted + [last_volume]
+    assert archive_maker.pending_archives() == volumes
+    members = []
+    for volume in volumes:
+        with zipfile.ZipFile(volume) as zf:
+            members.append(zf.namelist())
+        assert [record.path for record in read_file_manifest(file_manifest_path(volume))] == members[-1]
+    assert sorted(members) == [["a.txt", "sub/b.txt"], ["c.txt"]]
+
+
+def test_failed_volume_keeps_finished_volumes(data_dir, archives_dir):
+    watcher = Mock()
+    watcher.drain.return_value = (set(), False)
+    archive_maker = ArchiveMaker(data_dir, watcher=watcher, volume_size=1)
+    write_archive = ArchiveMaker.write_archive
+
+    def fail_second_volume(self, target, archive_name, files, on_hashed):
+        if self.file_index.queued():
+            raise OSError()
+        write_archive(self, target, archive_name, files, on_hashed)
+
+    with patch.object(ArchiveMaker, 'write_archive', fail_second_volume), pytest.raises(OSError):
+        archive_maker.make_fresh_archive()
+
+    assert len(archive_maker.pending_archives()) == 1
+    assert len(list(archives_dir.glob("*" + FILE_MANIFEST_SUFFIX))) == 1
+    assert len(list(watcher.mark_dirty.call_args.args[0])) == 1
+
+
+def test_stream_volumes_have_distinct_names(data_dir, archives_dir):
+    uploaded = {}
+
+    class Disk:
+        def upload_stream(self, stream, filename):
+            uploaded[filename] = stream.read()
+
+        def upload(self, file_path):
+            uploaded[os.path.basename(file_path)] = read_file_manifest(file_path)
+
+    streamed = []
+    with patch('backuper.archive_maker.make_archive_name', return_value="same.zip"):
+        last_volume = ArchiveMaker(data_dir, volume_size=1).stream_fresh_archive(Disk(), streamed.append)
+
+    assert streamed + [last_volume] == ["same.zip", "same.1.zip"]
+    assert sorted(uploaded) == ["same.1.zip", "same.1.zip" + FILE_MANIFEST_SUFFIX, "same.zip",
+                                "same.zip" + FILE_MANIFEST_SUFFIX]
+
+
+@pytest.mark.parametrize("maker_class, workers", [
+    (ArchiveMaker, 1), (ArchiveMaker, 2), (DedupArchiveMaker, 1), (DeltaArchiveMaker, 1)
+])
+def test_manifest_hashes_come_from_compression_pass(data_dir, archives_dir, maker_class, workers):
+    archive_maker = maker_class(data_dir, workers=workers, hash_cache=HashCache())
+    with patch('backuper.hash_cache.hash_file', side_effect=AssertionError), \
+            patch('backuper.catalog.hash_file', side_effect=AssertionError):
+        archive_path = archive_maker.make_fresh_archive()
+
+    records = read_file_manifest(file_manifest_path(archive_path))
+    assert sorted((record.path, record.sha256) for record in records) == [
+        ("a.txt", hashlib.sha256(b"a").hexdigest()), ("sub/b.txt", hashlib.sha256(b"b").hexdigest())
+    ]
+    assert len(archive_maker.hash_cache) == 2
@@ -1,4 +1,4 @@
-from unittest.mock import patch, call
+from unittest.mock import Mock, patch, call
 
 from backuper.backup import start_backup, stop_backup, get_backups
 
@@ -13,10 +13,39 @@ def test_start_backup_not_authed(mock_print, mock_get_disk, mock_is_disk_authed)
                                          call("Please, run 'python backup.py auth -d <disk>")]
 
 
-@patch('backuper.processes_repository.ProcessesRepository')
+@patch('backuper.backup.ProcessesRepository')
 @patch('backuper.backup.print')
-@patch("json.load", return_value={"test": {"cron": "* * * * *", "pid": 90660}})
-def test_get_backups_no_processes(mock_json_load, mock_print, mock_ProcessesRepository):
+def test_get_backups_no_processes(mock_print, mock_ProcessesRepository):
+    repository = mock_ProcessesRepository.return_value
+    repository.load.return_value = {"test": {"cron": "* * * * *", "pid": 90660}}
+    repository.is_running.return_value = True
     get_backups()
     assert mock_print.call_args_list == [call("test"),
                                          call("\tcron: * * * * *"), call("\tpid: 90660")]
+
+
+@patch('backuper.backup.ProcessesRepository')
+@patch('backuper.backup.print')
+def test_get_backups_marks_dead_processes(mock_print, mock_ProcessesRepository):
+    repository = mock_ProcessesRepository.return_value
+    repository.load.return_value = {"test": {"cron": "* * * * *", "pid": 90660}}
+    repository.is_running.return_value = False
+    get_backups()
+    assert mock_print.call_args_list[-1] == call("\tstatus: not running")
+
+
+@patch('backuper.backup.is_disk_authed', return_value=True)
+@patch('backuper.backup.ensure_daemon_running', return_value=1234)
+@patch('backuper.backup.ProcessesRepository')
+@patch('backuper.backup.print')
+def test_start_backup_registers_job(mock_print, mock_ProcessesRepository, mock_ensure_daemon_running, mock_is_disk_authed):
+    repository = mock_ProcessesRepository.return_value
+    repository.__contains__ = Mock(return_value=False)
+
+    start_backup('yandex', '*/5 * * * *', 'name', '/path', workers=2)
+
+    name, info = repository.add_process.call_args.args
+    assert name == 'name'
+    assert info["path"] == '/path' and info["disk"] == 'yandex' and info["workers"] == 2
+    assert "pid" not in info
+    mock_ensure_daemon_running.assert_called_once()
@@ -1,11 +1,17 @@
+import os
+import time
+
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import ANY, Mock, patch
 from pathlib import Path
 
 from backuper.disks.base_disk import BaseDisk
 from backuper.backup_loop import start_process
 from backuper.controller import FiniteController
 from backuper.archive_maker import ArchiveMaker
+from backuper.catalog import Catalog, file_manifest_path
+from backuper.metrics import MetricsRepository
+from backuper.retention import RetentionPolicy
 
 
 class FakeProcessesRepository:
@@ -22,6 +28,16 @@ class FakeProcessesRepository:
         return item in self.processes
 
 
+@pytest.fixture(autouse=True)
+def indexes_dir(tmp_path):
+    with patch('backuper.backup_loop.indexes_dir', tmp_path), \
+            patch('backuper.backup_loop.catalog_file', tmp_path / 'catalog.sqlite'), \
+            patch('backuper.backup_loop.cache_file', tmp_path / 'cache.sqlite'), \
+            patch('backuper.backup_loop.metrics_file', tmp_path / 'metrics.sqlite'), \
+            patch('backuper.backup_loop.metrics_textfile', tmp_path / 'backuper.prom'):
+        yield tmp_path
+
+
 @pytest.fixture
 def disk_mock():
     return Mock(spec=BaseDisk)
@@ -38,9 +54,10 @@ def processes_repository():
 
 
 @pytest.fixture
-def mock_cron_parser():
-    with patch('backuper.backup_loop.cron_parser') as mock:
-        yield mock
+def mock_schedule_delay():
+    with patch('backuper.backup_loop.CronSchedule') as mock:
+        mock.return_value.next_fire = time.time()
+        yield mock.return_value.delay
 
 
 @pytest.fixture
@@ -55,37 +72,165 @@ def mock_make_fresh_archive():
         yield mock
 
 
-def test_start_process_with_existing_name(disk_mock, controller, processes_repository, mock_stop_process, mock_cron_parser):
+def test_start_process_with_existing_name(disk_mock, controller, processes_repository, mock_stop_process, mock_schedule_delay):
     processes_repository.add_process('test', {})
-    mock_cron_parser.return_value = 0.1
+    mock_schedule_delay.return_value = 0.1
 
     start_process('test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository)
 
     mock_stop_process.assert_called_once()
 
 
-def test_start_process_with_new_name(disk_mock, controller, processes_repository, mock_stop_process, mock_cron_parser):
-    mock_cron_parser.return_value = 0.1
+def test_start_process_with_new_name(disk_mock, controller, processes_repository, mock_stop_process, mock_schedule_delay):
+    mock_schedule_delay.return_value = 0.1
 
     start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository)
 
     mock_stop_process.assert_not_called()
 
 
-def test_start_process_no_files_to_archive(disk_mock, controller, processes_repository, mock_make_fresh_archive, mock_cron_parser):
+def test_start_process_no_files_to_archive(disk_mock, controller, processes_repository, mock_make_fresh_archive, mock_schedule_delay):
     mock_make_fresh_archive.return_value = None
-    mock_cron_parser.return_value = 0.1
+    mock_schedule_delay.return_value = 0.1
 
     start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository)
 
     disk_mock.upload.assert_not_called()
 
 
-def test_start_process_with_files_to_archive(disk_mock, controller, processes_repository, mock_make_fresh_archive, mock_cron_parser):
+def test_start_process_with_files_to_archive(disk_mock, controller, processes_repository, mock_make_fresh_archive, mock_schedule_delay):
     processes_repository.add_process('new_test', {})
     mock_make_fresh_archive.return_value = '/path/to/archive.zip'
-    mock_cron_parser.return_value = 0.1
+    mock_schedule_delay.return_value = 0.1
 
     start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository)
 
     disk_mock.upload.assert_called_once()
+
+
+def test_start_process_marks_uploaded_files(disk_mock, controller, processes_repository, mock_make_fresh_archive, mock_schedule_delay):
+    mock_make_fresh_archive.return_value = '/path/to/archive.zip'
+    mock_schedule_delay.return_value = 0.1
+
+    with patch.object(ArchiveMaker, 'mark_uploaded') as mock_mark_uploaded:
+        start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository)
+
+    mock_mark_uploaded.assert_called_once_with('/path/to/archive.zip')
+
+
+def test_start_process_uses_index_per_name(disk_mock, controller, processes_repository, mock_schedule_delay, indexes_dir):
+    mock_schedule_delay.return_value = 0.1
+
+    start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository)
+
+    assert (indexes_dir / 'new_test.sqlite').exists()
+
+
+def test_start_process_keeps_signatures_per_name(disk_mock, controller, processes_repository, mock_schedule_delay, indexes_dir):
+    mock_schedule_delay.return_value = 0.1
+
+    start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository,
+                  delta=True)
+
+    assert (indexes_dir / 'new_test.signatures.sqlite').exists()
+
+
+def test_start_process_streams_archive(disk_mock, controller, processes_repository, mock_schedule_delay):
+    mock_schedule_delay.return_value = 0.1
+
+    with patch.object(ArchiveMaker, 'stream_fresh_archive', return_value='archive.zip') as mock_stream:
+        start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller,
+                      processes_repository, stream=True)
+
+    mock_stream.assert_called_once_with(disk_mock, on_volume=ANY)
+    disk_mock.upload.assert_not_called()
+
+
+def test_start_process_resumes_pending_archives(disk_mock, controller, processes_repository, mock_make_fresh_archive, mock_schedule_delay):
+    mock_make_fresh_archive.return_value = None
+    mock_schedule_delay.return_value = 0.1
+
+    with patch.object(ArchiveMaker, 'pending_archives', return_value=['/path/to/pending.zip']):
+        start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, controller, processes_repository)
+
+    disk_mock.upload.assert_called_once_with('/path/to/pending.zip')
+    mock_make_fresh_archive.assert_called_once()
+
+
+def test_start_process_keeps_archiving_while_uploading(disk_mock, processes_repository, mock_make_fresh_archive, mock_schedule_delay):
+    mock_make_fresh_archive.side_effect = ['/path/to/first.zip', '/path/to/second.zip']
+    mock_schedule_delay.return_value = 0.1
+    disk_mock.upload.side_effect = lambda archive_path: time.sleep(0.3)
+
+    with patch.object(ArchiveMaker, 'mark_uploaded') as mock_mark_uploaded:
+        start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, FiniteController(2),
+                      processes_repository, upload_workers=2)
+
+    assert mock_make_fresh_archive.call_count == 2
+    assert sorted(call.args[0] for call in mock_mark_uploaded.call_args_list) == [
+        '/path/to/first.zip', '/path/to/second.zip'
+    ]
+
+
+def test_start_process_continues_after_failed_upload(disk_mock, processes_repository, mock_make_fresh_archive, mock_schedule_delay):
+    mock_make_fresh_archive.side_effect = ['/path/to/archive.zip', None]
+    mock_schedule_delay.return_value = 0.1
+    disk_mock.upload.side_effect = [ConnectionError(), None]
+
+    with patch.object(ArchiveMaker, 'mark_uploaded') as mock_mark_uploaded:
+        start_process('new_test', Path('/path/to/folder'), '0 * * * *', disk_mock, FiniteController(2),
+                      processes_repository)
+
+    assert disk_mock.upload.call_count == 2
+    mock_mark_uploaded.assert_called_once_with('/path/to/archive.zip')
+
+
+def test_start_process_adds_uploaded_archive_to_catalog(disk_mock, controller, processes_repository, mock_schedule_delay, tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'a.txt').write_text('a')
+    archives = tmp_path / 'archives'
+    archives.mkdir()
+    mock_schedule_delay.return_value = 0.1
+
+    with patch('backuper.archive_maker.archives_dir', archives):
+        start_process('new_test', data_dir, '0 * * * *', disk_mock, controller, processes_repository)
+
+    uploaded = [call.args[0] for call in disk_mock.upload.call_args_list]
+    assert uploaded[0] == file_manifest_path(uploaded[1])
+    matches = Catalog(tmp_path / 'catalog.sqlite').find('a.txt')
+    assert [match.archive for match in matches] == [os.path.basename(uploaded[1])]
+
+
+def test_start_process_prunes_by_retention_policy(disk_mock, controller, processes_repository, mock_make_fresh_archive, mock_schedule_delay):
+    mock_make_fresh_archive.return_value = None
+    mock_schedule_delay.return_value = 0.1
+
+    with patch('backuper.backup_loop.restore_index_file', ':memory:'), \
+            patch('backuper.backup_loop.prune', return_value=['old.zip']) as mock_prune, \
+            patch('backuper.backup_loop.ArchiveCache.remove') as mock_remove:
+        start_process('new_test', Path('/path/to/data'), '0 * * * *', disk_mock, FiniteController(2),
+                      processes_repository, retention=RetentionPolicy(daily=7))
+
+    mock_prune.assert_called_once()
+    assert mock_prune.call_args.args[2:] == ('data', RetentionPolicy(daily=7))
+    mock_remove.assert_called_once_with('old.zip')
+
+
+def test_start_process_records_metrics(disk_mock, controller, processes_repository, mock_schedule_delay, tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'a.txt').write_text('aaaa')
+    (data_dir / 'b.txt').write_text('bb')
+    archives = tmp_path / 'archives'
+    archives.mkdir()
+    mock_schedule_delay.return_value = 0.1
+
+    with patch('backuper.archive_maker.archives_dir', archives):
+        start_process('new_test', data_dir, '0 * * * *', disk_mock, controller, processes_repository)
+
+    run, = MetricsRepository(tmp_path / 'metrics.sqlite').history('new_test')
+    assert run.succeeded
+    assert (run.scanned_files, run.changed_files, run.raw_bytes) == (2, 2, 6)
+    assert run.compressed_bytes > 0
+    assert 'backuper_changed_files{job="new_test"} 2.0' in (tmp_path / 'backuper.prom').read_text()
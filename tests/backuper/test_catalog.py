@@ -0,0 +1,111 @@
+import datetime
+import hashlib
+import os
+import shutil
+
+from backuper.catalog import Catalog, FileRecord, file_manifest_path, read_file_manifest, write_file_manifest
+from backuper.remote_manifest import RemoteFile
+from backuper.scanner import scan_path
+from backuper.utils import ARCHIVE_TIME_FORMAT
+
+
+def _record(path, size=1):
+    return FileRecord(path, size, 0, None)
+
+
+def test_file_manifest_roundtrip(tmp_path):
+    data_dir = tmp_path / "data"
+    (data_dir / "sub").mkdir(parents=True)
+    (data_dir / "sub" / "a.txt").write_text("abc")
+    manifest_path = tmp_path / "archive.zip.files.json.gz"
+
+    assert write_file_manifest(manifest_path, data_dir, scan_path(data_dir)) == 1
+
+    assert read_file_manifest(manifest_path) == [
+        FileRecord("sub/a.txt", 3, os.stat(data_dir / "sub" / "a.txt").st_mtime_ns,
+                   hashlib.sha256(b"abc").hexdigest())
+    ]
+
+
+def test_find_by_glob():
+    catalog = Catalog()
+    catalog.add("GoogleDisk", "1.zip", [_record("docs/report.pdf"), _record("notes.txt")])
+    catalog.add("GoogleDisk", "2.zip", [_record("docs/report.pdf", 2)])
+    catalog.add("YandexDisk", "1.zip", [_record("docs/old/report.pdf")])
+
+    assert [(match.archive, match.file.size) for match in catalog.find("docs/report.pdf")] == [("1.zip", 1), ("2.zip", 2)]
+    assert [match.file.path for match in catalog.find("report*")] == [
+        "docs/old/report.pdf", "docs/report.pdf", "docs/report.pdf"
+    ]
+    assert [match.disk for match in catalog.find("*.pdf", "YandexDisk")] == ["YandexDisk"]
+    assert catalog.find("missing*") == []
+
+
+def test_remove_archive_forgets_unreferenced_paths():
+    catalog = Catalog()
+    catalog.add("GoogleDisk", "1.zip", [_record("old.txt"), _record("kept.txt")])
+    catalog.add("GoogleDisk", "2.zip", [_record("kept.txt", 2)])
+
+    catalog.remove_archive("GoogleDisk", "1.zip")
+
+    assert [(match.archive, match.file.path) for match in catalog.find("*")] == [("2.zip", "kept.txt")]
+    assert catalog.connection.execute("SELECT path FROM paths").fetchall() == [("kept.txt",)]
+    assert not catalog.is_indexed("GoogleDisk", "1.zip")
+
+
+class FakeDisk:
+    def __init__(self, directory):
+        self.directory = directory
+        self.downloaded = []
+
+    def remote_files(self):
+        return [RemoteFile(path.name, path.name, None, None) for path in self.directory.iterdir()]
+
+    @staticmethod
+    def filter_files(files):
+        return [name for name in files if name.endswith(".zip")]
+
+    def download(self, filename, connections, destination):
+        self.downloaded.append(filename)
+        shutil.copy(self.directory / filename, destination)
+
+
+def test_sync_downloads_only_file_manifests(tmp_path):
+    remote = tmp_path / "remote"
+    data_dir = tmp_path / "data"
+    remote.mkdir()
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a")
+    (remote / "new.zip").write_bytes(b"archive data")
+    write_file_manifest(file_manifest_path(remote / "new.zip"), data_dir, scan_path(data_dir))
+    (remote / "legacy.zip").write_bytes(b"archive data")
+    disk = FakeDisk(remote)
+    catalog = Catalog()
+
+    assert catalog.sync(disk) == 2
+    assert catalog.sync(disk) == 0
+
+    assert disk.downloaded == ["new.zip.files.json.gz"]
+    assert [match.archive for match in catalog.find("a.txt")] == ["new.zip"]
+    assert catalog.is_indexed("FakeDisk", "legacy.zip")
+
+
+def test_sync_waits_for_file_manifest_of_fresh_archive(tmp_path):
+    remote = tmp_path / "remote"
+    data_dir = tmp_path / "data"
+    remote.mkdir()
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a")
+    archive_name = datetime.datetime.now().strftime(ARCHIVE_TIME_FORMAT) + "_data.zip"
+    (remote / archive_name).write_bytes(b"archive data")
+    (remote / "2020-01-01_00-00-00_data.zip").write_bytes(b"archive data")
+    disk = FakeDisk(remote)
+    catalog = Catalog()
+
+    assert catalog.sync(disk) == 1
+    assert catalog.is_indexed("FakeDisk", "2020-01-01_00-00-00_data.zip")
+    assert not catalog.is_indexed("FakeDisk", archive_name)
+
+    write_file_manifest(file_manifest_path(remote / archive_name), data_dir, scan_path(data_dir))
+    assert catalog.sync(disk) == 1
+    assert [match.archive for match in catalog.find("a.txt")] == [archive_name]
@@ -0,0 +1,46 @@
+import io
+import random
+
+import pytest
+
+from backuper.chunker import _boundary_mask, _find_boundary_numpy, _find_boundary_python, iter_chunks
+
+
+def _random_bytes(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunks_reassemble_to_original():
+    data = _random_bytes(200_000)
+    chunks = list(iter_chunks(io.BytesIO(data), 1024, 4096, 16384))
+    assert b"".join(chunks) == data
+
+
+def test_chunk_sizes_within_bounds():
+    data = _random_bytes(200_000)
+    chunks = list(iter_chunks(io.BytesIO(data), 1024, 4096, 16384))
+    assert all(1024 <= len(chunk) <= 16384 for chunk in chunks[:-1])
+    assert len(chunks[-1]) <= 16384
+
+
+def test_empty_stream_has_no_chunks():
+    assert list(iter_chunks(io.BytesIO(b""), 1024, 4096, 16384)) == []
+
+
+def test_vectorised_search_finds_same_boundaries():
+    pytest.importorskip("numpy")
+    data = _random_bytes(600_000)
+    for start, end, avg_size in ((0, 600_000, 4096), (1000, 300_000, 65536), (100, 140, 16), (5, 600_000, 1 << 20)):
+        mask = _boundary_mask(avg_size)
+        assert _find_boundary_numpy(data, start, end, mask) == _find_boundary_python(data, start, end, mask)
+
+
+def test_insertion_changes_only_neighbouring_chunks():
+    data = _random_bytes(200_000)
+    modified = data[:100_000] + b"inserted" + data[100_000:]
+
+    original_chunks = set(iter_chunks(io.BytesIO(data), 1024, 4096, 16384))
+    modified_chunks = list(iter_chunks(io.BytesIO(modified), 1024, 4096, 16384))
+
+    new_chunks = [chunk for chunk in modified_chunks if chunk not in original_chunks]
+    assert len(new_chunks) <= 2
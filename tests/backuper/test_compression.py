@@ -0,0 +1,91 @@
+import io
+import random
+import zipfile
+
+import pytest
+
+from backuper.compression import (
+    CodecSelector, DeflateCodec, StoreCodec, get_codec, is_compressible, open_member, read_member,
+    copy_compressed
+)
+from backuper.scanner import FileStat
+
+
+def _entry(path, size):
+    return FileStat(str(path), size, 0, 0, 0o100644)
+
+
+def test_get_codec_invalid():
+    with pytest.raises(ValueError):
+        get_codec("invalid")
+
+
+def test_get_codec_level():
+    assert get_codec("deflate", 9).level == 9
+    assert get_codec("deflate").level == 6
+
+
+def test_is_compressible():
+    assert is_compressible(b"a" * 10_000)
+    assert not is_compressible(random.Random(1).randbytes(10_000))
+
+
+def test_selector_without_auto_returns_codec(tmp_path):
+    codec = DeflateCodec()
+    assert CodecSelector(codec).for_file(_entry(tmp_path / "photo.jpg", 100)) is codec
+
+
+def test_auto_selector_stores_by_extension(tmp_path):
+    assert isinstance(CodecSelector(DeflateCodec(), auto=True).for_file(_entry(tmp_path / "photo.JPG", 100)), StoreCodec)
+
+
+def test_auto_selector_samples_content(tmp_path):
+    random_file = tmp_path / "random.bin"
+    random_file.write_bytes(random.Random(1).randbytes(100_000))
+    text_file = tmp_path / "text.log"
+    text_file.write_bytes(b"log line\n" * 10_000)
+    selector = CodecSelector(DeflateCodec(), auto=True)
+
+    assert isinstance(selector.for_file(_entry(random_file, 100_000)), StoreCodec)
+    assert isinstance(selector.for_file(_entry(text_file, 90_000)), DeflateCodec)
+
+
+@pytest.mark.parametrize("codec_name, module", [("zstd", "zstandard"), ("lz4", "lz4")])
+def test_external_codec_members_round_trip(codec_name, module):
+    pytest.importorskip(module)
+    codec = get_codec(codec_name)
+    content = b"backup " * 100_000
+    buffer = io.BytesIO()
+
+    with zipfile.ZipFile(buffer, mode="w") as zf:
+        with zf.open(zipfile.ZipInfo("a.txt" + codec.suffix), "w") as dst:
+            copy_compressed(io.BytesIO(content), dst, codec, chunk_size=4096)
+
+    with zipfile.ZipFile(buffer) as zf:
+        assert zf.getinfo("a.txt" + codec.suffix).file_size < len(content)
+        assert read_member(zf, "a.txt") == content
+
+
+@pytest.mark.parametrize("codec_name, module", [("zstd", "zstandard"), ("lz4", "lz4")])
+def test_open_member_reads_block_compressed_member_in_parts(codec_name, module):
+    pytest.importorskip(module)
+    codec = get_codec(codec_name)
+    blocks = [bytes([number]) * 10_000 for number in range(3)]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, mode="w") as zf:
+        zf.writestr("a.txt" + codec.suffix, b"".join(
+            codec.compress_block(block, number == len(blocks) - 1) for number, block in enumerate(blocks)
+        ))
+
+    with zipfile.ZipFile(buffer) as zf, open_member(zf, "a.txt") as reader:
+        assert reader.read(15_000) == blocks[0] + blocks[1][:5_000]
+        assert reader.read() == blocks[1][5_000:] + blocks[2]
+
+
+def test_read_member_missing():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, mode="w") as zf:
+        zf.writestr("a.txt", "a")
+    with zipfile.ZipFile(buffer) as zf:
+        with pytest.raises(KeyError):
+            read_member(zf, "b.txt")
@@ -0,0 +1,122 @@
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+
+from backuper.controller import FiniteController
+from backuper.daemon import BackupDaemon
+
+
+class FakeProcessesRepository:
+    def __init__(self, processes):
+        self.processes = processes
+
+    def load(self):
+        return dict(self.processes)
+
+
+@pytest.fixture
+def job_class():
+    with patch('backuper.daemon.BackupJob') as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def get_disk():
+    with patch('backuper.daemon.get_disk') as mock:
+        yield mock
+
+
+def _job_info(**kwargs):
+    info = {"cron": "*/5 * * * *", "path": "/data", "disk": "yandex"}
+    info.update(kwargs)
+    return info
+
+
+def test_sync_adds_and_removes_jobs(job_class):
+    repository = FakeProcessesRepository({"first": _job_info(), "second": _job_info(codec="store")})
+    daemon = BackupDaemon(repository)
+
+    daemon.sync()
+    assert sorted(daemon.jobs) == ["first", "second"]
+
+    del repository.processes["first"]
+    daemon.sync()
+    assert sorted(daemon.jobs) == ["second"]
+    daemon.close()
+    assert job_class.return_value.close.call_count == 2
+
+
+def test_changed_job_is_replaced_after_old_one_closes(job_class):
+    repository = FakeProcessesRepository({"job": _job_info()})
+    daemon = BackupDaemon(repository)
+    daemon.sync()
+    uploads_finished = threading.Event()
+    job_class.return_value.close.side_effect = lambda: uploads_finished.wait(10)
+
+    repository.processes["job"] = _job_info(workers=4)
+    daemon.sync()
+    daemon.sync()
+
+    assert daemon.jobs == {}
+    assert job_class.call_count == 1
+    uploads_finished.set()
+    daemon._closing["job"].result()
+    daemon.sync()
+    assert daemon.jobs["job"].info["workers"] == 4
+    daemon.close()
+
+
+def test_sync_skips_standalone_processes(job_class):
+    daemon = BackupDaemon(FakeProcessesRepository({"standalone": _job_info(pid=123)}))
+
+    daemon.sync()
+
+    assert daemon.jobs == {}
+    daemon.close()
+
+
+def test_sync_restarts_changed_job(job_class):
+    repository = FakeProcessesRepository({"job": _job_info()})
+    daemon = BackupDaemon(repository)
+    daemon.sync()
+    first_job = daemon.jobs["job"]
+
+    repository.processes["job"] = _job_info(workers=4)
+    daemon.sync()
+    daemon._closer.submit(lambda: None).result()
+    daemon.sync()
+
+    assert daemon.jobs["job"] is not first_job
+    assert daemon.jobs["job"].info["workers"] == 4
+    daemon.close()
+
+
+def test_each_job_has_own_disk_client(job_class, get_disk):
+    get_disk.return_value.side_effect = lambda: Mock()
+    daemon = BackupDaemon(FakeProcessesRepository({"first": _job_info(), "second": _job_info()}))
+
+    daemon.sync()
+
+    disks = [call.args[2] for call in job_class.call_args_list]
+    assert len(disks) == 2 and disks[0] is not disks[1]
+    daemon.close()
+
+
+def test_run_executes_due_jobs(job_class):
+    daemon = BackupDaemon(FakeProcessesRepository({"job": _job_info()}))
+
+    daemon.run(FiniteController(1))
+    daemon.close()
+
+    job_class.return_value.run_once.assert_called_once()
+    job_class.return_value.close.assert_called_once()
+
+
+def test_finished_job_is_scheduled_by_cron(job_class):
+    daemon = BackupDaemon(FakeProcessesRepository({"job": _job_info(cron="0 3 * * *")}), poll_interval=0)
+
+    daemon.run(FiniteController(3))
+    daemon.close()
+
+    job_class.return_value.run_once.assert_called_once()
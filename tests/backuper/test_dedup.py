@@ -0,0 +1,120 @@
+import os
+import json
+import random
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+from backuper.compression import CodecSelector, get_codec
+from backuper.dedup import ChunkIndex, DedupArchiveMaker, restore_snapshot
+
+
+@pytest.fixture(autouse=True)
+def small_chunks():
+    with patch.object(DedupArchiveMaker, 'min_chunk_size', 1024), \
+            patch.object(DedupArchiveMaker, 'avg_chunk_size', 4096), \
+            patch.object(DedupArchiveMaker, 'max_chunk_size', 16384):
+        yield
+
+
+@pytest.fixture
+def archives_dir(tmp_path):
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    with patch('backuper.archive_maker.archives_dir', archives):
+        yield archives
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "big.bin").write_bytes(random.Random(1).randbytes(200_000))
+    (data / "small.txt").write_text("small")
+    return data
+
+
+def _chunk_members(archive_path):
+    with zipfile.ZipFile(archive_path) as zf:
+        return [name for name in zf.namelist() if name.startswith("chunks/")]
+
+
+def test_chunk_index_add_and_get():
+    index = ChunkIndex()
+    index.add({"abc": ("archive.zip", 10)})
+    assert index.get("abc") == "archive.zip"
+    assert "abc" in index
+    assert index.get("def") is None
+
+
+def test_only_new_chunks_are_archived(data_dir, archives_dir):
+    archive_maker = DedupArchiveMaker(data_dir)
+    first_archive = archive_maker.make_fresh_archive()
+    first_chunks = _chunk_members(first_archive)
+
+    content = bytearray((data_dir / "big.bin").read_bytes())
+    content[150_000:150_010] = b"0123456789"
+    (data_dir / "big.bin").write_bytes(bytes(content))
+
+    with patch('backuper.archive_maker.make_archive_name', return_value="second.zip"):
+        second_archive = archive_maker.make_fresh_archive()
+    second_chunks = _chunk_members(second_archive)
+
+    assert 0 < len(second_chunks) <= 2
+    assert not set(second_chunks) & set(first_chunks)
+    with zipfile.ZipFile(second_archive) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+    assert [file_info["path"] for file_info in manifest["files"]] == ["big.bin"]
+
+
+def test_restore_snapshot(data_dir, archives_dir, tmp_path):
+    archive_maker = DedupArchiveMaker(data_dir)
+    archive_maker.make_fresh_archive()
+
+    content = (data_dir / "big.bin").read_bytes()[:100_000] + b"appended"
+    (data_dir / "big.bin").write_bytes(content)
+    with patch('backuper.archive_maker.make_archive_name', return_value="second.zip"):
+        second_archive = archive_maker.make_fresh_archive()
+
+    target = tmp_path / "restored"
+    restore_snapshot(second_archive, target)
+
+    assert (target / "big.bin").read_bytes() == content
+    assert not (target / "small.txt").exists()
+
+
+def test_parallel_snapshot_restores(data_dir, archives_dir, tmp_path):
+    archive_maker = DedupArchiveMaker(data_dir, workers=4)
+    archive_path = archive_maker.make_fresh_archive()
+
+    target = tmp_path / "restored"
+    restore_snapshot(archive_path, target)
+
+    assert (target / "big.bin").read_bytes() == (data_dir / "big.bin").read_bytes()
+    assert (target / "small.txt").read_text() == "small"
+
+
+def test_snapshot_with_zstd_chunks_restores(data_dir, archives_dir, tmp_path):
+    pytest.importorskip("zstandard")
+    archive_maker = DedupArchiveMaker(data_dir, codec_selector=CodecSelector(get_codec("zstd"), auto=True))
+    archive_path = archive_maker.make_fresh_archive()
+
+    target = tmp_path / "restored"
+    restore_snapshot(archive_path, target)
+
+    assert (target / "big.bin").read_bytes() == (data_dir / "big.bin").read_bytes()
+    assert (target / "small.txt").read_text() == "small"
+
+
+def test_lost_snapshot_chunks_are_archived_again(data_dir, archives_dir):
+    archive_maker = DedupArchiveMaker(data_dir)
+    first_archive = archive_maker.make_fresh_archive()
+    first_chunks = _chunk_members(first_archive)
+    os.remove(first_archive)
+
+    assert archive_maker.pending_archives() == []
+    assert len(archive_maker.chunk_index) == 0
+    with patch('backuper.archive_maker.make_archive_name', return_value="second.zip"):
+        second_archive = archive_maker.make_fresh_archive()
+    assert sorted(_chunk_members(second_archive)) == sorted(first_chunks)
@@ -0,0 +1,188 @@
+import datetime
+import io
+import os
+import random
+import shutil
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+from backuper.delta import (
+    DELTA_SUFFIX, MAX_CHAIN_LENGTH, DeltaArchiveMaker, SignatureStore, StoredSignature, apply_delta,
+    compute_signature, write_delta
+)
+from backuper.remote_manifest import RemoteFile
+from backuper.restore import RestoreIndex, Restorer, required_archives
+from backuper.scanner import scan_path
+
+BLOCK_SIZE = 1024
+
+
+class FakeDisk:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def remote_files(self):
+        return [RemoteFile(path.name, path.name, path.stat().st_size, None) for path in self.directory.iterdir()]
+
+    def open_remote(self, remote_file):
+        return open(self.directory / remote_file.name, "rb")
+
+    def download(self, filename, connections, destination):
+        shutil.copy(self.directory / filename, destination)
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path):
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    with patch("backuper.restore.archives_dir", archives):
+        yield archives
+
+
+def _random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def _round_trip(old, new):
+    signature = compute_signature(io.BytesIO(old), BLOCK_SIZE)
+    delta = io.BytesIO()
+    copied, literal = write_delta(io.BytesIO(new), signature, delta)
+    restored = io.BytesIO()
+    delta.seek(0)
+    apply_delta(io.BytesIO(old), delta, restored)
+    assert restored.getvalue() == new
+    return copied, literal
+
+
+def test_delta_of_in_place_change_contains_only_changed_block():
+    old = _random_bytes(64 * BLOCK_SIZE)
+    new = bytearray(old)
+    new[10 * BLOCK_SIZE + 5:10 * BLOCK_SIZE + 20] = b"x" * 15
+
+    copied, literal = _round_trip(old, bytes(new))
+
+    assert literal == BLOCK_SIZE
+    assert copied == len(old) - BLOCK_SIZE
+
+
+def test_delta_finds_blocks_shifted_by_insertion():
+    old = _random_bytes(64 * BLOCK_SIZE)
+    new = old[:20 * BLOCK_SIZE + 100] + b"inserted" + old[20 * BLOCK_SIZE + 100:]
+
+    copied, literal = _round_trip(old, new)
+
+    assert literal <= 2 * BLOCK_SIZE
+    assert copied >= len(old) - 2 * BLOCK_SIZE
+
+
+def test_delta_of_appended_and_truncated_file():
+    old = _random_bytes(10 * BLOCK_SIZE + 300)
+    _round_trip(old, old + b"tail")
+    _round_trip(old, old[:5 * BLOCK_SIZE + 7])
+    _round_trip(old, b"")
+    _round_trip(b"", old)
+
+
+def test_apply_delta_rejects_truncated_delta():
+    old = _random_bytes(4 * BLOCK_SIZE)
+    delta = io.BytesIO()
+    write_delta(io.BytesIO(old + b"new"), compute_signature(io.BytesIO(old), BLOCK_SIZE), delta)
+
+    with pytest.raises(ValueError):
+        apply_delta(io.BytesIO(old), io.BytesIO(delta.getvalue()[:-3]), io.BytesIO())
+
+
+def test_signature_store_evicts_least_recently_used():
+    signature = compute_signature(io.BytesIO(_random_bytes(10 * BLOCK_SIZE)), BLOCK_SIZE)
+    size = len(signature.blocks) * 20
+    store = SignatureStore(max_bytes=2 * size)
+    store.put({"a": StoredSignature("1.zip", [], signature)})
+    store.put({"b": StoredSignature("1.zip", [], signature)})
+    assert store.get("a") is not None
+    store.put({"c": StoredSignature("2.zip", ["1.zip"], signature)})
+
+    assert store.get("b") is None
+    assert store.get("a") == StoredSignature("1.zip", [], signature)
+    assert store.get("c").chain == ["1.zip"]
+
+    store.remove_archive("1.zip")
+    assert len(store) == 1
+
+
+def _make_archive(maker, remote_dir, name):
+    files = list(scan_path(maker.path))
+    maker.write_archive(remote_dir / name, name, files)
+    maker._commit_signatures()
+
+
+def test_restores_file_from_delta_chain(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    remote_dir = tmp_path / "remote"
+    remote_dir.mkdir()
+    big = data_dir / "big.bin"
+    content = bytearray(_random_bytes(200 * 1024))
+    big.write_bytes(content)
+    (data_dir / "small.txt").write_text("small")
+    maker = DeltaArchiveMaker(data_dir, min_delta_size=64 * 1024)
+
+    names = [f"2024-01-0{day}_00-00-00_data.zip" for day in range(1, 4)]
+    _make_archive(maker, remote_dir, names[0])
+    content[1000:1010] = b"0123456789"
+    big.write_bytes(content)
+    _make_archive(maker, remote_dir, names[1])
+    content += b"appended"
+    big.write_bytes(content)
+    _make_archive(maker, remote_dir, names[2])
+
+    with zipfile.ZipFile(remote_dir / names[2]) as zf:
+        member = zf.getinfo("big.bin" + DELTA_SUFFIX)
+        assert member.comment.decode() == f"delta:{names[0]},{names[1]}"
+        assert member.compress_size < 64 * 1024
+
+    index = RestoreIndex()
+    target = tmp_path / "restored"
+    restored = Restorer(FakeDisk(remote_dir), index).restore("data", datetime.datetime(2024, 1, 4), target)
+
+    assert restored == 2
+    assert (target / "big.bin").read_bytes() == bytes(content)
+    assert (target / "small.txt").read_text() == "small"
+    assert not os.listdir(tmp_path / "archives")
+    entries = index.resolve("FakeDisk", names).values()
+    assert required_archives(entries) == set(names)
+
+
+def test_chain_is_capped_with_full_copy(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    big = data_dir / "big.bin"
+    content = bytearray(_random_bytes(8 * BLOCK_SIZE))
+    maker = DeltaArchiveMaker(data_dir, min_delta_size=BLOCK_SIZE)
+
+    for number in range(MAX_CHAIN_LENGTH + 1):
+        content[0] = number
+        big.write_bytes(content)
+        maker.write_archive(tmp_path / f"{number}.zip", f"{number}.zip", list(scan_path(data_dir)))
+        maker._commit_signatures()
+
+    with zipfile.ZipFile(tmp_path / f"{MAX_CHAIN_LENGTH - 1}.zip") as zf:
+        assert zf.namelist() == ["big.bin" + DELTA_SUFFIX]
+    with zipfile.ZipFile(tmp_path / f"{MAX_CHAIN_LENGTH}.zip") as zf:
+        assert zf.namelist() == ["big.bin"]
+
+
+def test_discard_forgets_signatures_of_archive(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "big.bin").write_bytes(_random_bytes(4 * BLOCK_SIZE))
+    maker = DeltaArchiveMaker(data_dir, min_delta_size=BLOCK_SIZE)
+    archive = tmp_path / "1.zip"
+    maker.write_archive(archive, archive.name, list(scan_path(data_dir)))
+    maker._commit_signatures()
+    assert maker.signature_store.get(str(data_dir / "big.bin")) is not None
+
+    maker.discard(str(archive))
+
+    assert maker.signature_store.get(str(data_dir / "big.bin")) is None
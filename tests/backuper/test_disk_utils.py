@@ -1,6 +1,6 @@
 import pytest
 
-from backuper.disk_utils import get_disk, YandexDisk, GoogleDisk
+from backuper.disk_utils import get_disk, YandexDisk, GoogleDisk, LocalDisk
 
 
 def test_get_disk_yandex():
@@ -13,6 +13,11 @@ def test_get_disk_google():
     assert disk == GoogleDisk
 
 
+def test_get_disk_local():
+    disk = get_disk("local")
+    assert disk == LocalDisk
+
+
 def test_get_disk_invalid():
     try:
         get_disk("invalid")
@@ -0,0 +1,85 @@
+import hashlib
+import re
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from backuper import download_engine
+from backuper.download_engine import DownloadEngine
+
+DATA = bytes(range(256)) * 4
+
+
+class FakeSession:
+    def __init__(self, failures=0, status_code=206):
+        self.failures = failures
+        self.status_code = status_code
+        self.ranges = []
+
+    def get(self, url, headers, stream, timeout):
+        start, end = map(int, re.fullmatch(r"bytes=(\d+)-(\d+)", headers["Range"]).groups())
+        self.ranges.append((start, end))
+        body = DATA[start:end + 1]
+        if self.failures:
+            self.failures -= 1
+            body = body[:len(body) // 2]
+
+        response = MagicMock(status_code=self.status_code)
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [body[i:i + 100] for i in range(0, len(body), 100)]
+        if self.status_code >= 400:
+            response.raise_for_status.side_effect = requests.HTTPError(response=response)
+        return response
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with patch.object(download_engine.time, "sleep"):
+        yield
+
+
+def _download(session, destination, checksum=None, connections=3):
+    engine = DownloadEngine(connections, part_size=300)
+    with patch.object(engine, "_session", return_value=session):
+        engine.download("https://disk/file", str(destination), len(DATA), checksum)
+
+
+def test_downloads_ranges(tmp_path):
+    destination = tmp_path / "archive.zip"
+    session = FakeSession()
+
+    _download(session, destination, hashlib.md5(DATA).hexdigest())
+
+    assert destination.read_bytes() == DATA
+    assert sorted(session.ranges) == [(0, 299), (300, 599), (600, 899), (900, 1023)]
+    assert not (tmp_path / "archive.zip.part").exists()
+
+
+def test_retries_range_from_received_offset(tmp_path):
+    destination = tmp_path / "archive.zip"
+    session = FakeSession(failures=1)
+
+    _download(session, destination, connections=1)
+
+    assert destination.read_bytes() == DATA
+    assert session.ranges[:2] == [(0, 299), (150, 299)]
+
+
+def test_checksum_mismatch(tmp_path):
+    destination = tmp_path / "archive.zip"
+
+    with pytest.raises(ValueError):
+        _download(FakeSession(), destination, "0" * 32)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_client_error_is_not_retried(tmp_path):
+    session = FakeSession(status_code=404)
+
+    with pytest.raises(requests.HTTPError):
+        _download(session, tmp_path / "archive.zip", connections=1)
+
+    assert len(session.ranges) == 1
+    assert list(tmp_path.iterdir()) == []
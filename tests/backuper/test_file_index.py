@@ -0,0 +1,111 @@
+from backuper.file_index import FileIndex
+from backuper.scanner import FileStat
+
+
+def test_new_file_is_changed():
+    index = FileIndex()
+    assert index.is_changed(FileStat("/data/a.txt", 10, 100, 1, 0o100644))
+
+
+def test_update_and_get():
+    index = FileIndex()
+    index.update([FileStat("/data/a.txt", 10, 100, 1, 0o100644)])
+    assert index.get("/data/a.txt") == (10, 100, 1)
+    assert "/data/a.txt" in index
+    assert len(index) == 1
+
+
+def test_unchanged_file():
+    index = FileIndex()
+    index.update([FileStat("/data/a.txt", 10, 100, 1, 0o100644)])
+    assert not index.is_changed(FileStat("/data/a.txt", 10, 100, 1, 0o100644))
+
+
+def test_changed_size_mtime_or_inode():
+    index = FileIndex()
+    index.update([FileStat("/data/a.txt", 10, 100, 1, 0o100644)])
+    assert index.is_changed(FileStat("/data/a.txt", 11, 100, 1, 0o100644))
+    assert index.is_changed(FileStat("/data/a.txt", 10, 101, 1, 0o100644))
+    assert index.is_changed(FileStat("/data/a.txt", 10, 100, 2, 0o100644))
+
+
+def test_remove():
+    index = FileIndex()
+    index.update([FileStat("/data/a.txt", 10, 100, 1, 0o100644), FileStat("/data/b.txt", 20, 200, 2, 0o100644)])
+    index.remove(["/data/a.txt"])
+    assert "/data/a.txt" not in index
+    assert "/data/b.txt" in index
+
+
+def test_remove_trees():
+    index = FileIndex()
+    index.update([FileStat(path, 1, 1, 1, 0o100644) for path in ("/data/a.txt", "/data/sub/b.txt", "/data/sub/c/d.txt",
+                                                                 "/data/sub.txt", "/data/subling/e.txt")])
+
+    assert index.remove_trees(["/data/sub", "/data/a.txt"]) == 3
+    assert "/data/sub.txt" in index
+    assert "/data/subling/e.txt" in index
+    assert len(index) == 2
+
+
+def test_remove_unseen():
+    index = FileIndex()
+    index.update([FileStat("/data/a.txt", 10, 100, 1, 0o100644), FileStat("/data/b.txt", 20, 200, 2, 0o100644)])
+
+    index.begin_scan()
+    index.mark_seen([FileStat("/data/b.txt", 20, 200, 2, 0o100644), FileStat("/data/c.txt", 30, 300, 3, 0o100644)])
+
+    assert index.remove_unseen() == 1
+    assert "/data/a.txt" not in index
+    assert "/data/b.txt" in index
+    index.begin_scan()
+    assert index.remove_unseen() == 1
+    assert len(index) == 0
+
+
+def test_index_persists_between_instances(tmp_path):
+    db_path = tmp_path / "job.sqlite"
+    index = FileIndex(db_path)
+    index.update([FileStat("/data/a.txt", 10, 100, 1, 0o100644)])
+    index.close()
+
+    reopened = FileIndex(db_path)
+    assert reopened.get("/data/a.txt") == (10, 100, 1)
+
+
+def test_enqueue_and_dequeue():
+    index = FileIndex()
+    index.enqueue("/archives/1.zip", [FileStat("/data/a.txt", 10, 100, 1, 0o100644)])
+    index.enqueue("/archives/2.zip", [FileStat("/data/b.txt", 10, 100, 2, 0o100644)])
+
+    assert index.queued() == ["/archives/1.zip", "/archives/2.zip"]
+    assert not index.is_changed(FileStat("/data/a.txt", 10, 100, 1, 0o100644))
+
+    index.dequeue("/archives/1.zip")
+    assert index.queued() == ["/archives/2.zip"]
+    assert "/data/a.txt" in index
+
+
+def test_discard_forgets_files_of_lost_archive():
+    index = FileIndex()
+    index.enqueue("/archives/1.zip", [
+        FileStat("/data/a.txt", 10, 100, 1, 0o100644), FileStat("/data/b.txt", 10, 100, 2, 0o100644)
+    ])
+    index.enqueue("/archives/2.zip", [FileStat("/data/b.txt", 20, 200, 2, 0o100644)])
+
+    index.discard("/archives/1.zip")
+
+    assert index.queued() == ["/archives/2.zip"]
+    assert "/data/a.txt" not in index
+    assert index.get("/data/b.txt") == (20, 200, 2)
+
+
+def test_touched_files_of_lost_archive_are_forgotten():
+    index = FileIndex()
+    index.enqueue("/archives/1.zip", [FileStat("/data/a.txt", 10, 100, 1, 0o100644)])
+
+    index.touch([FileStat("/data/a.txt", 10, 300, 3, 0o100644)])
+    assert index.get("/data/a.txt") == (10, 300, 3)
+
+    index.discard("/archives/1.zip")
+    assert "/data/a.txt" not in index
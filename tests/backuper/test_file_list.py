@@ -0,0 +1,31 @@
+import pytest
+
+from backuper.file_list import FileList
+from backuper.scanner import FileStat
+
+
+def _entries():
+    return [
+        FileStat("/data/a.txt", 10, -5, 2 ** 40, 0o100644, 2 ** 33),
+        FileStat("/data/sub/b.txt", 0, 100, 1, 0o100600, 1),
+        FileStat("/data/тест\udcff.bin", 2 ** 40, 1_700_000_000 * 10 ** 9, 3, 0o100755, 1),
+        FileStat("relative", 1, 1, 1, 0o100644),
+    ]
+
+
+def test_file_list_returns_appended_entries():
+    files = FileList(_entries())
+
+    assert len(files) == 4
+    assert list(files) == _entries()
+    assert files == _entries()
+    assert files[-1] == _entries()[-1]
+    with pytest.raises(IndexError):
+        files[4]
+
+
+def test_file_list_stores_directory_once():
+    files = FileList(FileStat(f"/data/dir/file{number}", number, 0, number, 0o100644) for number in range(100))
+
+    assert files._dirs == ["/data/dir"]
+    assert files[42].path == "/data/dir/file42"
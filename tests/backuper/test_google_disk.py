@@ -0,0 +1,185 @@
+import io
+import os
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from backuper.disks import google_disk
+from backuper.disks.google_disk import GoogleDisk
+from backuper.remote_manifest import RemoteFile, RemoteManifest
+from backuper.upload_sessions import UploadSessions
+
+BACKUP_NAME = "2022-01-01_00-00-00_test.zip"
+
+
+def _response(status_code, headers=None):
+    metadata = {"title": BACKUP_NAME, "id": "new-id", "fileSize": "10", "md5Checksum": "abc"}
+    return Mock(status_code=status_code, headers=headers or {}, json=Mock(return_value=metadata))
+
+
+@pytest.fixture
+def disk():
+    disk = GoogleDisk.__new__(GoogleDisk)
+    disk._http_lock = threading.RLock()
+    disk.upload_sessions = UploadSessions()
+    disk.manifest = RemoteManifest()
+    disk._create_upload_session = Mock(return_value="https://upload/new")
+    return disk
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / "archive.zip"
+    path.write_bytes(b"x" * 10)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def small_chunks():
+    with patch.object(google_disk, "UPLOAD_CHUNK_SIZE", 4), patch.object(google_disk.time, "sleep"):
+        yield
+
+
+def test_upload_in_chunks(disk, archive):
+    with patch.object(google_disk.requests, "put", side_effect=[
+        _response(308, {"Range": "bytes=0-3"}),
+        _response(308, {"Range": "bytes=0-7"}),
+        _response(200),
+    ]) as mock_put:
+        disk.upload(archive)
+
+    ranges = [call.kwargs["headers"]["Content-Range"] for call in mock_put.call_args_list]
+    assert ranges == ["bytes 0-3/10", "bytes 4-7/10", "bytes 8-9/10"]
+    stat = os.stat(archive)
+    assert disk.upload_sessions.get("GoogleDisk", str(archive), stat.st_size, stat.st_mtime_ns) is None
+    assert disk.manifest.get("GoogleDisk", BACKUP_NAME) == RemoteFile(BACKUP_NAME, "new-id", 10, "abc")
+
+
+def test_upload_resumes_saved_session(disk, archive):
+    stat = os.stat(archive)
+    disk.upload_sessions.save("GoogleDisk", str(archive), "https://upload/old", stat.st_size, stat.st_mtime_ns, 4)
+
+    with patch.object(google_disk.requests, "put", side_effect=[
+        _response(308, {"Range": "bytes=0-7"}),
+        _response(200),
+    ]) as mock_put:
+        disk.upload(archive)
+
+    disk._create_upload_session.assert_not_called()
+    assert mock_put.call_args_list[1].args[0] == "https://upload/old"
+    assert mock_put.call_args_list[1].kwargs["headers"]["Content-Range"] == "bytes 8-9/10"
+
+
+def test_upload_retries_from_confirmed_offset(disk, archive):
+    with patch.object(google_disk.requests, "put", side_effect=[
+        _response(308, {"Range": "bytes=0-3"}),
+        requests.ConnectionError(),
+        _response(308, {"Range": "bytes=0-5"}),
+        _response(308, {"Range": "bytes=0-9"}),
+        _response(200),
+    ]) as mock_put:
+        disk.upload(archive)
+
+    ranges = [call.kwargs["headers"]["Content-Range"] for call in mock_put.call_args_list]
+    assert ranges == ["bytes 0-3/10", "bytes 4-7/10", "bytes */10", "bytes 6-9/10", "bytes */10"]
+
+
+def test_failed_upload_keeps_session(disk, archive):
+    with patch.object(google_disk.requests, "put", side_effect=[_response(308, {"Range": "bytes=0-3"})]
+                      + [requests.ConnectionError()] * 20):
+        with pytest.raises(ValueError):
+            disk.upload(archive)
+
+    stat = os.stat(archive)
+    assert disk.upload_sessions.get("GoogleDisk", str(archive), stat.st_size, stat.st_mtime_ns) == \
+        ("https://upload/new", 4)
+
+
+def _change(file_id, title=None, deleted=False, in_root=True):
+    change = {"fileId": file_id, "deleted": deleted}
+    if title is not None:
+        change["file"] = {"id": file_id, "title": title, "parents": [{"isRoot": in_root}], "labels": {"trashed": False}}
+    return change
+
+
+def test_refresh_applies_changes(disk):
+    old_name = "2022-01-01_00-00-00_old.zip"
+    disk.manifest.put("GoogleDisk", [RemoteFile(old_name, "old-id", 1, None), RemoteFile(BACKUP_NAME, "moved-id", 1, None)])
+    disk.manifest.set_state("GoogleDisk", "change_token", "1")
+    service = Mock()
+    service.changes.return_value.list.return_value.execute.side_effect = [
+        {"items": [_change("old-id", deleted=True)], "nextPageToken": "2"},
+        {"items": [_change("moved-id", BACKUP_NAME, in_root=False), _change("new-id", "2022-02-01_00-00-00_new.zip"),
+                   _change("other-id", "notes.txt")], "newStartPageToken": "3"},
+    ]
+    disk._drive_service = Mock(return_value=service)
+
+    assert disk.list_of_files() == ["2022-02-01_00-00-00_new.zip"]
+    assert disk.manifest.get_state("GoogleDisk", "change_token") == "3"
+    assert disk.manifest.is_fresh("GoogleDisk", 60)
+
+
+def test_download_uses_manifest(disk):
+    disk.manifest.put("GoogleDisk", [RemoteFile(BACKUP_NAME, "file-id", 10, "abc")])
+    disk.drive = Mock()
+
+    with patch("backuper.disks.base_disk.DownloadEngine") as engine:
+        disk.download(BACKUP_NAME, connections=3)
+
+    disk.drive.ListFile.assert_not_called()
+    engine.assert_called_once_with(3)
+    engine.return_value.download.assert_called_once_with(
+        "https://www.googleapis.com/drive/v2/files/file-id?alt=media", BACKUP_NAME, 10, "abc", disk._download_headers
+    )
+
+
+def test_download_missing_file(disk):
+    disk._refresh_manifest = Mock()
+    with pytest.raises(ValueError):
+        disk.download(BACKUP_NAME)
+    disk._refresh_manifest.assert_called_once_with(full=False)
+
+
+def test_upload_stream_in_chunks(disk):
+    with patch.object(google_disk.requests, "put", side_effect=[
+        _response(308, {"Range": "bytes=0-3"}),
+        _response(308, {"Range": "bytes=0-7"}),
+        _response(200),
+    ]) as mock_put:
+        disk.upload_stream(io.BytesIO(b"x" * 10), BACKUP_NAME)
+
+    ranges = [call.kwargs["headers"]["Content-Range"] for call in mock_put.call_args_list]
+    assert ranges == ["bytes 0-3/*", "bytes 4-7/*", "bytes 8-9/10"]
+    assert disk.manifest.get("GoogleDisk", BACKUP_NAME) == RemoteFile(BACKUP_NAME, "new-id", 10, "abc")
+
+
+def test_upload_stream_resumes_from_reported_offset(disk):
+    with patch.object(google_disk.requests, "put", side_effect=[
+        _response(308, {"Range": "bytes=0-3"}),
+        requests.ConnectionError(),
+        _response(503),
+        _response(308, {"Range": "bytes=0-5"}),
+        _response(308, {"Range": "bytes=0-9"}),
+        requests.ConnectionError(),
+        _response(201),
+    ]) as mock_put:
+        disk.upload_stream(io.BytesIO(bytes(range(11))), BACKUP_NAME)
+
+    calls = [(call.kwargs["headers"]["Content-Range"], call.kwargs.get("data")) for call in mock_put.call_args_list]
+    assert calls == [
+        ("bytes 0-3/*", bytes(range(4))),
+        ("bytes 4-7/*", bytes(range(4, 8))),
+        ("bytes */*", None),
+        ("bytes */*", None),
+        ("bytes 6-9/*", bytes(range(6, 10))),
+        ("bytes 10-10/11", bytes([10])),
+        ("bytes */11", None),
+    ]
+
+
+def test_upload_stream_gives_up_after_retries(disk):
+    with patch.object(google_disk.requests, "put", side_effect=[requests.ConnectionError()] * 20):
+        with pytest.raises(ValueError):
+            disk.upload_stream(io.BytesIO(b"x" * 10), BACKUP_NAME)
@@ -0,0 +1,116 @@
+import os
+import shutil
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+from backuper.archive_maker import ArchiveMaker
+from backuper.catalog import file_manifest_path, hash_file, read_file_manifest
+from backuper.hash_cache import HashCache
+from backuper.scanner import scan_path
+
+
+@pytest.fixture
+def archives_dir(tmp_path):
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    with patch('backuper.archive_maker.archives_dir', archives):
+        yield archives
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("aaaa")
+    (data / "b.txt").write_text("bbbb")
+    return data
+
+
+def _touch(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def _archived_names(archive_path):
+    with zipfile.ZipFile(archive_path) as zf:
+        return sorted(zf.namelist())
+
+
+def test_hash_is_cached_until_file_changes(data_dir):
+    cache = HashCache()
+    entry, = (entry for entry in scan_path(data_dir) if entry.path.endswith("a.txt"))
+
+    assert cache.hash(entry) == hash_file(entry.path)
+    assert cache.get(entry.device, entry.inode, entry.size, entry.mtime_ns) == hash_file(entry.path)
+
+    _touch(entry.path)
+    assert cache.get(entry.device, entry.inode, entry.size, entry.mtime_ns + 10 ** 9) is None
+    assert len(cache) == 1
+
+
+def test_touched_file_with_same_content_is_skipped(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir, hash_cache=HashCache())
+    archive_path = archive_maker.make_fresh_archive()
+    archive_maker.mark_uploaded(archive_path)
+    assert [record.sha256 for record in read_file_manifest(file_manifest_path(archive_path))] == [
+        archive_maker.hash_cache.hash(entry) for entry in scan_path(data_dir)
+    ]
+
+    _touch(data_dir / "a.txt")
+    replaced = data_dir / "b.tmp"
+    shutil.copy2(data_dir / "b.txt", replaced)
+    os.replace(replaced, data_dir / "b.txt")
+
+    assert archive_maker.make_fresh_archive() is None
+    assert archive_maker.last_stats.changed_files == 0
+    assert not archive_maker.file_index.is_changed(next(scan_path(data_dir)))
+
+
+def test_touched_file_with_new_content_is_archived(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir, hash_cache=HashCache())
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    (data_dir / "a.txt").write_text("cccc")
+    _touch(data_dir / "b.txt")
+
+    assert _archived_names(archive_maker.make_fresh_archive()) == ["a.txt"]
+
+
+def test_files_over_hash_limit_are_not_hashed(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir, hash_cache=HashCache(), hash_limit=3)
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    _touch(data_dir / "a.txt")
+    assert _archived_names(archive_maker.make_fresh_archive()) == ["a.txt"]
+
+    archive_maker.hash_limit = None
+    _touch(data_dir / "b.txt")
+    assert archive_maker.make_fresh_archive() is None
+
+
+def test_hashes_of_replaced_files_are_pruned(data_dir, archives_dir):
+    archive_maker = ArchiveMaker(data_dir, hash_cache=HashCache())
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    for _ in range(3):
+        replaced = data_dir / "b.tmp"
+        shutil.copy2(data_dir / "b.txt", replaced)
+        os.replace(replaced, data_dir / "b.txt")
+        assert archive_maker.make_fresh_archive() is None
+
+    assert len(archive_maker.hash_cache) == 2
+    (data_dir / "a.txt").unlink()
+    archive_maker.make_fresh_archive()
+    assert len(archive_maker.hash_cache) == 1
+
+
+def test_zero_hash_limit_disables_hashing(data_dir, archives_dir):
+    (data_dir / "empty.txt").touch()
+    archive_maker = ArchiveMaker(data_dir, hash_cache=HashCache(), hash_limit=0)
+    archive_maker.mark_uploaded(archive_maker.make_fresh_archive())
+
+    _touch(data_dir / "empty.txt")
+    with patch('backuper.hash_cache.hash_file', side_effect=AssertionError):
+        assert _archived_names(archive_maker.make_fresh_archive()) == ["empty.txt"]
@@ -0,0 +1,92 @@
+import errno
+import io
+from unittest.mock import patch
+
+import pytest
+
+from backuper.catalog import file_manifest_path
+from backuper.disks.local_disk import LocalDisk
+
+ARCHIVE = "2024-01-01_00-00-00_data.zip"
+
+
+@pytest.fixture
+def disk(tmp_path):
+    return LocalDisk(tmp_path / "remote")
+
+
+def _local_file(tmp_path, name, data=b"data"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_upload_and_list(tmp_path, disk):
+    disk.upload(str(_local_file(tmp_path, ARCHIVE)))
+    disk.upload(str(_local_file(tmp_path, file_manifest_path(ARCHIVE))))
+    disk.upload(str(_local_file(tmp_path, "notes.txt")))
+
+    assert disk.list_of_files() == [ARCHIVE]
+    assert sorted(remote_file.name for remote_file in disk.remote_files()) == [ARCHIVE, file_manifest_path(ARCHIVE)]
+    assert (tmp_path / "remote" / ARCHIVE).read_bytes() == b"data"
+    assert not list((tmp_path / "remote").glob("*.part"))
+
+
+def test_upload_stream(disk):
+    disk.upload_stream(io.BytesIO(b"x" * 1000), ARCHIVE)
+
+    assert disk.find_remote_file(ARCHIVE).size == 1000
+
+
+def test_failed_upload_stream_leaves_no_part_file(tmp_path, disk):
+    class FailingStream(io.BytesIO):
+        def read(self, size=-1):
+            if self.tell():
+                raise OSError("archive build failed")
+            return super().read(size)
+
+    with pytest.raises(OSError):
+        disk.upload_stream(FailingStream(b"x" * 1000), ARCHIVE)
+
+    assert list((tmp_path / "remote").iterdir()) == []
+
+
+def test_download_and_open_remote(tmp_path, disk):
+    disk.upload(str(_local_file(tmp_path, ARCHIVE, b"0123456789")))
+
+    disk.download(ARCHIVE, destination=str(tmp_path / "copy.zip"))
+    assert (tmp_path / "copy.zip").read_bytes() == b"0123456789"
+    with disk.open_remote(disk.find_remote_file(ARCHIVE)) as f:
+        f.seek(5)
+        assert f.read() == b"56789"
+    with pytest.raises(ValueError):
+        disk.download("2024-01-02_00-00-00_data.zip", destination=str(tmp_path / "missing.zip"))
+
+
+def test_delete_files(tmp_path, disk):
+    disk.upload(str(_local_file(tmp_path, ARCHIVE)))
+    remote_file = disk.find_remote_file(ARCHIVE)
+    (tmp_path / "remote" / ARCHIVE).unlink()
+
+    assert disk.delete_files([remote_file]) == [remote_file]
+    assert disk.list_of_files() == []
+
+
+def test_copy_falls_back_when_reflink_and_copy_file_range_are_unsupported(tmp_path, disk):
+    unsupported = OSError(errno.EOPNOTSUPP, "Operation not supported")
+    with patch("backuper.disks.local_disk.fcntl.ioctl", side_effect=unsupported), \
+            patch("backuper.disks.local_disk.os.copy_file_range", side_effect=OSError(errno.EXDEV, "Cross-device"),
+                  create=True):
+        disk.upload(str(_local_file(tmp_path, ARCHIVE, b"y" * 100)))
+
+    assert (tmp_path / "remote" / ARCHIVE).read_bytes() == b"y" * 100
+    assert not disk._reflink
+    assert not disk._copy_file_range
+
+
+def test_fsyncs_in_batches(tmp_path, disk):
+    with patch.object(LocalDisk, "flush") as mock_flush:
+        disk.upload(str(_local_file(tmp_path, file_manifest_path(ARCHIVE))))
+        mock_flush.assert_not_called()
+        disk.upload(str(_local_file(tmp_path, ARCHIVE)))
+        mock_flush.assert_called_once()
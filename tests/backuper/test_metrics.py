@@ -0,0 +1,57 @@
+from unittest.mock import patch
+
+from backuper.metrics import IterationMetrics, MetricsRepository, export_textfile, format_textfile
+
+
+def _run(job, started, succeeded=True, **kwargs):
+    return IterationMetrics(job, started, 1.0, succeeded, **kwargs)
+
+
+def test_records_history_and_totals():
+    repository = MetricsRepository()
+    repository.record(_run("docs", 100.0, uploaded_bytes=10, upload_retries=1))
+    repository.record(_run("docs", 200.0, succeeded=False))
+    repository.record(_run("photos", 150.0, scanned_files=5))
+
+    assert [run.started for run in repository.history("docs")] == [200.0, 100.0]
+    assert repository.history("docs")[0].succeeded is False
+    assert [run.job for run in repository.latest()] == ["docs", "photos"]
+    docs, photos = repository.totals()
+    assert (docs.runs, docs.failed_runs, docs.uploaded_bytes, docs.upload_retries, docs.last_success) == (2, 1, 10, 1, 100.0)
+    assert photos.runs == 1
+
+
+def test_keeps_limited_history():
+    repository = MetricsRepository()
+    with patch("backuper.metrics.HISTORY_SIZE", 3):
+        for started in range(5):
+            repository.record(_run("docs", float(started)))
+
+    assert [run.started for run in repository.history("docs")] == [4.0, 3.0, 2.0]
+    assert repository.totals()[0].runs == 5
+
+
+def test_textfile_format():
+    run = _run('we"ird', 100.0, uploaded_bytes=300, upload_seconds=2.0, changed_files=3)
+    repository = MetricsRepository()
+    repository.record(run)
+
+    content = format_textfile(repository.latest(), repository.totals())
+
+    assert "# TYPE backuper_runs_total counter" in content
+    assert 'backuper_changed_files{job="we\\"ird"} 3.0' in content
+    assert 'backuper_upload_throughput_bytes_per_second{job="we\\"ird"} 150.0' in content
+    assert 'backuper_last_success_timestamp_seconds{job="we\\"ird"} 100.0' in content
+    assert content.endswith("\n")
+
+
+def test_export_textfile_replaces_file(tmp_path):
+    repository = MetricsRepository()
+    repository.record(_run("docs", 100.0))
+    path = tmp_path / "backuper.prom"
+    path.write_text("old")
+
+    export_textfile(repository, path)
+
+    assert 'backuper_runs_total{job="docs"} 1' in path.read_text()
+    assert [child.name for child in tmp_path.iterdir()] == ["backuper.prom"]
@@ -0,0 +1,93 @@
+import io
+import random
+import zipfile
+import zlib
+
+import pytest
+
+from backuper.compression import CodecSelector, DeflateCodec, get_codec, read_member
+from backuper.parallel_zip import ParallelZipWriter, write_parallel_archive
+from backuper.scanner import scan_path
+
+
+class NonSeekableBuffer(io.RawIOBase):
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+def test_compressed_blocks_concatenate_into_valid_stream():
+    data = random.Random(1).randbytes(50_000) + b"a" * 50_000
+    blocks = [data[:30_000], data[30_000:60_000], data[60_000:]]
+    codec = DeflateCodec()
+    compressed = b"".join(codec.compress_block(block, i == len(blocks) - 1) for i, block in enumerate(blocks))
+    assert zlib.decompress(compressed, -15) == data
+
+
+def test_parallel_archive_matches_files(tmp_path):
+    data = tmp_path / "data"
+    (data / "sub").mkdir(parents=True)
+    (data / "a.txt").write_text("a" * 10_000)
+    (data / "empty.txt").write_bytes(b"")
+    (data / "sub" / "b.bin").write_bytes(random.Random(2).randbytes(100_000))
+    archive_path = tmp_path / "archive.zip"
+
+    write_parallel_archive(archive_path, data, scan_path(data), workers=4)
+
+    with zipfile.ZipFile(archive_path) as zf:
+        assert zf.testzip() is None
+        assert zf.read("a.txt") == b"a" * 10_000
+        assert zf.read("empty.txt") == b""
+        assert zf.read("sub/b.bin") == (data / "sub" / "b.bin").read_bytes()
+
+
+def test_parallel_archive_reports_unreadable_file(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("a")
+    files = list(scan_path(data))
+    (data / "a.txt").unlink()
+
+    with pytest.raises(FileNotFoundError):
+        write_parallel_archive(tmp_path / "archive.zip", data, files, workers=2, read_ahead=0)
+
+
+def test_small_blocks_to_non_seekable_stream():
+    content = random.Random(3).randbytes(10_000) * 5
+    target = NonSeekableBuffer()
+
+    with zipfile.ZipFile(target, mode="w") as zf:
+        writer = ParallelZipWriter(zf, workers=3, block_size=4096)
+        writer.writestr(zipfile.ZipInfo("first.bin"), content, DeflateCodec())
+        writer.writestr(zipfile.ZipInfo("second.txt"), b"second", DeflateCodec())
+        writer.flush()
+        writer.shutdown()
+        zf.writestr("third.txt", "third")
+
+    with zipfile.ZipFile(io.BytesIO(target.buffer.getvalue())) as zf:
+        assert zf.testzip() is None
+        assert zf.read("first.bin") == content
+        assert zf.read("second.txt") == b"second"
+        assert zf.read("third.txt") == b"third"
+
+
+@pytest.mark.parametrize("codec_name", ["store", "deflate", "zstd", "lz4"])
+def test_parallel_archive_with_codecs(tmp_path, codec_name):
+    if codec_name in ("zstd", "lz4"):
+        pytest.importorskip({"zstd": "zstandard", "lz4": "lz4"}[codec_name])
+    data = tmp_path / "data"
+    data.mkdir()
+    content = b"abc" * 50_000
+    (data / "a.txt").write_bytes(content)
+    archive_path = tmp_path / "archive.zip"
+
+    write_parallel_archive(archive_path, data, scan_path(data), 2, CodecSelector(get_codec(codec_name)))
+
+    with zipfile.ZipFile(archive_path) as zf:
+        assert zf.testzip() is None
+        assert read_member(zf, "a.txt") == content
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from backuper.pipeline import Prefetcher, VolumeSplitter, batched, read_files
+from backuper.scanner import FileStat
+
+
+def _entry(name, size):
+    return FileStat(name, size, 0, 0, 0o100644)
+
+
+def test_prefetcher_yields_items_in_order():
+    assert list(Prefetcher(batched(range(100), 7), 3)) == list(range(100))
+
+
+def test_prefetcher_applies_backpressure():
+    produced = []
+    blocked = threading.Event()
+
+    def items():
+        for number in range(10):
+            produced.append(number)
+            if len(produced) == 3:
+                blocked.set()
+            yield [number]
+
+    prefetcher = Prefetcher(items(), 2)
+    blocked.wait(1)
+    assert len(produced) <= 3
+    assert next(prefetcher) == 0
+    prefetcher.close()
+    assert len(produced) < 10
+
+
+def test_prefetcher_raises_producer_error():
+    def items():
+        yield [1]
+        raise OSError("disk failed")
+
+    prefetcher = Prefetcher(items(), 4)
+    assert next(prefetcher) == 1
+    with pytest.raises(OSError):
+        next(prefetcher)
+    assert list(prefetcher) == []
+
+
+def test_read_files_marks_end_of_each_file(tmp_path):
+    (tmp_path / "a").write_bytes(b"x" * 5)
+    (tmp_path / "empty").write_bytes(b"")
+    files = [_entry(str(tmp_path / "a"), 5), _entry(str(tmp_path / "empty"), 0)]
+
+    batches = [[(entry.path[-1], block) for entry, block in batch] for batch in read_files(files, 2)]
+
+    assert batches == [[("a", b"xx")], [("a", b"xx")], [("a", b"x"), ("a", None), ("y", b""), ("y", None)]]
+
+
+def test_volume_splitter_keeps_files_whole():
+    small, big = _entry("small", 3), _entry("big", 10)
+    volumes = VolumeSplitter(iter([small, small, small, big, small]), 7)
+
+    split = []
+    while volumes:
+        split.append(list(volumes.volume()))
+        assert volumes.written == split[-1]
+
+    assert split == [[small, small], [small], [big], [small]]
+    assert not VolumeSplitter(iter([]), 7)
+
+
+def test_volume_splitter_returns_unwritten_files():
+    files = [_entry(str(number), 1) for number in range(5)]
+    volumes = VolumeSplitter(iter(files), 2)
+    list(volumes.volume())
+    volume = volumes.volume()
+    next(volume)
+
+    assert volumes.remaining() == files[2:]
@@ -1,57 +1,114 @@
+import json
+import os
 import signal
+import threading
 from unittest import mock
 
-from backuper.processes_repository import ProcessesRepository
+import pytest
 
+from backuper.processes_repository import ProcessesRepository, process_start_time
 
-def test_load():
-    with mock.patch("builtins.open", mock.mock_open(read_data='{"proc1": {"pid": 12345, "path": "/path/to/proc1"}}')):
-        repo = ProcessesRepository("/path/to/repo")
-        data = repo.load()
-        assert data == {"proc1": {"pid": 12345, "path": "/path/to/proc1"}}
 
+@pytest.fixture
+def repo(tmp_path):
+    return ProcessesRepository(tmp_path / "processes.sqlite")
 
-def test_save():
-    with mock.patch("builtins.open", mock.mock_open()) as mock_file, \
-            mock.patch("json.dump") as mock_json_dump:
-        repo = ProcessesRepository("/path/to/repo")
-        repo.save({"proc1": {"pid": 12345, "path": "/path/to/proc1"}})
-        mock_file.assert_called_once_with("/path/to/repo", "w")
-        mock_json_dump.assert_called_once_with({"proc1": {"pid": 12345, "path": "/path/to/proc1"}}, mock_file())
 
+def test_add_and_load(repo):
+    repo.add_process("proc1", {"pid": 12345, "path": "/path/to/proc1"})
+    repo.add_process("proc2", {"cron": "* * * * *", "path": "/path/to/proc2"})
 
-def test_add_process():
-    with mock.patch("builtins.open", mock.mock_open(read_data='{}')) as mock_file, \
-            mock.patch("json.dump") as mock_json_dump:
-        repo = ProcessesRepository("/path/to/repo")
-        repo.add_process("proc1", {"pid": 12345, "path": "/path/to/proc1"})
-        mock_json_dump.assert_called_once()
+    assert repo.load() == {
+        "proc1": {"pid": 12345, "path": "/path/to/proc1"},
+        "proc2": {"cron": "* * * * *", "path": "/path/to/proc2"},
+    }
+    assert repo.get_process("proc2") == {"cron": "* * * * *", "path": "/path/to/proc2"}
+    assert repo.get_process("proc3") is None
 
 
-def test_remove_process():
-    with mock.patch("builtins.open",
-                    mock.mock_open(read_data='{"proc1": {"pid": 12345, "path": "/path/to/proc1"}}')) as mock_file, \
-            mock.patch("json.dump") as mock_json_dump:
-        repo = ProcessesRepository("/path/to/repo")
-        repo.remove_process("proc1")
-        mock_json_dump.assert_called_once()
+def test_remove_process(repo):
+    repo.add_process("proc1", {"pid": 12345, "path": "/path/to/proc1"})
+    repo.remove_process("proc1")
+    assert repo.load() == {}
 
 
-def test_stop_process():
-    with mock.patch("builtins.open",
-                    mock.mock_open(read_data='{"proc1": {"pid": 12345, "path": "/path/to/proc1"}}')) as mock_file, \
-            mock.patch("os.kill") as mock_os_kill, \
-            mock.patch("json.dump") as mock_json_dump:
-        repo = ProcessesRepository("/path/to/repo")
-        result = repo.stop_process("proc1")
-        mock_os_kill.assert_called_once_with(12345, signal.SIGTERM)
-        assert result is True
-        mock_json_dump.assert_called_once()
+def test_contains(repo):
+    repo.add_process("proc1", {"pid": 12345, "path": "/path/to/proc1"})
+    assert "proc1" in repo
+    assert "proc2" not in repo
 
 
-def test_contains():
-    with mock.patch("builtins.open",
-                    mock.mock_open(read_data='{"proc1": {"pid": 12345, "path": "/path/to/proc1"}}')) as mock_file:
-        repo = ProcessesRepository("/path/to/repo")
-        assert "proc1" in repo
-        assert "proc2" not in repo
+def test_stop_process(repo):
+    repo.add_process("proc1", {"pid": os.getpid(), "path": "/path/to/proc1"})
+
+    with mock.patch("os.kill") as mock_os_kill:
+        assert repo.stop_process("proc1") is True
+
+    mock_os_kill.assert_called_with(os.getpid(), signal.SIGTERM)
+    assert "proc1" not in repo
+
+
+def test_stop_process_with_recycled_pid(repo):
+    repo.add_process("proc1", {"pid": os.getpid(), "path": "/path/to/proc1"})
+    repo.connection.execute("UPDATE processes SET started = started - 1")
+
+    with mock.patch("os.kill") as mock_os_kill:
+        assert repo.stop_process("proc1") is False
+
+    assert mock.call(os.getpid(), signal.SIGTERM) not in mock_os_kill.call_args_list
+    assert "proc1" not in repo
+
+
+def test_stop_scheduled_job(repo):
+    repo.add_process("proc1", {"cron": "* * * * *", "path": "/path/to/proc1"})
+
+    with mock.patch("os.kill") as mock_os_kill:
+        assert repo.stop_process("proc1") is True
+
+    mock_os_kill.assert_not_called()
+    assert "proc1" not in repo
+
+
+def test_is_running(repo):
+    repo.add_process("alive", {"pid": os.getpid()})
+    repo.add_process("scheduled", {"cron": "* * * * *"})
+    with mock.patch("os.kill", side_effect=ProcessLookupError):
+        repo.add_process("dead", {"pid": 2 ** 22 + 1})
+
+        assert not repo.is_running("dead")
+    assert repo.is_running("alive")
+    assert repo.is_running("scheduled")
+    assert not repo.is_running("missing")
+
+
+def test_process_start_time():
+    if not os.path.exists("/proc/self/stat"):
+        pytest.skip("/proc is not available")
+    assert process_start_time(os.getpid()) == process_start_time(os.getpid())
+    assert process_start_time(2 ** 22 + 1) is None
+
+
+def test_concurrent_writers_keep_all_entries(tmp_path):
+    db_path = tmp_path / "processes.sqlite"
+    ProcessesRepository(db_path)
+
+    def register(number):
+        ProcessesRepository(db_path).add_process(f"proc{number}", {"pid": number})
+
+    threads = [threading.Thread(target=register, args=(number,)) for number in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(ProcessesRepository(db_path).load()) == 20
+
+
+def test_imports_legacy_json(tmp_path):
+    (tmp_path / "processes.json").write_text(json.dumps({"proc1": {"pid": 12345, "path": "/path/to/proc1"}}))
+
+    repo = ProcessesRepository(tmp_path / "processes.sqlite")
+
+    assert repo.load() == {"proc1": {"pid": 12345, "path": "/path/to/proc1"}}
+    assert not (tmp_path / "processes.json").exists()
+    assert (tmp_path / "processes.json.bak").exists()
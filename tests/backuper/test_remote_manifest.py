@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+import pytest
+
+from backuper import remote_manifest
+from backuper.remote_manifest import RemoteFile, RemoteManifest
+
+
+@pytest.fixture
+def manifest():
+    return RemoteManifest()
+
+
+def test_put_and_get(manifest):
+    manifest.put("GoogleDisk", [RemoteFile("b.zip", "2", 20, "md5"), RemoteFile("a.zip", "1", 10, None)])
+
+    assert manifest.get("GoogleDisk", "a.zip") == RemoteFile("a.zip", "1", 10, None)
+    assert manifest.get("YandexDisk", "a.zip") is None
+    assert [remote_file.name for remote_file in manifest.list("GoogleDisk")] == ["a.zip", "b.zip"]
+
+
+def test_remove_ids(manifest):
+    manifest.put("GoogleDisk", [RemoteFile("a.zip", "1", 10, None), RemoteFile("b.zip", "2", 20, None)])
+
+    manifest.remove_ids("GoogleDisk", ["1", "3"])
+
+    assert manifest.list("GoogleDisk") == [RemoteFile("b.zip", "2", 20, None)]
+
+
+def test_replace_all(manifest):
+    manifest.put("GoogleDisk", [RemoteFile("a.zip", "1", 10, None)])
+    manifest.put("YandexDisk", [RemoteFile("a.zip", "/a.zip", 10, None)])
+
+    manifest.replace_all("GoogleDisk", [RemoteFile("b.zip", "2", 20, None)])
+
+    assert manifest.list("GoogleDisk") == [RemoteFile("b.zip", "2", 20, None)]
+    assert manifest.list("YandexDisk") == [RemoteFile("a.zip", "/a.zip", 10, None)]
+
+
+def test_is_fresh(manifest):
+    assert not manifest.is_fresh("GoogleDisk", 60)
+
+    with patch.object(remote_manifest.time, "time", return_value=1000):
+        manifest.mark_refreshed("GoogleDisk")
+    with patch.object(remote_manifest.time, "time", return_value=1030):
+        assert manifest.is_fresh("GoogleDisk", 60)
+    with patch.object(remote_manifest.time, "time", return_value=1100):
+        assert not manifest.is_fresh("GoogleDisk", 60)
+
+
+def test_state(manifest):
+    assert manifest.get_state("GoogleDisk", "change_token") is None
+    manifest.set_state("GoogleDisk", "change_token", "42")
+    assert manifest.get_state("GoogleDisk", "change_token") == "42"
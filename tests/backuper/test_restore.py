@@ -0,0 +1,178 @@
+import datetime
+import os
+import shutil
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+from backuper.compression import CodecSelector, get_codec
+from backuper.dedup import DedupArchiveMaker
+from backuper.remote_manifest import RemoteFile
+from backuper.restore import RestoreIndex, Restorer, list_archive_entries, parse_archive_name
+from backuper.scanner import scan_path
+from backuper.utils import write_archive
+
+
+class FakeDisk:
+    def __init__(self, directory):
+        self.directory = directory
+        self.downloaded = []
+
+    def remote_files(self):
+        return [RemoteFile(path.name, path.name, path.stat().st_size, None) for path in self.directory.iterdir()]
+
+    def open_remote(self, remote_file):
+        return open(self.directory / remote_file.name, "rb")
+
+    def download(self, filename, connections, destination):
+        self.downloaded.append(filename)
+        shutil.copy(self.directory / filename, destination)
+
+
+@pytest.fixture
+def remote_dir(tmp_path):
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    return remote
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path):
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    with patch("backuper.restore.archives_dir", archives):
+        yield archives
+
+
+def _backup(data_dir, remote_dir, name, paths, codec_selector=None):
+    files = [entry for entry in scan_path(data_dir) if entry.path in {str(data_dir / path) for path in paths}]
+    write_archive(remote_dir / name, data_dir, files, codec_selector)
+
+
+def test_parse_archive_name():
+    assert parse_archive_name("2024-01-02_03-04-05_data.zip", "data") == (datetime.datetime(2024, 1, 2, 3, 4, 5), 0)
+    assert parse_archive_name("2024-01-02_03-04-05.2_data.zip", "data") == (datetime.datetime(2024, 1, 2, 3, 4, 5), 2)
+    assert parse_archive_name("2024-01-02_03-04-05_data_2.zip", "data") is None
+    assert parse_archive_name("2024-01-02_03-04-05_data_2.zip", "data_2") == (datetime.datetime(2024, 1, 2, 3, 4, 5), 0)
+    assert parse_archive_name("2024-01-02_03-04-05_other.zip", "data") is None
+    assert parse_archive_name("notes.zip", "data") is None
+
+
+def test_restores_newest_versions_at_time(tmp_path, remote_dir):
+    data_dir = tmp_path / "data"
+    (data_dir / "sub").mkdir(parents=True)
+    (data_dir / "a.txt").write_text("a1")
+    (data_dir / "sub" / "b.txt").write_text("b1")
+    _backup(data_dir, remote_dir, "2024-01-01_00-00-00_data.zip", ["a.txt", "sub/b.txt"])
+    (data_dir / "a.txt").write_text("a2")
+    _backup(data_dir, remote_dir, "2024-01-02_00-00-00_data.zip", ["a.txt"])
+    (data_dir / "sub" / "b.txt").write_text("b3")
+    _backup(data_dir, remote_dir, "2024-01-03_00-00-00_data.zip", ["sub/b.txt"])
+    _backup(data_dir, remote_dir, "2024-01-02_00-00-00_other.zip", ["a.txt"])
+
+    disk = FakeDisk(remote_dir)
+    target = tmp_path / "restored"
+    restored = Restorer(disk, RestoreIndex(), workers=2).restore("data", datetime.datetime(2024, 1, 2, 12), target)
+
+    assert restored == 2
+    assert (target / "a.txt").read_text() == "a2"
+    assert (target / "sub" / "b.txt").read_text() == "b1"
+    assert sorted(disk.downloaded) == ["2024-01-01_00-00-00_data.zip", "2024-01-02_00-00-00_data.zip"]
+
+
+def test_ignores_archives_of_directory_with_numbered_name(tmp_path, remote_dir):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a").write_text("data")
+    _backup(data_dir, remote_dir, "2024-01-01_00-00-00_data.zip", ["a"])
+    (data_dir / "a").write_text("data_2")
+    _backup(data_dir, remote_dir, "2024-01-02_00-00-00_data_2.zip", ["a"])
+    (data_dir / "a").write_text("data, later")
+    _backup(data_dir, remote_dir, "2024-01-03_00-00-00_data.zip", ["a"])
+
+    target = tmp_path / "restored"
+    Restorer(FakeDisk(remote_dir), RestoreIndex()).restore("data", datetime.datetime(2024, 1, 2, 12), target)
+
+    assert (target / "a").read_text() == "data"
+
+
+def test_reuses_index(tmp_path, remote_dir):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a1")
+    _backup(data_dir, remote_dir, "2024-01-01_00-00-00_data.zip", ["a.txt"])
+    index = RestoreIndex()
+    disk = FakeDisk(remote_dir)
+    Restorer(disk, index).restore("data", datetime.datetime(2024, 2, 1), tmp_path / "first")
+
+    with patch.object(disk, "open_remote", side_effect=AssertionError):
+        Restorer(disk, index).restore("data", datetime.datetime(2024, 2, 1), tmp_path / "second")
+
+    assert (tmp_path / "second" / "a.txt").read_text() == "a1"
+
+
+def test_no_archives_before_time(tmp_path, remote_dir):
+    with pytest.raises(ValueError):
+        Restorer(FakeDisk(remote_dir), RestoreIndex()).restore("data", datetime.datetime(2024, 1, 1), tmp_path)
+
+
+def test_codec_suffix_is_stripped_only_for_compressed_members(tmp_path, remote_dir):
+    pytest.importorskip("zstandard")
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "log.txt").write_text("text" * 100)
+    (data_dir / "packed.zst").write_bytes(b"not really zstd")
+    archive_path = remote_dir / "2024-01-01_00-00-00_data.zip"
+    write_archive(archive_path, data_dir, [entry for entry in scan_path(data_dir) if entry.path.endswith(".txt")],
+                  CodecSelector(get_codec("zstd")))
+    with zipfile.ZipFile(archive_path, "a") as zf:
+        zf.write(data_dir / "packed.zst", "packed.zst")
+
+    with zipfile.ZipFile(archive_path) as zf:
+        entries = {entry.path: entry for entry in list_archive_entries(zf, archive_path.name)}
+    assert entries["log.txt"].member == "log.txt.zst"
+    assert entries["log.txt"].codec == "zstd"
+    assert entries["packed.zst"].codec is None
+
+    target = tmp_path / "restored"
+    Restorer(FakeDisk(remote_dir), RestoreIndex()).restore("data", datetime.datetime(2024, 2, 1), target)
+    assert (target / "log.txt").read_text() == "text" * 100
+    assert (target / "packed.zst").read_bytes() == b"not really zstd"
+
+
+@pytest.mark.parametrize("codec_name, package", [("zstd", "zstandard"), ("lz4", "lz4")])
+def test_compressed_member_is_restored_without_reading_it_whole(tmp_path, remote_dir, codec_name, package):
+    pytest.importorskip(package)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    content = os.urandom(512 * 1024) * 6
+    (data_dir / "big.bin").write_bytes(content)
+    write_archive(remote_dir / "2024-01-01_00-00-00_data.zip", data_dir, list(scan_path(data_dir)),
+                  CodecSelector(get_codec(codec_name)))
+
+    target = tmp_path / "restored"
+    with patch.object(zipfile.ZipFile, "read", side_effect=AssertionError):
+        Restorer(FakeDisk(remote_dir), RestoreIndex()).restore("data", datetime.datetime(2024, 2, 1), target)
+    assert (target / "big.bin").read_bytes() == content
+
+
+def test_restores_dedup_snapshots(tmp_path, remote_dir):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a1")
+    (data_dir / "b.txt").write_text("b1")
+    maker = DedupArchiveMaker(data_dir)
+    with patch("backuper.archive_maker.archives_dir", remote_dir), \
+            patch("backuper.archive_maker.make_archive_name", side_effect=[
+                "2024-01-01_00-00-00_data.zip", "2024-01-02_00-00-00_data.zip"
+            ]):
+        maker.make_fresh_archive()
+        (data_dir / "b.txt").write_text("b2")
+        maker.make_fresh_archive()
+
+    target = tmp_path / "restored"
+    Restorer(FakeDisk(remote_dir), RestoreIndex()).restore("data", datetime.datetime(2024, 2, 1), target)
+
+    assert (target / "a.txt").read_text() == "a1"
+    assert (target / "b.txt").read_text() == "b2"
@@ -0,0 +1,130 @@
+import datetime
+from unittest.mock import patch
+
+import pytest
+
+from backuper.catalog import file_manifest_path
+from backuper.dedup import DedupArchiveMaker
+from backuper.remote_manifest import RemoteFile
+from backuper.restore import RestoreIndex
+from backuper.retention import RetentionPolicy, plan_prune, prune
+from backuper.scanner import scan_path
+from backuper.utils import write_archive
+
+
+class FakeDisk:
+    def __init__(self, directory):
+        self.directory = directory
+        self.deleted = []
+
+    def remote_files(self):
+        return [RemoteFile(path.name, path.name, path.stat().st_size, None) for path in self.directory.iterdir()]
+
+    def open_remote(self, remote_file):
+        return open(self.directory / remote_file.name, "rb")
+
+    def delete_files(self, remote_files):
+        for remote_file in remote_files:
+            (self.directory / remote_file.name).unlink()
+        self.deleted.extend(remote_file.name for remote_file in remote_files)
+        return remote_files
+
+    @staticmethod
+    def filter_files(files):
+        return [name for name in files if name.endswith(".zip")]
+
+
+@pytest.fixture
+def remote_dir(tmp_path):
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    return remote
+
+
+def _backup(data_dir, remote_dir, name, paths):
+    files = [entry for entry in scan_path(data_dir) if entry.path in {str(data_dir / path) for path in paths}]
+    write_archive(remote_dir / name, data_dir, files)
+
+
+def test_select_keeps_newest_in_each_bucket():
+    times = [
+        datetime.datetime(2024, 1, 1, 10), datetime.datetime(2024, 1, 1, 11),
+        datetime.datetime(2024, 1, 2, 9), datetime.datetime(2024, 1, 2, 9, 30),
+        datetime.datetime(2024, 1, 9, 8),
+    ]
+    assert RetentionPolicy(daily=2).select(times) == {datetime.datetime(2024, 1, 9, 8), datetime.datetime(2024, 1, 2, 9, 30)}
+    assert RetentionPolicy(weekly=2).select(times) == {datetime.datetime(2024, 1, 9, 8), datetime.datetime(2024, 1, 2, 9, 30)}
+    assert RetentionPolicy(hourly=3).select(times) == {
+        datetime.datetime(2024, 1, 9, 8), datetime.datetime(2024, 1, 2, 9, 30), datetime.datetime(2024, 1, 1, 11)
+    }
+    assert RetentionPolicy().select(times) == {datetime.datetime(2024, 1, 9, 8)}
+    assert not RetentionPolicy().enabled
+
+
+def test_keeps_archives_with_live_files(tmp_path, remote_dir):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a1")
+    (data_dir / "b.txt").write_text("b1")
+    _backup(data_dir, remote_dir, "2024-01-01_00-00-00_data.zip", ["a.txt", "b.txt"])
+    (data_dir / "a.txt").write_text("a2")
+    _backup(data_dir, remote_dir, "2024-01-02_00-00-00_data.zip", ["a.txt"])
+    (remote_dir / file_manifest_path("2024-01-02_00-00-00_data.zip")).write_bytes(b"")
+    (data_dir / "a.txt").write_text("a3")
+    _backup(data_dir, remote_dir, "2024-01-03_00-00-00_data.zip", ["a.txt"])
+    _backup(data_dir, remote_dir, "2024-01-01_00-00-00_other.zip", ["a.txt"])
+
+    disk = FakeDisk(remote_dir)
+    to_delete = plan_prune(disk, RestoreIndex(), "data", RetentionPolicy(daily=1))
+
+    assert [remote_file.name for remote_file in to_delete] == [
+        "2024-01-02_00-00-00_data.zip", file_manifest_path("2024-01-02_00-00-00_data.zip")
+    ]
+
+
+def test_prune_forgets_deleted_archives(tmp_path, remote_dir):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a1")
+    _backup(data_dir, remote_dir, "2024-01-01_00-00-00_data.zip", ["a.txt"])
+    (data_dir / "a.txt").write_text("a2")
+    _backup(data_dir, remote_dir, "2024-01-02_00-00-00_data.zip", ["a.txt"])
+
+    disk = FakeDisk(remote_dir)
+    index = RestoreIndex()
+    assert prune(disk, index, "data", RetentionPolicy(daily=1)) == ["2024-01-01_00-00-00_data.zip"]
+    assert not index.is_indexed("FakeDisk", "2024-01-01_00-00-00_data.zip")
+    assert prune(disk, index, "data", RetentionPolicy(daily=1)) == []
+
+
+def test_keeps_archives_with_live_chunks(tmp_path, remote_dir):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a1")
+    (data_dir / "b.txt").write_text("b1")
+    maker = DedupArchiveMaker(data_dir)
+    with patch("backuper.archive_maker.archives_dir", remote_dir), \
+            patch("backuper.archive_maker.make_archive_name", side_effect=[
+                "2024-01-01_00-00-00_data.zip", "2024-01-02_00-00-00_data.zip"
+            ]):
+        maker.make_fresh_archive()
+        (data_dir / "b.txt").write_text("b2")
+        maker.make_fresh_archive()
+
+    assert plan_prune(FakeDisk(remote_dir), RestoreIndex(), "data", RetentionPolicy(daily=1)) == []
+
+
+def test_prune_keeps_archives_of_directory_with_numbered_name(tmp_path, remote_dir):
+    data_dir = tmp_path / "x"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a1")
+    _backup(data_dir, remote_dir, "2024-01-01_00-00-00_x.zip", ["a.txt"])
+    _backup(data_dir, remote_dir, "2024-01-02_00-00-00_x_2.zip", ["a.txt"])
+    (data_dir / "a.txt").write_text("a2")
+    _backup(data_dir, remote_dir, "2024-01-03_00-00-00_x.zip", ["a.txt"])
+
+    disk = FakeDisk(remote_dir)
+
+    assert prune(disk, RestoreIndex(), "x", RetentionPolicy(daily=1)) == ["2024-01-01_00-00-00_x.zip"]
+    assert prune(disk, RestoreIndex(), "x_2", RetentionPolicy(daily=1)) == []
+    assert (remote_dir / "2024-01-02_00-00-00_x_2.zip").exists()
@@ -0,0 +1,32 @@
+import os
+
+from backuper.scanner import scan_path
+
+
+def test_scan_path_returns_stat_records(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.txt").write_text("abc")
+    (tmp_path / "sub" / "b.txt").write_text("defgh")
+
+    records = {os.path.relpath(entry.path, tmp_path): entry for entry in scan_path(tmp_path)}
+
+    assert set(records) == {"a.txt", os.path.join("sub", "b.txt")}
+    stat = os.stat(tmp_path / "sub" / "b.txt")
+    assert records[os.path.join("sub", "b.txt")].size == 5
+    assert records[os.path.join("sub", "b.txt")].mtime_ns == stat.st_mtime_ns
+    assert records[os.path.join("sub", "b.txt")].inode == stat.st_ino
+
+
+def test_scan_path_does_not_follow_directory_symlinks(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / "a.txt").write_text("a")
+    data = tmp_path / "data"
+    data.mkdir()
+    os.symlink(target, data / "link")
+
+    assert list(scan_path(data)) == []
+
+
+def test_scan_path_missing_directory(tmp_path):
+    assert list(scan_path(tmp_path / "missing")) == []
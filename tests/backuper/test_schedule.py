@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+from backuper.schedule import CronSchedule, Scheduler
+
+
+def _timestamp(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+def test_first_run_is_immediate():
+    start = _timestamp(2026, 1, 1, 12, 0)
+    assert CronSchedule("0 3 * * *", start=start).next_fire == start
+
+
+def test_daily_schedule():
+    schedule = CronSchedule("0 3 * * *", start=_timestamp(2026, 1, 1, 12, 0))
+
+    assert schedule.advance(_timestamp(2026, 1, 1, 12, 5)) == _timestamp(2026, 1, 2, 3, 0)
+    assert schedule.advance(_timestamp(2026, 1, 2, 3, 10)) == _timestamp(2026, 1, 3, 3, 0)
+
+
+def test_schedule_does_not_drift():
+    schedule = CronSchedule("*/10 * * * *", start=_timestamp(2026, 1, 1, 12, 0))
+
+    assert schedule.advance(_timestamp(2026, 1, 1, 12, 7)) == _timestamp(2026, 1, 1, 12, 10)
+    assert schedule.advance(_timestamp(2026, 1, 1, 12, 19)) == _timestamp(2026, 1, 1, 12, 20)
+
+
+def test_overrun_skip():
+    schedule = CronSchedule("*/10 * * * *", start=_timestamp(2026, 1, 1, 12, 0))
+
+    assert schedule.advance(_timestamp(2026, 1, 1, 12, 35)) == _timestamp(2026, 1, 1, 12, 40)
+    assert schedule.skipped == 3
+
+
+def test_overrun_run_once():
+    schedule = CronSchedule("*/10 * * * *", overrun="run-once", start=_timestamp(2026, 1, 1, 12, 0))
+    now = _timestamp(2026, 1, 1, 12, 35)
+
+    assert schedule.advance(now) == now
+    assert schedule.skipped == 2
+    assert schedule.advance(_timestamp(2026, 1, 1, 12, 36)) == _timestamp(2026, 1, 1, 12, 40)
+
+
+def test_invalid_cron():
+    with pytest.raises(ValueError):
+        CronSchedule("invalid cron expression")
+
+
+def test_scheduler_pops_due_in_order():
+    scheduler = Scheduler()
+    scheduler.add("late", 30)
+    scheduler.add("early", 10)
+    scheduler.add("never", 100)
+
+    assert scheduler.pop_due(50) == ["early", "late"]
+    assert scheduler.next_fire() == 100
+    assert len(scheduler) == 1
+
+
+def test_scheduler_remove_and_replace():
+    scheduler = Scheduler()
+    scheduler.add("job", 10)
+    scheduler.add("job", 20)
+    scheduler.add("removed", 5)
+    scheduler.remove("removed")
+
+    assert scheduler.next_fire() == 20
+    assert scheduler.pop_due(15) == []
+    assert scheduler.pop_due(20) == ["job"]
+    assert "job" not in scheduler
@@ -0,0 +1,95 @@
+import io
+import threading
+import zipfile
+
+import pytest
+
+from backuper.stream import BoundedPipe, PipeAbortedError, stream_to_disk
+
+
+class FakeStreamDisk:
+    def __init__(self, fail=False):
+        self.files = {}
+        self.fail = fail
+
+    def upload_stream(self, stream, filename):
+        if self.fail:
+            stream.read(1)
+            raise ConnectionError("connection dropped")
+        data = b""
+        while chunk := stream.read(7):
+            data += chunk
+        self.files[filename] = data
+
+
+def test_pipe_read_exact_sizes():
+    pipe = BoundedPipe()
+    pipe.write(b"hello ")
+    pipe.write(b"world")
+    pipe.close()
+    assert pipe.read(3) == b"hel"
+    assert pipe.read(5) == b"lo wo"
+    assert pipe.read(10) == b"rld"
+    assert pipe.read(10) == b""
+
+
+def test_pipe_blocks_writer_when_full():
+    pipe = BoundedPipe(max_size=4)
+    pipe.write(b"1234")
+    written = threading.Event()
+
+    def writer():
+        pipe.write(b"5678")
+        written.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert not written.wait(0.1)
+    assert pipe.read(4) == b"1234"
+    assert written.wait(1)
+    thread.join()
+
+
+def test_pipe_abort_stops_writer():
+    pipe = BoundedPipe()
+    pipe.abort()
+    with pytest.raises(PipeAbortedError):
+        pipe.write(b"data")
+
+
+def test_pipe_fail_raises_for_reader():
+    pipe = BoundedPipe()
+    pipe.fail(OSError("disk error"))
+    with pytest.raises(OSError):
+        pipe.read(1)
+
+
+def test_stream_to_disk_uploads_zip():
+    disk = FakeStreamDisk()
+
+    def write(fileobj):
+        with zipfile.ZipFile(fileobj, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("a.txt", "a" * 100_000)
+
+    stream_to_disk(disk, "archive.zip", write, max_size=1024)
+
+    with zipfile.ZipFile(io.BytesIO(disk.files["archive.zip"])) as zf:
+        assert zf.read("a.txt") == b"a" * 100_000
+
+
+def test_stream_to_disk_propagates_writer_error():
+    def write(fileobj):
+        fileobj.write(b"partial")
+        raise OSError("read error")
+
+    with pytest.raises(OSError):
+        stream_to_disk(FakeStreamDisk(), "archive.zip", write)
+
+
+def test_stream_to_disk_propagates_upload_error():
+    def write(fileobj):
+        for _ in range(100):
+            fileobj.write(b"x" * 1024)
+
+    with pytest.raises(ConnectionError):
+        stream_to_disk(FakeStreamDisk(fail=True), "archive.zip", write, max_size=1024)
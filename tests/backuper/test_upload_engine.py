@@ -0,0 +1,74 @@
+import threading
+from unittest.mock import Mock
+
+from backuper.disks.base_disk import BaseDisk
+from backuper.upload_engine import UploadEngine
+
+
+def test_uploads_submitted_archives(tmp_path):
+    archive_path = tmp_path / "archive.zip"
+    archive_path.write_bytes(b"x" * 100)
+    disk = Mock(spec=BaseDisk)
+
+    engine = UploadEngine(disk, workers=2)
+    assert engine.submit(str(archive_path))
+    engine.close()
+
+    disk.upload.assert_called_once_with(str(archive_path))
+    assert engine.completed() == [(str(archive_path), None)]
+    assert sum(stats.bytes for stats in engine.stats) == 100
+    assert engine.backlog == (0, 0)
+
+
+def test_reports_failed_upload():
+    error = ConnectionError()
+    disk = Mock(spec=BaseDisk)
+    disk.upload.side_effect = error
+
+    engine = UploadEngine(disk)
+    engine.submit("/path/to/archive.zip")
+    engine.close()
+
+    assert engine.completed() == [("/path/to/archive.zip", error)]
+
+
+def test_uploads_in_parallel_and_tracks_backlog():
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    disk = Mock(spec=BaseDisk)
+
+    def upload(archive_path):
+        started.release()
+        release.wait()
+
+    disk.upload.side_effect = upload
+    engine = UploadEngine(disk, workers=2)
+    for number in range(3):
+        engine.submit(f"/path/to/{number}.zip")
+
+    assert started.acquire(timeout=5) and started.acquire(timeout=5)
+    assert engine.backlog[0] == 1
+    assert not engine.submit("/path/to/0.zip")
+
+    release.set()
+    engine.close()
+    assert sorted(path for path, _ in engine.completed()) == [f"/path/to/{number}.zip" for number in range(3)]
+
+
+def test_wait_for_backlog_blocks_until_uploads_finish():
+    release = threading.Event()
+    disk = Mock(spec=BaseDisk)
+    disk.upload.side_effect = lambda archive_path: release.wait()
+    engine = UploadEngine(disk)
+    for number in range(3):
+        engine.submit(f"/path/to/{number}.zip")
+
+    waited = threading.Event()
+    waiter = threading.Thread(target=lambda: (engine.wait_for_backlog(1), waited.set()))
+    waiter.start()
+    assert not waited.wait(0.1)
+
+    release.set()
+    assert waited.wait(1)
+    waiter.join()
+    engine.close()
@@ -0,0 +1,27 @@
+from backuper.upload_sessions import UploadSessions
+
+
+def test_get_missing_session():
+    sessions = UploadSessions()
+    assert sessions.get("GoogleDisk", "/archives/a.zip", 10, 100) is None
+
+
+def test_save_and_get_session():
+    sessions = UploadSessions()
+    sessions.save("GoogleDisk", "/archives/a.zip", "https://upload/session", 10, 100, 4)
+    assert sessions.get("GoogleDisk", "/archives/a.zip", 10, 100) == ("https://upload/session", 4)
+
+
+def test_session_dropped_when_archive_changed():
+    sessions = UploadSessions()
+    sessions.save("GoogleDisk", "/archives/a.zip", "https://upload/session", 10, 100, 4)
+    assert sessions.get("GoogleDisk", "/archives/a.zip", 11, 100) is None
+    assert sessions.get("GoogleDisk", "/archives/a.zip", 10, 100) is None
+
+
+def test_sessions_persist(tmp_path):
+    UploadSessions(tmp_path / "uploads.sqlite").save("GoogleDisk", "/archives/a.zip", "https://upload/session", 10, 100, 4)
+    sessions = UploadSessions(tmp_path / "uploads.sqlite")
+    assert sessions.get("GoogleDisk", "/archives/a.zip", 10, 100) == ("https://upload/session", 4)
+    sessions.remove("GoogleDisk", "/archives/a.zip")
+    assert sessions.get("GoogleDisk", "/archives/a.zip", 10, 100) is None
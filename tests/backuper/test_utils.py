@@ -5,7 +5,7 @@ import datetime
 import os
 import json
 
-from backuper.utils import make_app_dirs, extract_secrets_from_json, save_secrets, cron_parser, filter_files_by_time
+from backuper.utils import lock_daemon_pid, make_app_dirs, extract_secrets_from_json, save_secrets, filter_files_by_time
 
 
 def test_make_app_dirs_already_exist(tmpdir):
@@ -153,27 +153,6 @@ def test_save_none_secrets(tmpdir):
         assert updated_data == data
 
 
-def test_cron_parser_every_minute():
-    assert cron_parser('* * * * *') == 60
-
-
-def test_cron_parser_every_x_minutes():
-    assert cron_parser('*/15 * * * *') == 15 * 60
-
-
-def test_cron_parser_every_hour():
-    assert cron_parser('0 * * * *') == 60 * 60
-
-
-def test_cron_parser_every_x_hours():
-    assert cron_parser('0 */3 * * *') == 3 * 60 * 60
-
-
-def test_cron_parser_invalid_format():
-    with pytest.raises(ValueError):
-        cron_parser('invalid cron expression')
-
-
 def test_filter_files_by_time():
     files = ["file1.txt", "file2.txt", "file3.txt"]
 
@@ -192,3 +171,20 @@ def test_filter_files_by_time():
 
         expected_result = {"file2.txt", "file3.txt"}
         assert result == expected_result
+
+
+def test_lock_daemon_pid_allows_single_daemon(tmp_path):
+    pid_file = tmp_path / "daemon.pid"
+    pid_file.write_text("999999")
+
+    pid_lock = lock_daemon_pid(pid_file)
+    try:
+        assert pid_lock is not None
+        assert pid_file.read_text() == str(os.getpid())
+        assert lock_daemon_pid(pid_file) is None
+    finally:
+        os.close(pid_lock)
+
+    second_lock = lock_daemon_pid(pid_file)
+    assert second_lock is not None
+    os.close(second_lock)
@@ -0,0 +1,69 @@
+import sys
+import time
+
+import pytest
+
+from backuper.watcher import IN_Q_OVERFLOW, InotifyWatcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux-only")
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data = tmp_path / "data"
+    (data / "sub").mkdir(parents=True)
+    (data / "a.txt").write_text("a")
+    return data
+
+
+@pytest.fixture
+def watcher(data_dir):
+    watcher = InotifyWatcher(data_dir)
+    yield watcher
+    watcher.close()
+
+
+def _wait_for(watcher, expected, timeout=5):
+    collected = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        dirty, _ = watcher.drain()
+        collected |= dirty
+        if expected <= collected:
+            break
+        time.sleep(0.01)
+    return collected
+
+
+def test_reports_created_modified_and_deleted_files(watcher, data_dir):
+    (data_dir / "a.txt").write_text("changed")
+    (data_dir / "sub" / "b.txt").write_text("b")
+    (data_dir / "a.txt").unlink()
+
+    expected = {str(data_dir / "a.txt"), str(data_dir / "sub" / "b.txt")}
+    assert _wait_for(watcher, expected) == expected
+
+
+def test_watches_new_directories(watcher, data_dir):
+    (data_dir / "new").mkdir()
+    time.sleep(0.1)
+    (data_dir / "new" / "c.txt").write_text("c")
+
+    assert str(data_dir / "new" / "c.txt") in _wait_for(watcher, {str(data_dir / "new" / "c.txt")})
+
+
+def test_reports_directory_moved_out_of_tree(watcher, data_dir, tmp_path):
+    (data_dir / "sub" / "b.txt").write_text("b")
+    _wait_for(watcher, {str(data_dir / "sub" / "b.txt")})
+
+    (data_dir / "sub").rename(tmp_path / "moved")
+    (tmp_path / "moved" / "c.txt").write_text("c")
+
+    assert _wait_for(watcher, {str(data_dir / "sub")}) == {str(data_dir / "sub")}
+
+
+def test_overflow_requests_full_scan(watcher):
+    watcher._handle_events(b"\xff\xff\xff\xff" + IN_Q_OVERFLOW.to_bytes(4, "little") + bytes(8))
+
+    assert watcher.drain() == (set(), True)
+    assert watcher.drain() == (set(), False)
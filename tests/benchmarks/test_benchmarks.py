@@ -0,0 +1,47 @@
+from benchmarks.__main__ import compare
+from benchmarks.cases import run_case
+from benchmarks.trees import TreeProfile, generate_tree
+from backuper.scanner import scan_path
+
+
+def _snapshot(tree):
+    return sorted((entry.path, entry.size, entry.mtime_ns, open(entry.path, "rb").read()) for entry in scan_path(tree))
+
+
+def test_generated_trees_are_reproducible(tmp_path):
+    profile = TreeProfile("small", 1500, 0, 64)
+    first = generate_tree(tmp_path / "a", profile, seed=1)
+    second = generate_tree(tmp_path / "b", profile, seed=1)
+
+    assert len(_snapshot(first)) == 1500
+    assert [entry[1:] for entry in _snapshot(first)] == [entry[1:] for entry in _snapshot(second)]
+    assert generate_tree(tmp_path / "a", profile, seed=1) == first
+
+
+def test_scan_case_counts_files(tmp_path):
+    tree = generate_tree(tmp_path, TreeProfile("small", 10, 100, 100))
+    result = run_case("scan", tree, tmp_path)
+
+    assert result["files"] == 10
+    assert result["bytes"] == 1000
+    assert result["peak_rss_kb"] > 0
+    assert result["rss_kb_per_million_files"] >= 0
+
+
+def test_chunk_case_reads_all_bytes(tmp_path):
+    tree = generate_tree(tmp_path, TreeProfile("small", 3, 1000, 1000))
+    result = run_case("chunk", tree, tmp_path)
+
+    assert result["bytes"] == 3000
+    assert result["mb_per_s"] > 0
+
+
+def test_compare_flags_regressions():
+    baseline = {"archive": {"mb_per_s": 100.0, "peak_rss_kb": 1000, "read_syscalls": None}}
+
+    assert compare({"archive": {"mb_per_s": 90.0, "peak_rss_kb": 1100, "read_syscalls": 5}}, baseline) == []
+    assert compare({"archive": {"mb_per_s": 50.0, "peak_rss_kb": 1000}}, baseline) == [
+        "archive: mb_per_s 100 -> 50 (+50% worse)"
+    ]
+    assert len(compare({"archive": {"mb_per_s": 100.0, "peak_rss_kb": 2000}}, baseline)) == 1
+    assert compare({"scan": {"mb_per_s": 1.0}}, baseline) == []